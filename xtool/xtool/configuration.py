@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 import json
 import logging
 import os
@@ -9,6 +10,7 @@ from environment import Environment
 from packaging import version
 
 from entities import Snapshot
+from locking import FileLock
 
 
 class PreferenceNotFoundError(Exception):
@@ -22,21 +24,71 @@ class ConfigManager:
         'instances': [],
         'versions': [],
         'snapshots': [],
+        'versionsUsage': {},
         'preferences': {
             'editor': None,
             'debug': False,
             'linkInstanceStorage': False,
+            'instanceCopyStrategy': 'auto',
+            'portRange': '8080-8199',
+            'startupStagger': 10,
+            'instancePool': {},
+            'seedInstances': False,
+            'jvmProfiles': {
+                'small': '-Xmx512m -XX:+UseSerialGC -XX:TieredStopAtLevel=1',
+                'loadtest': '-Xms4g -Xmx4g -XX:+UseG1GC -XX:+AlwaysPreTouch',
+                'profiling': ('-Xmx2g -XX:+UnlockDiagnosticVMOptions -XX:+DebugNonSafepoints '
+                              '-XX:StartFlightRecording=filename={instance}/xwiki.jfr,settings=profile')
+            },
+            'appCDS': False,
+            'monitorInterval': 5,
+            'ephemeralDir': '/dev/shm/xtool',
+            'ephemeralHeadroom': '1G',
+            'warmupUrls': {
+                'default': [
+                    '/xwiki/bin/view/Main/',
+                    '/xwiki/bin/view/Main/Search?text=xwiki',
+                    '/xwiki/bin/admin/XWiki/XWikiPreferences',
+                    '/xwiki/bin/view/Main/AllDocs',
+                    '/xwiki/bin/skin/skins/flamingo/logo.svg',
+                    '/xwiki/bin/skin/skins/flamingo/style.min.css',
+                    '/xwiki/bin/skin/resources/js/xwiki/xwiki-min.js',
+                    '/xwiki/rest/wikis/xwiki/spaces',
+                    '/xwiki/rest/wikis/query?q=xwiki'
+                ],
+                'rest': [
+                    '/xwiki/rest/',
+                    '/xwiki/rest/wikis/xwiki/spaces',
+                    '/xwiki/rest/wikis/query?q=xwiki'
+                ]
+            },
+            'warmupMaxPasses': 10,
             'snapshot-format': 'xztar',
+            'downloadWorkers': 4,
+            'extractWorkers': None,
+            'streamingInstall': False,
+            'parallelDownloads': 3,
+            'metadataCacheTTL': 600,
+            'artifactSources': ['~/.m2/repository', 'https://maven.xwiki.org/{category}'],
+            'artifactCacheDir': None,
+            'deduplicateVersions': False,
+            'versionsCacheSize': None,
+            'coldArchiveFormat': 'gztar',
             'linkableFileExtensions': ['jar', 'xar', 'vm', 'js', 'css', 'less', 'png', 'gif', 'ttf', 'ttc']
         }
     }
 
     def __init__(self):
+        # Number of nested transactions currently running
+        self.transactionDepth = 0
+        self.lock = FileLock('config', quiet=True)
+
         self.__ensureExistingFolders()
         self.__loadConfig()
 
+        # The configuration file is replaced on each save, so watch its directory rather than the file itself
         self.observer = Observer()
-        self.observer.schedule(ConfigurationUpdateHandler(self), Environment.configFilePath)
+        self.observer.schedule(ConfigurationUpdateHandler(self), Environment.configDir)
         self.observer.start()
 
     def __del__(self):
@@ -45,7 +97,8 @@ class ConfigManager:
 
     def __ensureExistingFolders(self):
         foldersToCheck = [Environment.configDir, Environment.dataDir,
-                          Environment.instancesDir, Environment.snapshotsDir]
+                          Environment.instancesDir, Environment.snapshotsDir,
+                          Environment.cacheDir]
 
         for folder in foldersToCheck:
             self.logger.debug('Checking directory {}'.format(folder))
@@ -96,14 +149,42 @@ class ConfigManager:
         for snapshot in self.config['snapshots']:
             self.snapshots.append(Snapshot(snapshot))
 
+    # Write the configuration in a temporary file first, so that readers never see a partially written file
     def __saveConfig(self):
         dumps = json.dumps(self.config, sort_keys=True, indent=4, separators=(',', ': '))
-        with open(Environment.configFilePath, 'w+') as configFile:
+        temporaryPath = '{}.{}.tmp'.format(Environment.configFilePath, os.getpid())
+        with open(temporaryPath, 'w') as configFile:
             configFile.write(dumps)
+        os.replace(temporaryPath, Environment.configFilePath)
 
     def reload(self):
-        self.logger.debug('Reloading configuration')
-        self.__loadConfig()
+        with self.lock:
+            # Reloading in the middle of a transaction would drop its pending changes
+            if self.transactionDepth == 0:
+                self.logger.debug('Reloading configuration')
+                self.__loadConfig()
+
+    """
+    Read-modify-write the configuration while holding the configuration lock, so that concurrent xtool processes
+    do not overwrite each other's changes :
+
+        with configManager.transaction():
+            configManager.instances().append(...)
+
+    The configuration is reloaded from the disk when the outermost transaction starts, and persisted when it ends.
+    """
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.transactionDepth == 0:
+                self.__loadConfig()
+            self.transactionDepth += 1
+            try:
+                yield self
+            finally:
+                self.transactionDepth -= 1
+            if self.transactionDepth == 0:
+                self.persist()
 
     def versions(self):
         return self.config['versions']
@@ -111,6 +192,10 @@ class ConfigManager:
     def instances(self):
         return self.config['instances']
 
+    # Last time each version has been used, as a timestamp
+    def versionsUsage(self):
+        return self.config['versionsUsage']
+
     def getInstance(self, instanceName):
         matchingInstances = [i for i in self.config['instances'] if i['name'] == instanceName]
         if len(matchingInstances) == 0:
@@ -155,7 +240,8 @@ class ConfigManager:
         # Sort the instances alphebetically
         self.config['instances'] = sorted(self.config['instances'], key=lambda x: x['name'])
 
-        self.__saveConfig()
+        with self.lock:
+            self.__saveConfig()
 
 
 class ConfigurationUpdateHandler(FileSystemEventHandler):
@@ -163,5 +249,13 @@ class ConfigurationUpdateHandler(FileSystemEventHandler):
         super().__init__()
         self.configManager = configManager
 
+    def __isConfigFile(self, path):
+        return os.path.abspath(path) == os.path.abspath(Environment.configFilePath)
+
     def on_modified(self, event):
-        self.configManager.reload()
+        if self.__isConfigFile(event.src_path):
+            self.configManager.reload()
+
+    def on_moved(self, event):
+        if self.__isConfigFile(event.dest_path):
+            self.configManager.reload()
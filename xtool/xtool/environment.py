@@ -8,3 +8,11 @@ class Environment:
     dataDir = '{}/.xtool/versions'.format(os.getenv("HOME"))
     instancesDir = '{}/.xtool/instances'.format(os.getenv("HOME"))
     snapshotsDir = '{}/.xtool/snapshots'.format(os.getenv("HOME"))
+    cacheDir = '{}/.xtool/cache'.format(os.getenv("HOME"))
+    coldVersionsDir = '{}/.xtool/cold-versions'.format(os.getenv("HOME"))
+    locksDir = '{}/.xtool/locks'.format(os.getenv("HOME"))
+    runDir = '{}/.xtool/run'.format(os.getenv("HOME"))
+    poolDir = '{}/.xtool/pool'.format(os.getenv("HOME"))
+    trashDir = '{}/.xtool/trash'.format(os.getenv("HOME"))
+    statsDir = '{}/.xtool/stats'.format(os.getenv("HOME"))
+    seedsDir = '{}/.xtool/seeds'.format(os.getenv("HOME"))
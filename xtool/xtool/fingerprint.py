@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+from environment import Environment
+
+# xxhash is optional, it is only used to speed up the local comparisons of files
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+class FingerprintCache:
+    """
+    Persistent cache of the digests of the local files, keyed by (device, inode, size, mtime_ns) : a file that has
+    not been modified since it was last hashed is not read again.
+    The cache is a SQLite database shared by the xtool processes, and is bounded to a number of entries, the least
+    recently used entries being evicted first.
+    Besides the hashlib algorithms, the 'fast' algorithm gives a non cryptographic digest, which is enough to
+    compare local files : it uses xxhash when available, and BLAKE2b otherwise.
+    """
+
+    logger = logging.getLogger('FingerprintCache')
+
+    maxEntries = 200000
+    # Entries are only marked as used once a day, to avoid writing the database on every lookup
+    usageResolution = 24 * 60 * 60
+    chunkSize = 16 * 1024 * 1024
+
+    instance = None
+    instanceLock = threading.Lock()
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(Environment.cacheDir, 'fingerprints.db')
+        self.local = threading.local()
+
+    # Get the cache shared by the whole process
+    @staticmethod
+    def get():
+        with FingerprintCache.instanceLock:
+            if FingerprintCache.instance is None:
+                FingerprintCache.instance = FingerprintCache()
+            return FingerprintCache.instance
+
+    # SQLite connections cannot be shared between threads
+    def __connection(self):
+        if not hasattr(self.local, 'connection'):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS fingerprints (device INTEGER, inode INTEGER, '
+                               'size INTEGER, mtime INTEGER, algorithm TEXT, digest TEXT, used INTEGER, '
+                               'PRIMARY KEY (device, inode, size, mtime, algorithm))')
+            connection.execute('CREATE INDEX IF NOT EXISTS fingerprints_used ON fingerprints (used)')
+            self.local.connection = connection
+        return self.local.connection
+
+    @staticmethod
+    def newDigest(algorithm):
+        if algorithm == 'fast':
+            return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b()
+        return hashlib.new(algorithm)
+
+    # Hash the file through a memory map, in large chunks
+    @staticmethod
+    def hashFile(path, algorithm):
+        digest = FingerprintCache.newDigest(algorithm)
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    view = memoryview(data)
+                    for offset in range(0, len(data), FingerprintCache.chunkSize):
+                        digest.update(view[offset:offset + FingerprintCache.chunkSize])
+                    view.release()
+        return digest.hexdigest()
+
+    """
+    Get the digest of the given file, from the cache if the file did not change since it was last hashed.
+    """
+    def digest(self, path, algorithm='md5'):
+        fileStat = os.stat(path)
+        key = (fileStat.st_dev, fileStat.st_ino, fileStat.st_size, fileStat.st_mtime_ns, algorithm)
+        now = int(time.time())
+        try:
+            row = self.__connection().execute(
+                'SELECT digest, used FROM fingerprints WHERE device = ? AND inode = ? AND size = ? AND mtime = ? '
+                'AND algorithm = ?', key).fetchone()
+            if row is not None:
+                if now - row[1] > self.usageResolution:
+                    self.__connection().execute(
+                        'UPDATE fingerprints SET used = ? WHERE device = ? AND inode = ? AND size = ? AND mtime = ? '
+                        'AND algorithm = ?', (now,) + key)
+                return row[0]
+        except sqlite3.Error as e:
+            # The cache is only an optimization, never fail because of it
+            self.logger.debug('Fingerprint cache unavailable : {}'.format(e))
+            return self.hashFile(path, algorithm)
+
+        digest = self.hashFile(path, algorithm)
+        try:
+            self.__connection().execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        key + (digest, now))
+            self.__trimIfNeeded()
+        except sqlite3.Error as e:
+            self.logger.debug('Failed to store the fingerprint of [{}] : {}'.format(path, e))
+        return digest
+
+    # Evict the least recently used entries once the cache grows a tenth above its bound, the size is checked on
+    # the first insertion and then every thousand insertions
+    def __trimIfNeeded(self):
+        self.local.inserts = getattr(self.local, 'inserts', 0) + 1
+        if self.local.inserts % 1000 != 1:
+            return
+        count = self.__connection().execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+        if count > self.maxEntries * 1.1:
+            self.logger.debug('Evicting {} fingerprints'.format(count - self.maxEntries))
+            self.__connection().execute(
+                'DELETE FROM fingerprints WHERE rowid IN '
+                '(SELECT rowid FROM fingerprints ORDER BY used LIMIT ?)', (count - self.maxEntries,))
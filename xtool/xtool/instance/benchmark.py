@@ -0,0 +1,209 @@
+import csv
+import datetime
+import json
+import logging
+import math
+import platform
+import statistics
+
+from utils import random_chars
+
+from instance.monitor import ResourceMonitor
+
+
+class StartupBenchmark:
+    """
+    Measure the startup of instances of several versions, with several JVM profiles.
+    Each run starts a fresh instance of the version, so that every run initializes its data the same way. Each run
+    measures the time from the spawn of the start script to the opening of the HTTP port, then to the first
+    successful HTTP response, as well as the peak resident memory of the instance.
+    The first run of each version and profile is reported on its own : it reads the version from a cold page cache,
+    and may dump an AppCDS archive, the medians and 95th percentiles being computed over the other runs.
+    Reports are written in JSON or CSV, and two reports can be compared.
+    """
+
+    logger = logging.getLogger('StartupBenchmark')
+
+    # Name of the runs that use the default JVM options
+    defaultProfile = 'default'
+
+    metrics = ['portOpen', 'ready', 'peakRss']
+    metricLabels = {'portOpen': 'Port open', 'ready': 'Ready', 'peakRss': 'Peak RSS'}
+
+    def __init__(self, configManager, versionManager, instanceManager):
+        self.configManager = configManager
+        self.versionManager = versionManager
+        self.instanceManager = instanceManager
+
+    # Nearest-rank percentile, which does not invent values when there are few runs
+    @staticmethod
+    def percentile(values, percent):
+        values = sorted(values)
+        return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+    @staticmethod
+    def summarize(runs):
+        summary = {}
+        for metric in StartupBenchmark.metrics:
+            values = [run[metric] for run in runs if run.get(metric) is not None]
+            if values:
+                summary[metric] = {'median': statistics.median(values),
+                                   'p95': StartupBenchmark.percentile(values, 95)}
+        return summary
+
+    # Start the given instance once, returns the measures of the run, None if the instance did not get ready
+    def __measure(self, instanceName, profile, timeout):
+        supervisor = self.instanceManager.launch(instanceName, detach=True, profile=profile)
+        if supervisor is None:
+            return None
+        try:
+            if supervisor.waitReady(timeout) is None:
+                return None
+            return {'portOpen': supervisor.state['portOpen'],
+                    'ready': supervisor.state['ready'],
+                    'peakRss': ResourceMonitor.readPeakRss(supervisor.process.pid)}
+        finally:
+            self.instanceManager.stop(instanceName)
+
+    def __benchmark(self, version, profile, runs, timeout):
+        measures = []
+        for i in range(runs):
+            instanceName = 'xtool-bench-{}'.format(random_chars(4))
+            if not self.instanceManager.create(instanceName, version):
+                self.logger.error('Failed to create an instance of version {}, skipping run {}'.format(version, i + 1))
+                continue
+            try:
+                measure = self.__measure(instanceName, profile, timeout)
+            finally:
+                self.instanceManager.remove(instanceName)
+            if measure is None:
+                self.logger.error('Run {} of version {} with profile {} failed'.format(
+                    i + 1, version, profile or self.defaultProfile))
+                break
+            self.logger.info('Run {}/{} of version {} with profile {} : port open after {:.2f}s, ready after '
+                             '{:.2f}s'.format(i + 1, runs, version, profile or self.defaultProfile,
+                                              measure['portOpen'], measure['ready']))
+            measures.append(measure)
+        return measures
+
+    """
+    Run the benchmark and write its report.
+    @param profiles : the names of the JVM profiles to use, the default JVM options if empty
+    @param runs : the number of runs of each version and profile, each run starting a new instance
+    @param timeout : the number of seconds after which a run that is not ready is considered failed
+    @param outputPath : the path of the report, written in CSV if it ends with .csv and in JSON otherwise
+    """
+    def run(self, versions, profiles=None, runs=3, timeout=600, outputPath=None):
+        availableProfiles = self.instanceManager.jvmProfiles.getProfiles()
+        profiles = [None if p == self.defaultProfile and p not in availableProfiles else p
+                    for p in profiles or [self.defaultProfile]]
+        unknownProfiles = [p for p in profiles if p is not None and p not in availableProfiles]
+        if unknownProfiles:
+            self.logger.error('Unknown JVM profiles : {}'.format(', '.join(unknownProfiles)))
+            return
+
+        report = {
+            'created': datetime.datetime.now().isoformat(),
+            'host': platform.node(),
+            'runs': runs,
+            'results': []
+        }
+        for version in versions:
+            self.versionManager.ensureVersion(version)
+            for profile in profiles:
+                measures = self.__benchmark(version, profile, runs, timeout)
+                report['results'].append({'version': version,
+                                          'profile': profile or self.defaultProfile,
+                                          'measures': measures,
+                                          'first': measures[0] if measures else None,
+                                          'summary': self.summarize(measures[1:])})
+
+        self.printSummary(report)
+        if outputPath is not None:
+            self.writeReport(report, outputPath)
+            self.logger.info('Report written to [{}]'.format(outputPath))
+
+    @staticmethod
+    def formatMetric(metric, value):
+        if value is None:
+            return '-'
+        elif metric == 'peakRss':
+            return '{:.0f} MiB'.format(value / (1024 * 1024))
+        return '{:.2f}s'.format(value)
+
+    def printSummary(self, report):
+        rowFormat = '{:<20}{:<12}{:>14}{:>14}{:>14}{:>14}{:>14}{:>14}{:>14}{:>14}{:>14}'
+        print(rowFormat.format('Version', 'Profile', 'Port open', '(p95)', '(first)', 'Ready', '(p95)', '(first)',
+                               'Peak RSS', '(p95)', '(first)'))
+        for result in report['results']:
+            values = []
+            for metric in self.metrics:
+                summary = result['summary'].get(metric, {})
+                values += [self.formatMetric(metric, summary.get('median')),
+                           self.formatMetric(metric, summary.get('p95')),
+                           self.formatMetric(metric, (result['first'] or {}).get(metric))]
+            print(rowFormat.format(result['version'], result['profile'], *values))
+
+    @staticmethod
+    def writeReport(report, outputPath):
+        if outputPath.endswith('.csv'):
+            with open(outputPath, 'w', newline='') as reportFile:
+                writer = csv.writer(reportFile)
+                writer.writerow(['version', 'profile', 'runs']
+                                + ['{}_{}'.format(m, s) for m in StartupBenchmark.metrics for s in ['median', 'p95']]
+                                + ['{}_first'.format(m) for m in StartupBenchmark.metrics])
+                for result in report['results']:
+                    writer.writerow([result['version'], result['profile'], len(result['measures'])]
+                                    + [result['summary'].get(m, {}).get(s)
+                                       for m in StartupBenchmark.metrics for s in ['median', 'p95']]
+                                    + [(result['first'] or {}).get(m) for m in StartupBenchmark.metrics])
+        else:
+            with open(outputPath, 'w') as reportFile:
+                json.dump(report, reportFile, indent=4)
+
+    # Read the summaries of a JSON or CSV report, as a dict (version, profile) -> summary
+    @staticmethod
+    def readSummaries(reportPath):
+        summaries = {}
+        if reportPath.endswith('.csv'):
+            with open(reportPath, 'r', newline='') as reportFile:
+                for row in csv.DictReader(reportFile):
+                    summaries[(row['version'], row['profile'])] = {
+                        m: {s: float(row['{}_{}'.format(m, s)]) for s in ['median', 'p95']}
+                        for m in StartupBenchmark.metrics if row.get('{}_median'.format(m))}
+        else:
+            with open(reportPath, 'r') as reportFile:
+                for result in json.load(reportFile)['results']:
+                    summaries[(result['version'], result['profile'])] = result['summary']
+        return summaries
+
+    """
+    Compare the medians of two reports, for the versions and profiles they have in common.
+    Two reports of a single version and profile each are compared to each other.
+    """
+    def compare(self, baseReportPath, reportPath):
+        try:
+            baseSummaries = self.readSummaries(baseReportPath)
+            summaries = self.readSummaries(reportPath)
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.error('Unable to read the reports : {}'.format(e))
+            return
+
+        pairs = [(key, key) for key in baseSummaries.keys() if key in summaries]
+        if not pairs and len(baseSummaries) == 1 and len(summaries) == 1:
+            pairs = [(list(baseSummaries.keys())[0], list(summaries.keys())[0])]
+        if not pairs:
+            self.logger.error('The reports have no version and profile in common')
+            return
+
+        rowFormat = '{:<36}{:<12}{:>14}{:>14}{:>10}'
+        print(rowFormat.format('Version / profile', 'Metric', 'Base', 'New', 'Change'))
+        for baseKey, key in pairs:
+            label = '/'.join(baseKey) if baseKey == key else '{} -> {}'.format('/'.join(baseKey), '/'.join(key))
+            for metric in self.metrics:
+                base = baseSummaries[baseKey].get(metric, {}).get('median')
+                new = summaries[key].get(metric, {}).get('median')
+                change = '{:+.1f}%'.format(100 * (new - base) / base) if base and new is not None else '-'
+                print(rowFormat.format(label, self.metricLabels[metric], self.formatMetric(metric, base),
+                                       self.formatMetric(metric, new), change))
+                label = ''
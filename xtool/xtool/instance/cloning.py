@@ -0,0 +1,143 @@
+import fcntl
+import logging
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TreeCopier:
+    """
+    Copy a directory tree with the cheapest strategy available :
+    * reflink : files are cloned with the FICLONE ioctl, sharing their blocks until either copy is modified
+      (btrfs, XFS, ...)
+    * hardlink : immutable files are hard linked while the other files are copied
+    * copy : files are copied by a pool of threads
+    The strategy is chosen once per copy, files that cannot be cloned or linked are copied.
+    The symlink strategy, which replaces the immutable files by symlinks to the source tree, is only used on demand.
+    """
+
+    logger = logging.getLogger('TreeCopier')
+
+    # From linux/fs.h
+    FICLONE = 0x40049409
+
+    strategies = ['auto', 'reflink', 'hardlink', 'copy', 'symlink']
+
+    workers = 8
+
+    # Directories holding the files written by a running instance, which are never shared whatever their extension
+    mutableDirectories = ['data', 'logs']
+
+    """
+    @param immutableExtensions : extensions of the files that are never modified in place, and can therefore be
+    shared through links
+    @param strategy : one of TreeCopier.strategies, auto picking the first one supported
+    @param manifest : the manifest of the version the tree comes from, if any ; when given, it decides which files
+    are immutable instead of their extension
+    """
+    def __init__(self, immutableExtensions=None, strategy='auto', manifest=None):
+        self.immutableExtensions = tuple('.{}'.format(e) for e in immutableExtensions or [])
+        self.strategy = strategy if strategy in self.strategies else 'auto'
+        self.manifest = manifest
+
+    # relativePath : the path of the file relative to the root of the copied tree
+    def isImmutable(self, relativePath):
+        if relativePath.split(os.sep, 1)[0] in self.mutableDirectories:
+            return False
+        if self.manifest is not None:
+            return self.manifest.isImmutable(relativePath)
+        return relativePath.endswith(self.immutableExtensions) if self.immutableExtensions else False
+
+    def __reflink(self, sourcePath, targetPath):
+        with open(sourcePath, 'rb') as source, open(targetPath, 'wb') as target:
+            fcntl.ioctl(target.fileno(), self.FICLONE, source.fileno())
+        shutil.copystat(sourcePath, targetPath)
+
+    # Create the directories of the target tree and list the files to copy, as tuples (source, target, relative path)
+    def __copyDirectories(self, sourcePath, targetPath, relativePath, directories, files):
+        os.makedirs(targetPath)
+        directories.append((sourcePath, targetPath))
+        with os.scandir(sourcePath) as entries:
+            for entry in entries:
+                # Like shutil.copytree, symlinks are followed
+                if entry.is_dir():
+                    self.__copyDirectories(entry.path, os.path.join(targetPath, entry.name),
+                                           os.path.join(relativePath, entry.name), directories, files)
+                else:
+                    files.append((entry.path, os.path.join(targetPath, entry.name),
+                                  os.path.join(relativePath, entry.name)))
+
+    # Try to clone the first file to know if the file system supports reflinks
+    def __supportsReflink(self, files):
+        if not files:
+            return False
+        sourcePath, targetPath, relativePath = files[0]
+        try:
+            self.__reflink(sourcePath, targetPath)
+            return True
+        except OSError as e:
+            self.logger.debug('Reflinks are not supported : {}'.format(e))
+            if os.path.exists(targetPath):
+                os.remove(targetPath)
+            return False
+
+    def __selectStrategy(self, sourcePath, targetPath, files):
+        if self.strategy == 'symlink':
+            return 'symlink'
+        elif self.strategy in ['auto', 'reflink'] and self.__supportsReflink(files):
+            return 'reflink'
+        elif (self.strategy in ['auto', 'hardlink']
+              and os.stat(sourcePath).st_dev == os.stat(os.path.dirname(targetPath)).st_dev):
+            return 'hardlink'
+        else:
+            return 'copy'
+
+    # Copy a single file with the given strategy, returns the strategy actually used
+    def __copyFile(self, strategy, sourcePath, targetPath, relativePath):
+        try:
+            if strategy == 'reflink':
+                self.__reflink(sourcePath, targetPath)
+                return 'reflink'
+            elif strategy == 'hardlink' and self.isImmutable(relativePath):
+                os.link(sourcePath, targetPath)
+                return 'hardlink'
+            elif strategy == 'symlink' and self.isImmutable(relativePath):
+                os.symlink(sourcePath, targetPath)
+                return 'symlink'
+        except OSError as e:
+            self.logger.debug('Falling back to a copy of [{}] : {}'.format(sourcePath, e))
+            if os.path.lexists(targetPath):
+                os.remove(targetPath)
+        shutil.copy2(sourcePath, targetPath)
+        return 'copy'
+
+    """
+    Copy the tree at sourcePath to targetPath, which should not exist yet.
+    Returns the strategy that has been used.
+    """
+    def copy(self, sourcePath, targetPath):
+        sourcePath = os.path.abspath(sourcePath)
+        targetPath = os.path.abspath(targetPath)
+        directories = []
+        files = []
+        self.__copyDirectories(sourcePath, targetPath, '', directories, files)
+
+        strategy = self.__selectStrategy(sourcePath, targetPath, files)
+        self.logger.info('Copying [{}] to [{}] using {}'.format(sourcePath, targetPath, strategy))
+
+        counts = Counter()
+        if strategy == 'reflink':
+            # The first file has already been cloned when checking for reflink support
+            counts['reflink'] += 1
+            files = files[1:]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            counts.update(executor.map(lambda f: self.__copyFile(strategy, *f), files))
+
+        # Copy the directory metadata last, as copying the files changes their modification time
+        for sourceDirectory, targetDirectory in reversed(directories):
+            shutil.copystat(sourceDirectory, targetDirectory)
+
+        self.logger.debug('{} files cloned, {} files linked, {} files copied'
+                          .format(counts['reflink'], counts['hardlink'] + counts['symlink'], counts['copy']))
+        return strategy
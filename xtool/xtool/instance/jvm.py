@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+
+from environment import Environment
+
+from instance.supervisor import InstanceSupervisor
+
+
+class JvmProfiles:
+    """
+    Named sets of JVM options, stored in the jvmProfiles preference, given to the instances through the XWIKI_OPTS
+    environment variable read by start_xwiki.sh. A profile is either attached to an instance or given when
+    starting it. In the options of a profile, {instance} is replaced by the path of the instance.
+    When the appCDS preference is enabled, the classes loaded by the first run of each version are dumped when the
+    JVM exits into an AppCDS archive (~/.xtool/cache/cds/<version>.jsa), that the next runs map instead of loading
+    and verifying the classes again. AppCDS archives require Java 13 or later.
+    Each run dumps into its own file (<version>@<instance>.dump), moved in place by the next start once the
+    instance has stopped, so that instances of the same version never write the same archive ; while a dump is
+    pending, the other instances of the version start without an archive.
+    """
+
+    logger = logging.getLogger('JvmProfiles')
+
+    # Options used by start_xwiki.sh when XWIKI_OPTS is not set
+    defaultOptions = '-Xmx1024m'
+
+    # ArchiveClassesAtExit, which dumps the archive of the application classes, appeared in Java 13
+    cdsMinimumJavaVersion = 13
+    javaVersionPattern = re.compile(r'version "(1\.)?(\d+)')
+    # Major version of each java executable, as it does not change between the starts
+    javaVersions = {}
+
+    # Seconds during which an empty dump file is considered as belonging to an instance that is still starting
+    dumpClaimTimeout = 60
+
+    def __init__(self, configManager, versionManager):
+        self.configManager = configManager
+        self.versionManager = versionManager
+
+    def getProfiles(self):
+        return self.configManager.get('jvmProfiles') or {}
+
+    def getCdsArchivePath(self, version):
+        return os.path.join(Environment.cacheDir, 'cds', '{}.jsa'.format(version))
+
+    """
+    Get the major version of the Java runtime start_xwiki.sh would use with the given environment : the one of
+    JAVA_HOME, or the first one on the PATH.
+    Returns None if it cannot be determined
+    """
+    def getJavaVersion(self, environment):
+        if environment.get('JAVA_HOME'):
+            javaPath = os.path.join(environment['JAVA_HOME'], 'bin', 'java')
+        else:
+            javaPath = shutil.which('java', path=environment.get('PATH'))
+        if javaPath is None:
+            return None
+
+        if javaPath not in self.javaVersions:
+            try:
+                output = subprocess.run([javaPath, '-version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        timeout=30).stdout.decode('utf-8', 'replace')
+                match = self.javaVersionPattern.search(output)
+                self.javaVersions[javaPath] = int(match.group(2)) if match else None
+            except (OSError, subprocess.SubprocessError) as e:
+                self.logger.debug('Failed to get the version of [{}] : {}'.format(javaPath, e))
+                self.javaVersions[javaPath] = None
+        return self.javaVersions[javaPath]
+
+    def getCdsDumpPath(self, version, instanceName):
+        return os.path.join(Environment.cacheDir, 'cds', '{}@{}.dump'.format(version, instanceName))
+
+    """
+    Move the dumps of the stopped instances of the given version in place of its archive, the latest one winning.
+    Returns True if a dump is still being written by a running instance
+    """
+    def __collectCdsDumps(self, version):
+        cdsDir = os.path.dirname(self.getCdsArchivePath(version))
+        prefix = '{}@'.format(version)
+        try:
+            dumpNames = [n for n in os.listdir(cdsDir) if n.startswith(prefix) and n.endswith('.dump')]
+        except FileNotFoundError:
+            return False
+
+        pending = False
+        for dumpName in dumpNames:
+            dumpPath = os.path.join(cdsDir, dumpName)
+            try:
+                dumpStat = os.stat(dumpPath)
+            except FileNotFoundError:
+                continue
+            if (InstanceSupervisor.readState(dumpName[len(prefix):-len('.dump')]) is not None
+                    or (dumpStat.st_size == 0 and time.time() - dumpStat.st_mtime < self.dumpClaimTimeout)):
+                pending = True
+            elif dumpStat.st_size == 0:
+                # The instance stopped without dumping its classes
+                os.remove(dumpPath)
+            else:
+                self.logger.debug('Moving the AppCDS archive dumped in [{}] in place'.format(dumpPath))
+                os.replace(dumpPath, self.getCdsArchivePath(version))
+        return pending
+
+    # Reuse the archive of the version, unless the version has been updated since the archive was dumped
+    def getCdsOptions(self, version, instanceName):
+        archivePath = self.getCdsArchivePath(version)
+        pending = self.__collectCdsDumps(version)
+        # Versions extracted before manifests existed are compared with their directory instead
+        referencePath = self.versionManager.getManifestPath(version)
+        if not os.path.isfile(referencePath):
+            referencePath = self.versionManager.getDirectoryPath(version)
+        try:
+            if os.stat(archivePath).st_mtime >= os.stat(referencePath).st_mtime:
+                return ['-XX:SharedArchiveFile={}'.format(archivePath)]
+            self.logger.debug('Discarding the outdated AppCDS archive [{}]'.format(archivePath))
+            os.remove(archivePath)
+        except OSError:
+            pass
+        if pending:
+            self.logger.info('Another instance of version {} is dumping its AppCDS archive, starting without one'
+                             .format(version))
+            return []
+
+        dumpPath = self.getCdsDumpPath(version, instanceName)
+        os.makedirs(os.path.dirname(dumpPath), exist_ok=True)
+        # Claim the dump until the instance state is written
+        open(dumpPath, 'w').close()
+        self.logger.info('The classes loaded by this run will be archived in [{}] when it stops'.format(archivePath))
+        return ['-XX:ArchiveClassesAtExit={}'.format(dumpPath)]
+
+    """
+    Get the environment to start an instance with.
+    @param profileName : the name of the profile to use, None to keep the default options of the instance
+    Returns a dict of environment variables, None if the profile does not exist
+    """
+    def getEnvironment(self, profileName, instanceName, instancePath, version):
+        environment = dict(os.environ)
+        if profileName is not None:
+            if profileName not in self.getProfiles():
+                self.logger.error('The JVM profile [{}] does not exist, available profiles : {}'
+                                  .format(profileName, ', '.join(sorted(self.getProfiles().keys()))))
+                return None
+            options = [self.getProfiles()[profileName].replace('{instance}', instancePath)]
+        else:
+            options = [environment.get('XWIKI_OPTS') or self.defaultOptions]
+
+        if self.configManager.get('appCDS'):
+            javaVersion = self.getJavaVersion(environment)
+            if javaVersion is not None and javaVersion >= self.cdsMinimumJavaVersion:
+                options += self.getCdsOptions(version, instanceName)
+            else:
+                self.logger.warning('AppCDS archives require Java {} or later ({}), starting without one'
+                                    .format(self.cdsMinimumJavaVersion,
+                                            'Java {} found'.format(javaVersion) if javaVersion else 'no Java found'))
+
+        if profileName is not None or len(options) > 1:
+            environment['XWIKI_OPTS'] = ' '.join(options)
+            self.logger.debug('XWIKI_OPTS : {}'.format(environment['XWIKI_OPTS']))
+        return environment
+
+    def list(self):
+        for name, options in sorted(self.getProfiles().items()):
+            print('{}: {}'.format(name, options))
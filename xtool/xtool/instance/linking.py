@@ -0,0 +1,124 @@
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import compute_checksum
+
+
+class InstanceLinker:
+    """
+    Replace the files of an instance that are identical to the files of its version by symlinks to the version,
+    and the other way around.
+    The instance is walked once : only the files having the same size as their counterpart in the version are
+    hashed, on a pool of threads, and the replacements are done once all the files have been compared.
+    """
+
+    logger = logging.getLogger('InstanceLinker')
+
+    workers = 8
+
+    def __init__(self, instancePath, versionPath):
+        self.instancePath = instancePath
+        self.versionPath = versionPath
+
+    # Walk the instance once, yielding its files as os.DirEntry objects
+    def __walk(self):
+        directories = [self.instancePath]
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    else:
+                        yield entry
+
+    # Whether the given tree contains a symlink, typically to the files of its version
+    @staticmethod
+    def hasSymlinks(path):
+        for root, dirs, fileNames in os.walk(path):
+            if any(os.path.islink(os.path.join(root, name)) for name in dirs + fileNames):
+                return True
+        return False
+
+    @staticmethod
+    def __isIdentical(instanceFile, versionFile):
+        return compute_checksum(instanceFile, 'fast') == compute_checksum(versionFile, 'fast')
+
+    """
+    Link the files of the instance having one of the given extensions.
+    Returns a tuple (number of linked files, number of bytes reclaimed)
+    """
+    def link(self, extensions):
+        extensions = tuple('.{}'.format(e) for e in extensions)
+        candidates = []
+        for entry in self.__walk():
+            if entry.is_file(follow_symlinks=False) and entry.name.endswith(extensions):
+                versionFile = os.path.join(self.versionPath, os.path.relpath(entry.path, self.instancePath))
+                try:
+                    instanceStat = entry.stat(follow_symlinks=False)
+                    versionStat = os.stat(versionFile)
+                except OSError:
+                    continue
+                # Files of different sizes cannot be identical, hard linked files are identical
+                if instanceStat.st_size == versionStat.st_size:
+                    sameInode = (instanceStat.st_dev, instanceStat.st_ino) == (versionStat.st_dev, versionStat.st_ino)
+                    candidates.append((entry.path, versionFile, instanceStat, sameInode))
+
+        toHash = [c for c in candidates if not c[3]]
+        self.logger.debug('{} candidate files, {} to hash'.format(len(candidates), len(toHash)))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            identical = list(executor.map(lambda c: self.__isIdentical(c[0], c[1]), toHash))
+        matches = [c for c in candidates if c[3]] + [c for c, same in zip(toHash, identical) if same]
+
+        reclaimedBytes = 0
+        for instanceFile, versionFile, instanceStat, sameInode in matches:
+            self.logger.debug('Replacing file [{}] with symlink to [{}]'.format(instanceFile, versionFile))
+            temporaryPath = '{}.xtool-link'.format(instanceFile)
+            os.symlink(versionFile, temporaryPath)
+            os.replace(temporaryPath, instanceFile)
+            if instanceStat.st_nlink == 1:
+                reclaimedBytes += instanceStat.st_size
+        return len(matches), reclaimedBytes
+
+    """
+    Give the instance its own copy of the given file if the file is shared with the version, through a symlink or a
+    hard link, so that it can be written in place without changing the version and the other instances.
+    Returns True if the file has been copied
+    """
+    @staticmethod
+    def detach(path):
+        try:
+            if not os.path.islink(path) and os.stat(path).st_nlink == 1:
+                return False
+        except OSError:
+            return False
+        InstanceLinker.logger.debug('Copying the shared file [{}]'.format(path))
+        temporaryPath = '{}.xtool-detach'.format(path)
+        shutil.copy2(os.path.realpath(path), temporaryPath)
+        os.replace(temporaryPath, path)
+        return True
+
+    def __materialize(self, link):
+        instanceFile, versionFile = link
+        temporaryPath = '{}.xtool-unlink'.format(instanceFile)
+        shutil.copy2(versionFile, temporaryPath)
+        os.replace(temporaryPath, instanceFile)
+        return os.path.getsize(instanceFile)
+
+    """
+    Replace the symlinks of the instance pointing to its version by copies of the version files.
+    Returns a tuple (number of unlinked files, number of bytes copied)
+    """
+    def unlink(self):
+        links = []
+        for entry in self.__walk():
+            if entry.is_symlink():
+                target = os.readlink(entry.path)
+                if target.startswith(self.versionPath):
+                    self.logger.debug('Undoing symlink from [{}] to [{}]'.format(entry.path, target))
+                    links.append((entry.path, target))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            copiedBytes = sum(executor.map(self.__materialize, links))
+        return len(links), copiedBytes
@@ -1,16 +1,27 @@
-import glob
 import logging
 import os
-import shutil
 import subprocess
 import time
 
 from environment import Environment
+from locking import FileLock
+from trash import Trash
 import packaging.version
 
-from utils import compute_checksum
+from utils import parse_size
 from utils import random_chars
 
+from instance.benchmark import StartupBenchmark
+from instance.cloning import TreeCopier
+from instance.jvm import JvmProfiles
+from instance.linking import InstanceLinker
+from instance.monitor import ResourceMonitor
+from instance.pool import InstancePool
+from instance.ports import PortAllocator
+from instance.seeds import DataSeeds
+from instance.supervisor import InstanceSupervisor
+from instance.warmup import WarmupCrawler
+
 
 class InstanceManager:
     logger = logging.getLogger('InstanceManager')
@@ -18,10 +29,107 @@ class InstanceManager:
     def __init__(self, configManager, versionManager):
         self.configManager = configManager
         self.versionManager = versionManager
+        self.pool = InstancePool(configManager, versionManager, self)
+        self.jvmProfiles = JvmProfiles(configManager, versionManager)
+        self.benchmark = StartupBenchmark(configManager, versionManager, self)
+        self.seeds = DataSeeds(configManager, versionManager, self)
+        versionManager.cache.isInUse = self.isVersionInUse
 
     def getInstancePath(self, instanceName):
+        # Ephemeral instances are stored outside of the instances directory
+        instance = self.configManager.getInstance(instanceName)
+        if instance is not None and instance.get('path'):
+            return instance['path']
         return os.path.abspath('{}/{}'.format(Environment.instancesDir, instanceName))
 
+    """
+    Whether the directory of the given version is needed by its instances : a running instance, or an instance or
+    pooled instance whose files are symlinked to the version, would lose its files if the version were packed.
+    """
+    def isVersionInUse(self, version):
+        instances = [i for i in self.configManager.instances() if i['version'] == version]
+        if any(InstanceSupervisor.readState(i['name']) is not None for i in instances):
+            return True
+
+        instancePaths = [self.getInstancePath(i['name']) for i in instances]
+        poolPath = self.pool.getVersionPath(version)
+        if os.path.isdir(poolPath):
+            instancePaths += [os.path.join(poolPath, entry) for entry in os.listdir(poolPath)]
+        return any(InstanceLinker.hasSymlinks(path) for path in instancePaths)
+
+    def getEphemeralPath(self, instanceName):
+        return os.path.abspath('{}/{}'.format(self.configManager.get('ephemeralDir') or '/dev/shm/xtool',
+                                              instanceName))
+
+    # Check that the memory file system can hold a new instance of the given version, along with the data the
+    # instance will write
+    def __hasEphemeralSpace(self, version, instancePath):
+        manifest = self.versionManager.getManifest(version)
+        if manifest is not None:
+            # Only the mutable files are copied, the other files are symlinked to the version
+            requiredBytes = sum(size for path, (size, crc) in manifest.files.items() if not manifest.isImmutable(path))
+        else:
+            requiredBytes = self.versionManager.cache.getSize(version)
+        requiredBytes += parse_size(self.configManager.get('ephemeralHeadroom')) or 0
+
+        fileSystemStat = os.statvfs(os.path.dirname(instancePath))
+        availableBytes = fileSystemStat.f_bavail * fileSystemStat.f_frsize
+        # Files on tmpfs are kept in memory, the file system may be larger than the available memory
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    availableBytes = min(availableBytes, int(line.split()[1]) * 1024)
+
+        if availableBytes < requiredBytes:
+            self.logger.error('Not enough memory for an ephemeral instance of version {} : {:.0f} MiB needed, {:.0f} '
+                              'MiB available'.format(version, requiredBytes / (1024 * 1024),
+                                                     availableBytes / (1024 * 1024)))
+            return False
+        return True
+
+    # Whether the xtool process that created the given ephemeral instance is still running
+    @staticmethod
+    def __isOwnerAlive(instance):
+        if not instance.get('owner'):
+            return False
+        try:
+            os.kill(instance['owner'], 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    # Collect the ephemeral instances left behind by xtool processes that did not clean them up, for instance because
+    # they were killed : instances whose files are gone, for instance because the machine restarted, are forgotten,
+    # and instances that are not running anymore are removed
+    def __collectEphemeralInstances(self):
+        with self.configManager.transaction():
+            lostInstances = [i['name'] for i in self.configManager.instances()
+                             if i.get('ephemeral') and not os.path.isdir(i['path'])]
+            if lostInstances:
+                self.logger.info('Forgetting the lost ephemeral instances {}'.format(', '.join(lostInstances)))
+                self.configManager.instances()[:] = [i for i in self.configManager.instances()
+                                                     if i['name'] not in lostInstances]
+
+        orphanInstances = [i['name'] for i in self.configManager.instances()
+                           if i.get('ephemeral') and not self.__isOwnerAlive(i)
+                           and InstanceSupervisor.readState(i['name']) is None]
+        for instanceName in orphanInstances:
+            self.logger.info('Removing the orphan ephemeral instance [{}]'.format(instanceName))
+            self.remove(instanceName)
+
+    # Get the engine used to copy versions and instances
+    # version : the version the copied tree comes from, its manifest tells which files can be shared
+    def getCopier(self, version=None, strategy=None):
+        return TreeCopier(self.configManager.get('linkableFileExtensions'),
+                          strategy or self.configManager.get('instanceCopyStrategy') or 'auto',
+                          self.versionManager.getManifest(version) if version is not None else None)
+
+    # Get the lock serializing the changes made to the given instance between xtool processes
+    def getLock(self, instanceName):
+        return FileLock('instance-{}'.format(instanceName))
+
     def list(self):
         # Sort the instances by version
         sortedInstances = sorted(self.configManager.instances(), key=lambda x: packaging.version.parse(x['version']))
@@ -34,38 +142,23 @@ class InstanceManager:
 
     def linkInstanceToVersion(self, instanceName, instancePath, versionPath):
         self.logger.info('Symlinking the instance [{}]'.format(instanceName))
-        # Go through each file that is present in the instancePath and that has a linkable extension ;
-        # Check if an equivalent exists in the versionPath.
-        # If an equivalent exists and has the same md5sum, remove the jar from the instance and replace it with a
-        # symlink to the version
-        for linkableFileExtension in self.configManager.get('linkableFileExtensions'):
-            for file in glob.glob('{}/**/*.{}'.format(instancePath, linkableFileExtension), recursive=True):
-                if not os.path.isdir(file):
-                    # Compute the file absolute
-                    absoluteFilePath = os.path.abspath(file)
-                    relativeFilePath = absoluteFilePath[len(instancePath)+1:]
-                    versionFilePath = '{}/{}'.format(versionPath, relativeFilePath)
-
-                    if (os.path.exists(versionFilePath)
-                            and (compute_checksum(absoluteFilePath) == compute_checksum(versionFilePath))):
-                        # Replace the file
-                        self.logger.debug('Replacing file [{}] with symlink to [{}]'
-                                          .format(absoluteFilePath, versionFilePath))
-                        os.remove(absoluteFilePath)
-                        os.symlink(versionFilePath, absoluteFilePath)
+        # Replace the files of the instance having a linkable extension and identical to the corresponding file of
+        # the version by a symlink to the version
+        linkedFiles, reclaimedBytes = InstanceLinker(instancePath, versionPath).link(
+            self.configManager.get('linkableFileExtensions'))
+        self.logger.info('{} files linked, {:.1f} MiB reclaimed'.format(linkedFiles, reclaimedBytes / (1024 * 1024)))
 
     def unlinkInstanceFromVersion(self, instanceName, instancePath, versionPath):
         self.logger.info('Unlinking the instance [{}] from its version [{}]'.format(instanceName, versionPath))
-
-        for file in glob.glob('{}/**/*.*'.format(instancePath), recursive=True):
-            if (os.path.islink(file) and os.readlink(file).startswith(versionPath)):
-                versionFile = os.readlink(file)
-                # Undo the link
-                self.logger.debug('Undoing symlink from [{}] to [{}]'.format(file, versionFile))
-                os.remove(file)
-                shutil.copy2(versionFile, file, follow_symlinks=True)
+        unlinkedFiles, copiedBytes = InstanceLinker(instancePath, versionPath).unlink()
+        self.logger.info('{} files unlinked, {:.1f} MiB copied'.format(unlinkedFiles, copiedBytes / (1024 * 1024)))
 
     def symlink(self, instanceName, undo=False):
+        with self.getLock(instanceName):
+            self.__symlink(instanceName, undo)
+
+    def __symlink(self, instanceName, undo):
+        self.configManager.reload()
         instance = self.configManager.getInstance(instanceName)
         if (instance is None):
             self.logger.error('The instance with name [{}] does not exist.', instanceName)
@@ -82,28 +175,78 @@ class InstanceManager:
                                                self.versionManager.getDirectoryPath(instance['version']))
                 self.logger.info('The instance with name [{}] has been unlinked'.format(instanceName))
 
-    def create(self, instanceName, version):
+    # ephemeral : whether to create the instance in a memory file system (ephemeralDir), rather than on the disk
+    # seeded : whether to copy the data directory seeded for the version, see DataSeeds ; by default, the
+    # seedInstances preference decides
+    # Returns True if the instance has been created
+    def create(self, instanceName, version, ephemeral=False, seeded=None):
+        with self.getLock(instanceName):
+            return self.__create(instanceName, version, ephemeral,
+                                 seeded if seeded is not None else self.configManager.get('seedInstances'))
+
+    def __create(self, instanceName, version, ephemeral=False, seeded=False):
+        # Another process may have changed the instances while we were waiting for the lock
+        self.configManager.reload()
+
         # Check if the name is not already taken
         if instanceName in [instance['name'] for instance in self.configManager.instances()]:
             self.logger.error('An instance with name [{}] already exists. Aborting.'.format(instanceName))
-            return
+            return False
 
         # First, check if we have the corresponding version
         self.versionManager.ensureVersion(version)
 
         # Now we are sure to have a version available.
         # Get the file and unzip it
-        instancePath = self.getInstancePath(instanceName)
-        versionPath = self.versionManager.getDirectoryPath(version)
-        shutil.copytree(versionPath, instancePath)
-        if self.configManager.get('linkInstanceStorage'):
-            self.linkInstanceToVersion(instanceName, instancePath, versionPath)
+        instance = {'name': instanceName, 'version': version}
+        if ephemeral:
+            instancePath = self.getEphemeralPath(instanceName)
+            os.makedirs(os.path.dirname(instancePath), exist_ok=True)
+            if not self.__hasEphemeralSpace(version, instancePath):
+                return False
+            # Keep the immutable files of the version on the disk, whatever the configuration
+            self.getCopier(version, 'symlink').copy(self.versionManager.getDirectoryPath(version), instancePath)
+            # The process owning the instance removes it once it is stopped
+            instance.update({'path': instancePath, 'ephemeral': True, 'owner': os.getpid()})
+        else:
+            instancePath = self.getInstancePath(instanceName)
+            self.copyVersion(version, instancePath)
+
+        if seeded:
+            self.seeds.apply(version, instancePath)
 
         # Update the configuration to record the new instance
-        self.configManager.instances().append({'name': instanceName, 'version': version})
-        self.configManager.persist()
+        with self.configManager.transaction():
+            self.configManager.instances().append(instance)
+            self.versionManager.touch(version)
 
         self.logger.info('Instance {} created in {}'.format(instanceName, instancePath))
+        return True
+
+    # Copy the files of the given version to a new instance directory
+    def copyVersion(self, version, instancePath):
+        versionPath = self.versionManager.getDirectoryPath(version)
+        if self.configManager.get('linkInstanceStorage'):
+            # Symlink the immutable files of the version right away, only the mutable files are copied
+            self.logger.info('Symlinking the instance [{}]'.format(os.path.basename(instancePath)))
+            self.getCopier(version, 'symlink').copy(versionPath, instancePath)
+        else:
+            self.getCopier(version).copy(versionPath, instancePath)
+
+    # Create a new instance of the given version, taking it from the pool of the version if possible
+    # Returns the name of the instance
+    # Returns the name of the instance, None if it could not be created
+    def __createFromVersion(self, version):
+        self.versionManager.ensureVersion(version)
+        instanceName = self.pool.take(version)
+        if instanceName is not None:
+            # Replace the pooled instance in the background
+            self.pool.fillInBackground([version])
+        else:
+            instanceName = 'xtool-{}'.format(random_chars(4))
+            if not self.create(instanceName, version):
+                return None
+        return instanceName
 
     def edit(self, instanceName, fileName):
         # Try first to determine the editor that we will have to use
@@ -118,9 +261,18 @@ class InstanceManager:
                 editor = "editor"
 
         instancePath = self.getInstancePath(instanceName)
-        subprocess.call([editor, '{}/webapps/xwiki/WEB-INF/{}'.format(instancePath, fileName)])
+        filePath = '{}/webapps/xwiki/WEB-INF/{}'.format(instancePath, fileName)
+        # Editors may write the file in place, which would also change the version if the file were shared
+        InstanceLinker.detach(filePath)
+        subprocess.call([editor, filePath])
 
     def copy(self, instanceName, newInstanceName):
+        with self.getLock(instanceName), self.getLock(newInstanceName):
+            self.__copy(instanceName, newInstanceName)
+
+    def __copy(self, instanceName, newInstanceName):
+        self.configManager.reload()
+
         # Verify that the instance exists
         matchingInstances = [i for i in self.configManager.instances() if i['name'] == instanceName]
 
@@ -132,73 +284,230 @@ class InstanceManager:
             if len(matchingNewInstances) == 0:
                 self.logger.info('Creating copy of [{}] with name [{}] ...'
                                  .format(instanceName, newInstanceName))
-                shutil.copytree(self.getInstancePath(instanceName),
-                                self.getInstancePath(newInstanceName))
+                self.getCopier().copy(self.getInstancePath(instanceName),
+                                      self.getInstancePath(newInstanceName))
 
-                self.configManager.instances().append(
-                    {'name': newInstanceName, 'version': matchingInstances[0]['version']})
-                self.configManager.persist()
+                with self.configManager.transaction():
+                    self.configManager.instances().append(
+                        {'name': newInstanceName, 'version': matchingInstances[0]['version']})
             else:
                 self.logger.error('An instance with name [{}] already exists'.fomat(newInstanceName))
         else:
             self.logger.error('The instance name [{}] is invalid'.format(instanceName))
 
-    def __startInstance(self, instanceName, port=None, debug=False):
-        startScript = 'start_xwiki_debug.sh' if debug else 'start_xwiki.sh'
+    # Attach a JVM profile to the given instance, or detach its profile if None is given
+    def setProfile(self, instanceName, profileName=None):
+        with self.getLock(instanceName), self.configManager.transaction():
+            instance = self.configManager.getInstance(instanceName)
+            if instance is None:
+                self.logger.error('The instance with name [{}] does not exist.'.format(instanceName))
+            elif profileName is None:
+                instance.pop('profile', None)
+                self.logger.info('The instance [{}] now uses the default JVM options'.format(instanceName))
+            elif profileName not in self.jvmProfiles.getProfiles():
+                self.logger.error('The JVM profile [{}] does not exist'.format(profileName))
+            else:
+                instance['profile'] = profileName
+                self.logger.info('The instance [{}] now uses the JVM profile [{}]'.format(instanceName, profileName))
 
+    def showProfile(self, instanceName):
+        instance = self.configManager.getInstance(instanceName)
+        if instance is None:
+            self.logger.error('The instance with name [{}] does not exist.'.format(instanceName))
+        else:
+            print(instance.get('profile') or 'default')
+
+    def getPortAllocator(self):
+        return PortAllocator(self.configManager.get('portRange'))
+
+    # Launch the given instance with ports from the configured range, unless a port is given
+    # profile : the JVM profile to use instead of the one attached to the instance
+    # Returns the supervisor of the instance, None if it could not be started
+    def launch(self, instanceName, port=None, debug=False, detach=False, profile=None):
         # Check if the instance exists
         instancePath = self.getInstancePath(instanceName)
-        if os.path.isdir(instancePath):
-            processArgs = ['{}/./{}'.format(instancePath, startScript)]
-            if port is not None:
-                processArgs.append('-p')
-                processArgs.append(port)
-
-            with subprocess.Popen(processArgs) as instanceProcess:
-                try:
-                    while instanceProcess.poll() is None:
-                        time.sleep(5)
-                    self.logger.debug('Instance has terminated by itself with return code : [{}]'
-                                      .format(instanceProcess.poll()))
-                except KeyboardInterrupt as interrupt:
-                    self.logger.debug('Interrupt [{}] recieved, terminating the instance ...'.format(interrupt))
-                    instanceProcess.terminate()
-                    try:
-                        # Give 10 seconds for the instance to stop, else, kill it
-                        instanceProcess.wait(10)
-                    except subprocess.TimeoutExpired:
-                        self.logger.debug('Failed to terminate within 10 seconds, killing the instance ...')
-                        instanceProcess.kill()
-
-                    returnCode = instanceProcess.poll()
-                    if returnCode is None:
-                        self.logger.error('Failed to kill the instance.')
-                    else:
-                        self.logger.debug('Instance return code : [{}]'.format(returnCode))
-        else:
+        instance = self.configManager.getInstance(instanceName)
+        if instance is None or not os.path.isdir(instancePath):
             self.logger.error('The instance [{}] folder does not exists.'.format(instanceName))
+        elif InstanceSupervisor.readState(instanceName) is not None:
+            self.logger.error('The instance [{}] is already running, see `x status`.'.format(instanceName))
+        else:
+            environment = self.jvmProfiles.getEnvironment(profile or instance.get('profile'), instanceName,
+                                                          instancePath, instance['version'])
+            if environment is None:
+                return None
+            ports = self.getPortAllocator().allocate(instanceName, port, debug)
+            if ports is not None:
+                supervisor = InstanceSupervisor(instanceName, instancePath)
+                supervisor.launch(ports, debug, detach, environment,
+                                  float(self.configManager.get('monitorInterval') or 0))
+                return supervisor
+        return None
+
+    # Get the crawler warming up the instance running on the given port with the given list of URLs
+    # Returns None if the list of URLs does not exist
+    def getWarmupCrawler(self, port, urlsName='default'):
+        urls = self.configManager.get('warmupUrls') or {}
+        if urlsName not in urls:
+            self.logger.error('The list of warm up URLs [{}] does not exist, available lists : {}'
+                              .format(urlsName, ', '.join(sorted(urls.keys()))))
+            return None
+        return WarmupCrawler(port, urls[urlsName], int(self.configManager.get('warmupMaxPasses') or 10))
+
+    def warmup(self, instanceName, urlsName='default'):
+        state = InstanceSupervisor.readState(instanceName)
+        if state is None:
+            self.logger.error('The instance [{}] is not running, see `x status`.'.format(instanceName))
+        elif state['ready'] is None and not InstanceSupervisor.probe(state['port']):
+            self.logger.error('The instance [{}] is not ready yet.'.format(instanceName))
+        else:
+            crawler = self.getWarmupCrawler(state['port'], urlsName)
+            if crawler is not None:
+                crawler.run()
+
+    # warmup : the name of the list of URLs to warm the instance up with once it is ready
+    def __startInstance(self, instanceName, port=None, debug=False, detach=False, waitReady=False, timeout=None,
+                        profile=None, warmup=None):
+        # Check the list of URLs before starting the instance
+        if warmup is not None and self.getWarmupCrawler(None, warmup) is None:
+            return
+        supervisor = self.launch(instanceName, port, debug, detach or waitReady, profile)
+        if supervisor is not None:
+            if waitReady or (detach and warmup is not None):
+                if supervisor.waitReady(timeout) is not None and warmup is not None:
+                    self.getWarmupCrawler(supervisor.state['port'], warmup).run()
+            elif not detach:
+                onReady = None
+                if warmup is not None:
+                    onReady = self.getWarmupCrawler(supervisor.state['port'], warmup).run
+                supervisor.supervise(onReady)
+                self.getPortAllocator().release(instanceName)
+
+    # Start an attached temporary instance, and remove it once it is stopped, including when xtool is interrupted
+    # or terminated
+    def __startTemporaryInstance(self, instanceName, port, debug, profile, warmup):
+        try:
+            with InstanceSupervisor.interruptOnTermination():
+                self.__startInstance(instanceName, port, debug, profile=profile, warmup=warmup)
+        except KeyboardInterrupt as interrupt:
+            self.logger.debug('Interrupt [{}] recieved, removing the temporary instance ...'.format(interrupt))
+        finally:
+            if InstanceSupervisor.readState(instanceName) is not None:
+                self.stop(instanceName)
+            self.remove(instanceName)
+
+    # detach : return once the instance is started, leaving it running in the background
+    # waitReady : detach once the instance answers on its port, or after the given timeout (in seconds)
+    # profile : the name of the JVM profile to start the instance with
+    # ephemeral : start a temporary instance stored in a memory file system
+    # warmup : the name of the list of URLs to warm the instance up with, see WarmupCrawler
+    def start(self, entityName, port=None, debug=False, temp=False, detach=False, waitReady=False, timeout=None,
+              profile=None, ephemeral=False, warmup=None):
+        # Ephemeral instances are always temporary
+        temp = temp or ephemeral
 
-    def start(self, entityName, port=None, debug=False, temp=False):
         # In case debug mode is forced by the config, force it
         debug = debug or self.configManager.get('debug')
         self.logger.debug('Instance debug mode : [{}]'.format(debug))
 
         # Check if the instance name exists
-        if entityName in [i['name'] for i in self.configManager.instances()]:
-            self.__startInstance(entityName, port, debug)
+        instance = self.configManager.getInstance(entityName)
+        if instance is not None and ephemeral:
+            self.logger.error('Only new instances of a version can be ephemeral')
+        elif instance is not None:
+            # The version may have been moved to the cold tier while the instance is linked to it
+            self.versionManager.ensureVersion(instance['version'])
+            self.versionManager.touch(instance['version'])
+            self.__startInstance(entityName, port, debug, detach, waitReady, timeout, profile, warmup)
         else:
             # Check that the entityName is a version
-            if entityName in self.configManager.versions():
-                # Generate a temporary instance id
+            if temp and (detach or waitReady):
+                self.logger.error('A temporary instance cannot be detached, as it is removed once it is stopped')
+            elif entityName in self.configManager.versions() and ephemeral:
+                self.__collectEphemeralInstances()
                 instanceName = 'xtool-{}'.format(random_chars(4))
-                self.create(instanceName, entityName)
-                self.__startInstance(instanceName, port, debug)
-                if temp:
-                    self.remove(instanceName)
+                if self.create(instanceName, entityName, ephemeral=True):
+                    self.__startTemporaryInstance(instanceName, port, debug, profile, warmup)
+            elif entityName in self.configManager.versions():
+                # Generate a temporary instance id
+                instanceName = self.__createFromVersion(entityName)
+                if instanceName is None:
+                    self.logger.error('Failed to create an instance of version {}'.format(entityName))
+                elif temp:
+                    self.__startTemporaryInstance(instanceName, port, debug, profile, warmup)
+                else:
+                    self.__startInstance(instanceName, port, debug, detach, waitReady, timeout, profile, warmup)
+            else:
+                self.logger.error('The entity name [{}] is invalid'.format(entityName))
+
+    """
+    Start several instances in the background, the startup of each instance being delayed until the previous one
+    is ready or for at most startupStagger seconds, so that they do not all initialize at the same time.
+    @param entityNames : names of instances, or of versions from which new instances are created
+    @param count : the number of instances to create for each version
+    """
+    def startAll(self, entityNames, count=1, debug=False, waitReady=False, timeout=None, profile=None):
+        debug = debug or self.configManager.get('debug')
+
+        instanceNames = []
+        for entityName in entityNames:
+            instance = self.configManager.getInstance(entityName)
+            if instance is not None:
+                self.versionManager.ensureVersion(instance['version'])
+                self.versionManager.touch(instance['version'])
+                instanceNames.append(entityName)
+            elif entityName in self.configManager.versions():
+                for i in range(count):
+                    instanceName = self.__createFromVersion(entityName)
+                    if instanceName is None:
+                        self.logger.error('Failed to create an instance of version {}'.format(entityName))
+                    else:
+                        instanceNames.append(instanceName)
             else:
                 self.logger.error('The entity name [{}] is invalid'.format(entityName))
 
+        stagger = self.configManager.get('startupStagger') or 0
+        supervisors = []
+        for instanceName in instanceNames:
+            if supervisors and stagger:
+                supervisors[-1].waitReady(stagger, reportTimeout=False)
+            supervisor = self.launch(instanceName, debug=debug, detach=True, profile=profile)
+            if supervisor is not None:
+                supervisors.append(supervisor)
+
+        if waitReady:
+            deadline = time.time() + timeout if timeout is not None else None
+            readyInstances = [s for s in supervisors
+                              if s.waitReady(max(0, deadline - time.time()) if deadline is not None else None)
+                              is not None]
+            self.logger.info('{} out of {} instances ready'.format(len(readyInstances), len(instanceNames)))
+        else:
+            self.logger.info('{} out of {} instances started, see `x status`'
+                             .format(len(supervisors), len(instanceNames)))
+
+    # Returns True if the instance is not running anymore, see InstanceSupervisor.stop
+    def stop(self, instanceName, force=True, timeout=None):
+        if InstanceSupervisor.stop(instanceName, force, timeout):
+            self.getPortAllocator().release(instanceName)
+            return True
+        return False
+
+    def status(self, instanceName=None):
+        InstanceSupervisor.status(instanceName)
+
+    def stats(self, instanceName):
+        if self.configManager.getInstance(instanceName) is None:
+            self.logger.error('The instance with name [{}] does not exist.'.format(instanceName))
+        else:
+            ResourceMonitor(instanceName).summary()
+
     def remove(self, instanceName):
+        with self.getLock(instanceName):
+            self.__remove(instanceName)
+
+    def __remove(self, instanceName):
+        self.configManager.reload()
+
         # Get the corresponding instance dict in the structures.
         instanceStruct = None
         for instance in self.configManager.instances():
@@ -208,8 +517,11 @@ class InstanceManager:
         # Let's first check if we indeed have an instance with that name
         if instanceStruct is not None:
             self.logger.info('Removing instance {} ...'.format(instanceName))
-            shutil.rmtree(self.getInstancePath(instanceName))
-            self.configManager.instances().remove(instanceStruct)
-            self.configManager.persist()
+            Trash.discard(self.getInstancePath(instanceName))
+            if os.path.exists(ResourceMonitor.getStatsPath(instanceName)):
+                os.remove(ResourceMonitor.getStatsPath(instanceName))
+            with self.configManager.transaction():
+                self.configManager.instances()[:] = [i for i in self.configManager.instances()
+                                                     if i['name'] != instanceName]
         else:
             self.logger.error('No instance exists with the name [{}]. Skipping.'.format(instanceName))
@@ -0,0 +1,196 @@
+import datetime
+import logging
+import os
+import struct
+import subprocess
+import sys
+import threading
+
+from environment import Environment
+from utils import format_size
+
+
+class ResourceMonitor:
+    """
+    Sample the resources used by the process tree of a running instance (the start script, the JVM and their
+    children) from /proc, and record the samples in a time series file, ~/.xtool/stats/<instance>.stats, which is
+    overwritten each time the instance is started.
+    Each sample is a fixed size record giving the time, the resident memory, the CPU time, the number of threads
+    and of open file descriptors, and the number of bytes read from and written to the storage.
+    """
+
+    logger = logging.getLogger('ResourceMonitor')
+
+    fields = ['time', 'rss', 'cpu', 'threads', 'fds', 'read', 'write']
+    record = struct.Struct('<dQdIIQQ')
+
+    clockTicks = os.sysconf('SC_CLK_TCK')
+    pageSize = os.sysconf('SC_PAGE_SIZE')
+
+    def __init__(self, instanceName):
+        self.instanceName = instanceName
+        self.statsPath = self.getStatsPath(instanceName)
+
+    @staticmethod
+    def getStatsPath(instanceName):
+        return os.path.join(Environment.statsDir, '{}.stats'.format(instanceName))
+
+    # Get the given process and all its descendants
+    @staticmethod
+    def getProcessTree(pid):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open('/proc/{}/stat'.format(entry), 'r') as statFile:
+                        parent = int(statFile.read().rsplit(')', 1)[1].split()[1])
+                    children.setdefault(parent, []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        tree = [pid]
+        for process in tree:
+            tree += children.get(process, [])
+        return tree
+
+    # Read the resources used by a single process, as a dict of the fields of the samples
+    # Returns None if the process does not exist anymore
+    @staticmethod
+    def readProcess(pid):
+        try:
+            with open('/proc/{}/stat'.format(pid), 'r') as statFile:
+                stat = statFile.read().rsplit(')', 1)[1].split()
+            with open('/proc/{}/statm'.format(pid), 'r') as statmFile:
+                residentPages = int(statmFile.read().split()[1])
+            usage = {
+                'state': stat[0],
+                'startTime': int(stat[19]),
+                'rss': residentPages * ResourceMonitor.pageSize,
+                'cpu': (int(stat[11]) + int(stat[12])) / ResourceMonitor.clockTicks,
+                'threads': int(stat[17]),
+                'fds': 0,
+                'read': 0,
+                'write': 0
+            }
+        except (OSError, IndexError, ValueError):
+            return None
+
+        # The file descriptors and the I/O counters are only readable by the owner of the process
+        try:
+            usage['fds'] = len(os.listdir('/proc/{}/fd'.format(pid)))
+            with open('/proc/{}/io'.format(pid), 'r') as ioFile:
+                counters = dict(line.split(': ') for line in ioFile.read().splitlines())
+            usage['read'] = int(counters['read_bytes'])
+            usage['write'] = int(counters['write_bytes'])
+        except (OSError, KeyError, ValueError):
+            pass
+        return usage
+
+    # Get the highest resident memory reached by the process tree of the given process, in bytes, as recorded by
+    # the kernel (VmHWM) rather than sampled
+    @staticmethod
+    def readPeakRss(pid):
+        peakRss = 0
+        for process in ResourceMonitor.getProcessTree(pid):
+            try:
+                with open('/proc/{}/status'.format(process), 'r') as statusFile:
+                    for line in statusFile:
+                        if line.startswith('VmHWM:'):
+                            peakRss += int(line.split()[1]) * 1024
+            except (OSError, IndexError, ValueError):
+                continue
+        return peakRss
+
+    """
+    Take a sample of the resources used by the process tree of the given process.
+    @param startTime : the start time of the process, to tell it apart from a process that reused its PID
+    Returns a tuple of the values of ResourceMonitor.fields, None if the process is not running anymore
+    """
+    def sample(self, pid, startTime=None):
+        root = self.readProcess(pid)
+        if root is None or root['state'] == 'Z' or (startTime is not None and root['startTime'] != startTime):
+            return None
+
+        total = dict.fromkeys(self.fields[1:], 0)
+        for process in [root] + [self.readProcess(p) for p in self.getProcessTree(pid)[1:]]:
+            if process is not None:
+                for field in total.keys():
+                    total[field] += process[field]
+        return (datetime.datetime.now().timestamp(),) + tuple(total[f] for f in self.fields[1:])
+
+    """
+    Sample the process tree of the given process every interval seconds, until the process exits.
+    @param stopped : an event telling that the process has exited, if the caller already waits for it
+    """
+    def run(self, pid, interval, stopped=None):
+        os.makedirs(Environment.statsDir, exist_ok=True)
+        stopped = stopped or threading.Event()
+        root = self.readProcess(pid)
+        startTime = root['startTime'] if root is not None else None
+        with open(self.statsPath, 'wb', buffering=0) as statsFile:
+            while not stopped.is_set():
+                sample = self.sample(pid, startTime)
+                if sample is None:
+                    break
+                statsFile.write(self.record.pack(*sample))
+                stopped.wait(interval)
+        self.logger.debug('Stopped sampling instance [{}]'.format(self.instanceName))
+
+    # Sample the given process from a separate process, that keeps running once xtool exits
+    def runInBackground(self, pid, interval):
+        xtoolPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.Popen([sys.executable, '-m', 'instance.monitor', self.instanceName, str(pid), str(interval)],
+                         cwd=xtoolPath, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+
+    # Get the recorded samples, as dicts of the sampled fields
+    def readSamples(self):
+        try:
+            with open(self.statsPath, 'rb') as statsFile:
+                content = statsFile.read()
+        except OSError:
+            return []
+        # Ignore a record being written
+        content = content[:len(content) - len(content) % self.record.size]
+        return [dict(zip(self.fields, values)) for values in self.record.iter_unpack(content)]
+
+    # Show the last, peak and average values of the samples of the last run of the instance
+    def summary(self):
+        samples = self.readSamples()
+        if not samples:
+            print('No resource usage recorded for instance [{}]'.format(self.instanceName))
+            return
+
+        # The CPU usage and the I/O rates are computed between consecutive samples
+        rates = []
+        for previous, current in zip(samples, samples[1:]):
+            elapsed = current['time'] - previous['time'] or 1
+            rates.append({'cpu': 100 * (current['cpu'] - previous['cpu']) / elapsed,
+                          'read': (current['read'] - previous['read']) / elapsed,
+                          'write': (current['write'] - previous['write']) / elapsed})
+
+        duration = samples[-1]['time'] - samples[0]['time']
+        print('Instance [{}] : {} samples over {:.0f}s, since {}'.format(
+            self.instanceName, len(samples), duration,
+            datetime.datetime.fromtimestamp(samples[0]['time']).__format__('%a %d %b %Y - %H:%M')))
+
+        rowFormat = '{:<16}{:>14}{:>14}{:>14}'
+        print(rowFormat.format('', 'Last', 'Peak', 'Average'))
+
+        def printRow(label, values, formatter):
+            print(rowFormat.format(label, formatter(values[-1]), formatter(max(values)),
+                                   formatter(sum(values) / len(values))))
+
+        printRow('Memory (RSS)', [s['rss'] for s in samples], format_size)
+        printRow('Threads', [s['threads'] for s in samples], lambda v: '{:.0f}'.format(v))
+        printRow('Open files', [s['fds'] for s in samples], lambda v: '{:.0f}'.format(v))
+        if rates:
+            printRow('CPU', [r['cpu'] for r in rates], lambda v: '{:.1f}%'.format(v))
+            printRow('Disk read', [r['read'] for r in rates], lambda v: '{}/s'.format(format_size(v)))
+            printRow('Disk write', [r['write'] for r in rates], lambda v: '{}/s'.format(format_size(v)))
+        print('CPU time : {:.1f}s, read : {}, written : {}'.format(
+            samples[-1]['cpu'], format_size(samples[-1]['read'] - samples[0]['read']),
+            format_size(samples[-1]['write'] - samples[0]['write'])))
+
+
+if __name__ == '__main__':
+    ResourceMonitor(sys.argv[1]).run(int(sys.argv[2]), float(sys.argv[3]))
@@ -20,14 +20,20 @@ class InstanceParser(Parser):
         createParser = subParsers.add_parser('create', aliases=['c'], help='create a new instance')
         createParser.add_argument('instance_name', help='the name of the instance to create')
         createParser.add_argument('version', help='the XWiki version to use in the instance')
+        createParser.add_argument(
+            '--seeded',
+            action='store_true',
+            default=None,
+            help='copy the data directory seeded for the version (see `x version seed`) into the instance'
+        )
 
         # Start action
         startParser = subParsers.add_parser('start', aliases=['s'], help='start an instance')
         startParser.add_argument(
             'entity_name',
-            nargs='?',
-            default=None,
-            help='the name of the instance or version (if --temp) to start'
+            nargs='*',
+            help=('the names of the instances or versions to start, several instances are started concurrently '
+                  'in the background')
         )
         startParser.add_argument('-d', '--debug', action='store_true', help='toggle debug mode')
         startParser.add_argument(
@@ -40,6 +46,96 @@ class InstanceParser(Parser):
             help=('start a temporary instance: xtool will create a random instance name with '
                   'the given version and start it. The instance will be removed automatically after being killed.')
         )
+        startParser.add_argument(
+            '--ephemeral', '--ram',
+            action='store_true',
+            help=('start a temporary instance stored in memory (see the ephemeralDir preference), '
+                  'which is removed once it is stopped')
+        )
+        startParser.add_argument(
+            '--detach',
+            action='store_true',
+            help='start the instance in the background, use `x stop` to stop it'
+        )
+        startParser.add_argument(
+            '-w', '--wait-ready',
+            action='store_true',
+            help='start the instance in the background and return as soon as it answers on its port'
+        )
+        startParser.add_argument(
+            '-n', '--count',
+            type=int,
+            default=1,
+            help='the number of instances to create and start for each given version'
+        )
+        startParser.add_argument(
+            '--profile',
+            help='the JVM profile to start the instance with, instead of the profile attached to the instance'
+        )
+        startParser.add_argument(
+            '--warmup',
+            nargs='?',
+            const='default',
+            metavar='URLS',
+            help=('once the instance is ready, request the given list of URLs from the warmupUrls preference until '
+                  'their latency settles, default by default')
+        )
+        startParser.add_argument(
+            '--timeout',
+            type=int,
+            help='the maximum number of seconds to wait for the instance to be ready, with --wait-ready'
+        )
+
+        # Stop action
+        stopParser = subParsers.add_parser('stop', help='stop an instance started in the background')
+        stopParser.add_argument('instance_name', nargs='?', default=None, help='the name of the instance to stop')
+
+        # Status action
+        statusParser = subParsers.add_parser('status', help='show the running instances')
+        statusParser.add_argument('instance_name', nargs='?', default=None, help='only show the given instance')
+
+        # Pool action
+        poolParser = subParsers.add_parser(
+            'pool',
+            help='manage the instances created in advance, from which new instances of a version are taken'
+        )
+        poolSubParsers = poolParser.add_subparsers(dest='poolAction', required=True, help='the action to perform')
+        poolFillParser = poolSubParsers.add_parser(
+            'fill',
+            help='create instances until the pool of each version is full, and recycle the outdated ones'
+        )
+        poolFillParser.add_argument('version', nargs='*', help='the versions to fill, all by default')
+        poolFillParser.add_argument('--detach', action='store_true', help='fill the pool in the background')
+        poolSubParsers.add_parser('list', aliases=['l'], help='show the pooled instances of each version')
+        poolSizeParser = poolSubParsers.add_parser('size', help='set the number of pooled instances of a version')
+        poolSizeParser.add_argument('version', help='the XWiki version to pool')
+        poolSizeParser.add_argument('size', type=int, help='the number of instances to keep, 0 to stop pooling')
+        poolClearParser = poolSubParsers.add_parser('clear', help='remove the pooled instances')
+        poolClearParser.add_argument('version', nargs='?', default=None, help='only clear the given version')
+
+        # Bench action
+        benchParser = subParsers.add_parser('bench', help='measure the startup of instances')
+        benchSubParsers = benchParser.add_subparsers(dest='benchAction', required=True, help='the action to perform')
+        benchStartupParser = benchSubParsers.add_parser(
+            'startup',
+            help=('start fresh instances of the given versions several times, and report the time to open their '
+                  'port, the time to answer a first request and their peak memory')
+        )
+        benchStartupParser.add_argument('version', nargs='+', help='the XWiki versions to benchmark')
+        benchStartupParser.add_argument(
+            '-p', '--profile',
+            action='append',
+            help='a JVM profile to benchmark, can be repeated, `default` stands for the default JVM options'
+        )
+        benchStartupParser.add_argument('-n', '--runs', type=int, default=3,
+                                        help='the number of runs of each version and profile, each on a new instance')
+        benchStartupParser.add_argument('--timeout', type=int, default=600,
+                                        help='the maximum number of seconds to wait for an instance to be ready')
+        benchStartupParser.add_argument('-o', '--output', help='the report to write, in CSV if it ends with .csv, '
+                                                               'in JSON otherwise')
+        benchCompareParser = benchSubParsers.add_parser('compare', help='compare two benchmark reports')
+        benchCompareParser.add_argument('base_report', help='the reference report')
+        benchCompareParser.add_argument('report', help='the report to compare to the reference')
 
         if not topLevel:
             # Upgrade action
@@ -78,6 +174,33 @@ class InstanceParser(Parser):
             removeParser = subParsers.add_parser('remove', aliases=['rm'], help='remove an entity')
             removeParser.add_argument('instance_name', help='the name of the instance to remove')
 
+            # Warmup action
+            warmupParser = subParsers.add_parser(
+                'warmup',
+                help='request a list of URLs from a running instance until their latency settles'
+            )
+            warmupParser.add_argument('instance_name', help='the name of the instance')
+            warmupParser.add_argument('-u', '--urls', default='default',
+                                      help='the list of URLs to request, from the warmupUrls preference')
+
+            # Stats action
+            statsParser = subParsers.add_parser(
+                'stats',
+                help='show the resources used by an instance during its last run'
+            )
+            statsParser.add_argument('instance_name', help='the name of the instance')
+
+            # Profile action
+            profileParser = subParsers.add_parser(
+                'profile',
+                help='attach a JVM profile to an instance, list the available profiles if no instance is given'
+            )
+            profileParser.add_argument('instance_name', nargs='?', default=None, help='the name of the instance')
+            profileParser.add_argument('profile', nargs='?', default=None,
+                                       help='the JVM profile to attach, show the current profile if not given')
+            profileParser.add_argument('-u', '--unset', action='store_true',
+                                       help='start the instance with the default JVM options')
+
             # Symlink action
             symlinkParser = subParsers.add_parser('symlink', aliases=['sym'], help=('symlink files in the instance to'
                                                                                     'their equivalent in the version'))
@@ -103,16 +226,53 @@ class InstanceParser(Parser):
     """
     def handleArgs(self, args, action):
         if action in ['create', 'c']:
-            self.instanceManager.create(args.instance_name, args.version)
+            self.instanceManager.create(args.instance_name, args.version, seeded=args.seeded)
         elif action in ['start', 's']:
             # Check if we have an explicit instance name, else, use the environment
-            if args.entity_name:
-                self.instanceManager.start(args.entity_name, args.port, args.debug, args.temp)
+            if len(args.entity_name) > 1 or args.count > 1:
+                if args.port is not None or args.temp or args.ephemeral or args.warmup:
+                    self.logger.error('--port, --temp, --ephemeral and --warmup can only be used to start a single '
+                                      'instance')
+                else:
+                    self.instanceManager.startAll(args.entity_name, args.count, args.debug, args.wait_ready,
+                                                  args.timeout, args.profile)
+            elif args.entity_name:
+                self.instanceManager.start(args.entity_name[0], args.port, args.debug, args.temp,
+                                           args.detach, args.wait_ready, args.timeout, args.profile,
+                                           args.ephemeral, args.warmup)
             elif self.execEnvironment.getInferredInstanceName():
                 self.instanceManager.start(
-                    self.execEnvironment.getInferredInstanceName(), args.port, args.debug)
+                    self.execEnvironment.getInferredInstanceName(), args.port, args.debug,
+                    detach=args.detach, waitReady=args.wait_ready, timeout=args.timeout, profile=args.profile,
+                    warmup=args.warmup)
             else:
                 self.logger.error('Unable to determine the name of the instance to start.')
+        elif action == 'stop':
+            if args.instance_name:
+                self.instanceManager.stop(args.instance_name)
+            elif self.execEnvironment.getInferredInstanceName():
+                self.instanceManager.stop(self.execEnvironment.getInferredInstanceName())
+            else:
+                self.logger.error('Unable to determine the name of the instance to stop.')
+        elif action == 'status':
+            self.instanceManager.status(args.instance_name)
+        elif action == 'bench':
+            if args.benchAction == 'startup':
+                self.instanceManager.benchmark.run(args.version, args.profile, args.runs, args.timeout, args.output)
+            elif args.benchAction == 'compare':
+                self.instanceManager.benchmark.compare(args.base_report, args.report)
+        elif action == 'pool':
+            if args.poolAction == 'fill':
+                if args.detach:
+                    self.instanceManager.pool.fillInBackground(args.version)
+                else:
+                    self.instanceManager.pool.fill(args.version)
+            elif args.poolAction in ['list', 'l']:
+                self.instanceManager.pool.list()
+            elif args.poolAction == 'size':
+                self.instanceManager.pool.setSize(args.version, args.size)
+            elif args.poolAction == 'clear':
+                self.instanceManager.pool.clear(args.version)
         elif action in ['upgrade', 'u']:
             self.upgradeManager.upgrade(args.instance_name, args.version, args.force, args.keepconf)
         elif action in ['edit', 'e']:
@@ -121,6 +281,19 @@ class InstanceParser(Parser):
             self.instanceManager.copy(args.instance_name, args.new_instance_name)
         elif (action in ['remove', 'rm']):
             self.instanceManager.remove(args.instance_name)
+        elif action == 'warmup':
+            self.instanceManager.warmup(args.instance_name, args.urls)
+        elif action == 'stats':
+            self.instanceManager.stats(args.instance_name)
+        elif action == 'profile':
+            if args.instance_name is None:
+                self.instanceManager.jvmProfiles.list()
+            elif args.unset:
+                self.instanceManager.setProfile(args.instance_name, None)
+            elif args.profile is not None:
+                self.instanceManager.setProfile(args.instance_name, args.profile)
+            else:
+                self.instanceManager.showProfile(args.instance_name)
         elif (action in ['symlink', 'sym']):
             if args.all:
                 for instance in self.configManager.instances():
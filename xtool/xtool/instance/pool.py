@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from environment import Environment
+from locking import FileLock
+from trash import Trash
+
+from utils import random_chars
+
+
+class InstancePool:
+    """
+    Instances created in advance, and never started, for the versions listed in the instancePool preference : an
+    instance of a pooled version is obtained by moving a pooled instance to the instances directory rather than by
+    copying the version.
+    The pooled instances are stored in ~/.xtool/pool/<version>, each one along with the stamp of the version it was
+    copied from, so that the instances of a version that has since been updated or extracted again are recycled.
+    """
+
+    logger = logging.getLogger('InstancePool')
+
+    def __init__(self, configManager, versionManager, instanceManager):
+        self.configManager = configManager
+        self.versionManager = versionManager
+        self.instanceManager = instanceManager
+
+    # Get the number of pooled instances to keep for each version
+    def getSizes(self):
+        return self.configManager.get('instancePool') or {}
+
+    def setSize(self, version, size):
+        with self.configManager.transaction():
+            sizes = dict(self.getSizes())
+            if size > 0:
+                sizes[version] = size
+            else:
+                sizes.pop(version, None)
+            self.configManager.set('instancePool', sizes)
+
+    def getVersionPath(self, version):
+        return os.path.join(Environment.poolDir, version)
+
+    def __pooledVersions(self):
+        return os.listdir(Environment.poolDir) if os.path.isdir(Environment.poolDir) else []
+
+    # Get the lock serializing the changes made to the pool of the given version between xtool processes
+    def getLock(self, version):
+        return FileLock('pool-{}'.format(version), quiet=True)
+
+    # List the pooled instances of the given version, as tuples (name, whether the instance is up to date)
+    def __entries(self, version):
+        versionPath = self.getVersionPath(version)
+        if not os.path.isdir(versionPath):
+            return []
+        stamp = self.versionManager.getStamp(version)
+        entries = []
+        for fileName in sorted(os.listdir(versionPath)):
+            if fileName.endswith('.json'):
+                name = fileName[:-len('.json')]
+                try:
+                    with open(os.path.join(versionPath, fileName), 'r') as entryFile:
+                        entryStamp = json.load(entryFile).get('stamp')
+                except (OSError, ValueError):
+                    entryStamp = None
+                entries.append((name, stamp is not None and entryStamp == stamp
+                                and os.path.isdir(os.path.join(versionPath, name))))
+        return entries
+
+    def __removeEntry(self, version, name):
+        versionPath = self.getVersionPath(version)
+        Trash.discard(os.path.join(versionPath, name))
+        if os.path.exists(os.path.join(versionPath, '{}.json'.format(name))):
+            os.remove(os.path.join(versionPath, '{}.json'.format(name)))
+
+    """
+    Take an up to date pooled instance of the given version, and register it as a new instance.
+    Returns the name of the instance, None if the pool of the version is empty
+    """
+    def take(self, version):
+        with self.getLock(version):
+            freshEntries = [name for name, fresh in self.__entries(version) if fresh]
+            if not freshEntries:
+                return None
+
+            name = freshEntries[0]
+            instanceName = 'xtool-{}'.format(random_chars(4))
+            os.remove(os.path.join(self.getVersionPath(version), '{}.json'.format(name)))
+            shutil.move(os.path.join(self.getVersionPath(version), name),
+                        self.instanceManager.getInstancePath(instanceName))
+
+        with self.configManager.transaction():
+            self.configManager.instances().append({'name': instanceName, 'version': version})
+            self.versionManager.touch(version)
+        self.logger.info('Instance {} taken from the pool of version {}'.format(instanceName, version))
+        return instanceName
+
+    """
+    Recycle the outdated pooled instances, and create instances until the pool of each version reaches its size.
+    @param versions : the versions to fill, all the pooled versions by default
+    """
+    def fill(self, versions=None):
+        sizes = self.getSizes()
+        # The versions removed from the preference are drained
+        for version in versions or sorted(set(sizes.keys()) | set(self.__pooledVersions())):
+            # Only one process fills the pool of a version, instances can still be taken in the meantime
+            with FileLock('pool-fill-{}'.format(version), quiet=True):
+                self.__fillVersion(version, int(sizes.get(version, 0)))
+
+    def __fillVersion(self, version, size):
+        versionPath = self.getVersionPath(version)
+        if size > 0:
+            self.versionManager.ensureVersion(version)
+
+        with self.getLock(version):
+            # Clean up the copies interrupted by another process
+            if os.path.isdir(versionPath):
+                for fileName in os.listdir(versionPath):
+                    if fileName.startswith('.'):
+                        Trash.discard(os.path.join(versionPath, fileName))
+            freshEntries = []
+            for name, fresh in self.__entries(version):
+                if fresh and len(freshEntries) < size:
+                    freshEntries.append(name)
+                else:
+                    self.logger.info('Recycling the pooled instance {} of version {}'.format(name, version))
+                    self.__removeEntry(version, name)
+
+            # Discarded under the lock, so that a concurrent take never sees a half removed pool
+            if size == 0:
+                Trash.discard(versionPath)
+                return
+
+        missing = size - len(freshEntries)
+        for i in range(missing):
+            self.logger.info('Creating pooled instance {} out of {} for version {}'
+                             .format(len(freshEntries) + i + 1, size, version))
+            stamp = self.versionManager.getStamp(version)
+            name = random_chars(4)
+            # Copy under a hidden name, so that an interrupted copy is never taken
+            temporaryPath = os.path.join(versionPath, '.{}'.format(name))
+            os.makedirs(versionPath, exist_ok=True)
+            self.instanceManager.copyVersion(version, temporaryPath)
+            if self.configManager.get('seedInstances'):
+                self.instanceManager.seeds.apply(version, temporaryPath)
+            with self.getLock(version):
+                os.rename(temporaryPath, os.path.join(versionPath, name))
+                with open(os.path.join(versionPath, '{}.json'.format(name)), 'w') as entryFile:
+                    json.dump({'stamp': stamp, 'created': time.time()}, entryFile)
+        self.logger.info('The pool of version {} is full ({} instances)'.format(version, size))
+
+    # Fill the pool of the given versions in a separate process, logging to ~/.xtool/run/pool.log
+    def fillInBackground(self, versions=None):
+        os.makedirs(Environment.runDir, exist_ok=True)
+        mainPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+        with open(os.path.join(Environment.runDir, 'pool.log'), 'a') as logFile:
+            subprocess.Popen([sys.executable, mainPath, 'pool', 'fill'] + list(versions or []),
+                             stdin=subprocess.DEVNULL, stdout=logFile, stderr=subprocess.STDOUT,
+                             start_new_session=True)
+        self.logger.debug('Filling the pool of versions {} in the background'.format(versions or 'all'))
+
+    def clear(self, version=None):
+        for pooledVersion in [version] if version else self.__pooledVersions():
+            with self.getLock(pooledVersion):
+                self.logger.info('Removing the pooled instances of version {}'.format(pooledVersion))
+                Trash.discard(self.getVersionPath(pooledVersion))
+
+    def list(self):
+        sizes = self.getSizes()
+        for version in sorted(set(sizes.keys()) | set(self.__pooledVersions())):
+            entries = self.__entries(version)
+            freshCount = len([e for e in entries if e[1]])
+            print('{}: {} out of {} instances ready{}'.format(
+                version, freshCount, sizes.get(version, 0),
+                ', {} outdated'.format(len(entries) - freshCount) if len(entries) > freshCount else ''))
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import socket
+import time
+
+from environment import Environment
+from locking import FileLock
+
+from instance.supervisor import InstanceSupervisor
+
+
+class PortAllocator:
+    """
+    Allocate the HTTP, stop and debug ports of the started instances from a range of ports.
+    Allocated ports are recorded in a registry shared by the xtool processes (~/.xtool/run/ports.registry), so that
+    instances started concurrently never get the same ports. The ports of an instance are released once it is not
+    running anymore.
+    """
+
+    logger = logging.getLogger('PortAllocator')
+
+    # Ports reserved for an instance that is still starting are kept for this amount of seconds
+    reservationTimeout = 120
+
+    # portRange : a string such as 8080-8199
+    def __init__(self, portRange):
+        start, end = str(portRange or '8080-8199').split('-')
+        self.ports = range(int(start), int(end) + 1)
+        self.registryPath = os.path.join(Environment.runDir, 'ports.registry')
+
+    def __loadRegistry(self):
+        try:
+            with open(self.registryPath, 'r') as registryFile:
+                return json.load(registryFile)
+        except (OSError, ValueError):
+            return {}
+
+    def __saveRegistry(self, registry):
+        os.makedirs(Environment.runDir, exist_ok=True)
+        temporaryPath = '{}.{}.tmp'.format(self.registryPath, os.getpid())
+        with open(temporaryPath, 'w') as registryFile:
+            json.dump(registry, registryFile, indent=4)
+        os.replace(temporaryPath, self.registryPath)
+
+    def __isActive(self, instanceName, entry):
+        return (time.time() - entry['reserved'] < self.reservationTimeout
+                or InstanceSupervisor.readState(instanceName) is not None)
+
+    # Check that no other program listens on the port
+    @staticmethod
+    def isFree(port):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            # Like Jetty, ignore the connections of a previous instance left in TIME_WAIT
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                s.bind(('', port))
+                return True
+            except OSError:
+                return False
+
+    """
+    Allocate the ports of the given instance.
+    @param httpPort : the HTTP port to use, if it has been chosen by the user
+    @param debug : whether a debug port should be allocated as well
+    Returns a dict with the http, stop and debug ports, None if the range has no free port left or if the given
+    HTTP port is already used
+    """
+    def allocate(self, instanceName, httpPort=None, debug=False):
+        with FileLock('ports', quiet=True):
+            registry = {name: entry for name, entry in self.__loadRegistry().items()
+                        if name != instanceName and self.__isActive(name, entry)}
+            usedPorts = set(port for entry in registry.values() for port in entry['ports'].values())
+
+            ports = {}
+            for kind in ['http', 'stop'] + (['debug'] if debug else []):
+                if kind == 'http' and httpPort is not None:
+                    ports[kind] = int(httpPort)
+                    if ports[kind] in usedPorts or not self.isFree(ports[kind]):
+                        self.logger.error('The port {} is already used, by another instance or program'
+                                          .format(ports[kind]))
+                        return None
+                else:
+                    candidates = (p for p in self.ports
+                                  if p not in usedPorts and p not in ports.values() and self.isFree(p))
+                    ports[kind] = next(candidates, None)
+                    if ports[kind] is None:
+                        self.logger.error('No free port left in the range {}-{}'
+                                          .format(self.ports.start, self.ports.stop - 1))
+                        return None
+
+            registry[instanceName] = {'ports': ports, 'reserved': time.time()}
+            self.__saveRegistry(registry)
+            self.logger.debug('Ports of instance [{}] : {}'.format(instanceName, ports))
+            return ports
+
+    def release(self, instanceName):
+        with FileLock('ports', quiet=True):
+            registry = self.__loadRegistry()
+            if registry.pop(instanceName, None) is not None:
+                self.__saveRegistry(registry)
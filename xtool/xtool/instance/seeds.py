@@ -0,0 +1,190 @@
+import datetime
+import json
+import logging
+import os
+import shutil
+import time
+
+from environment import Environment
+from locking import FileLock
+from trash import Trash
+from utils import random_chars
+
+from instance.cloning import TreeCopier
+from instance.supervisor import InstanceSupervisor
+from instance.warmup import WarmupCrawler
+
+
+class DataSeeds:
+    """
+    Templates of the data directory of the instances of each version, captured once the initialization done by
+    the first start of an instance (database creation, flavor, Solr index, ...) is over. Seeded instances get a copy
+    of the template instead of the empty data directory of the version, and skip that initialization.
+    The template of a version is stored in ~/.xtool/seeds/<version>/data, it is copied with reflinks when the file
+    system supports them.
+    """
+
+    logger = logging.getLogger('DataSeeds')
+
+    # The URL requested to trigger the initialization of the wiki
+    initializationUrl = '/xwiki/bin/view/Main/'
+    # Seconds between two requests while the wiki is initializing
+    pollInterval = 2
+    # Seconds given to the temporary instance to shut down cleanly, its data is not captured otherwise
+    stopTimeout = 120
+
+    def __init__(self, configManager, versionManager, instanceManager):
+        self.configManager = configManager
+        self.versionManager = versionManager
+        self.instanceManager = instanceManager
+
+    def getSeedDirectoryPath(self, version):
+        return os.path.join(Environment.seedsDir, version)
+
+    def getSeedPath(self, version):
+        return os.path.join(self.getSeedDirectoryPath(version), 'data')
+
+    def getInfoPath(self, version):
+        return os.path.join(self.getSeedDirectoryPath(version), 'seed.json')
+
+    def getLock(self, version):
+        return FileLock('seed-{}'.format(version), quiet=True)
+
+    def hasSeed(self, version):
+        return os.path.isdir(self.getSeedPath(version))
+
+    # Data files are modified in place by the instances, they are never linked
+    def getCopier(self):
+        return TreeCopier(strategy='auto')
+
+    """
+    Request the home page of the wiki until it is served, then until its latency settles : the first requests are
+    slowed down by the initialization jobs (database creation, Solr index, extensions).
+    Returns True once the wiki is initialized, False if it is not within the given number of seconds
+    """
+    def __waitInitialized(self, port, timeout):
+        crawler = WarmupCrawler(port, [self.initializationUrl])
+        deadline = time.time() + timeout
+        previousLatency = None
+        while time.time() < deadline:
+            status, latency = crawler.fetch(self.initializationUrl)
+            if status == 200:
+                if previousLatency is not None and latency > previousLatency * (1 - crawler.settleThreshold):
+                    return True
+                previousLatency = latency
+            else:
+                self.logger.debug('The wiki is still initializing ({})'.format(status or 'no response'))
+                previousLatency = None
+            time.sleep(self.pollInterval)
+        self.logger.error('The wiki was not initialized within {} seconds'.format(timeout))
+        return False
+
+    """
+    Capture the data directory of the given version, either from a given stopped instance of the version, which
+    may have been initialized by hand (flavor installed, users created, ...), or from a temporary instance started
+    for the occasion.
+    @param timeout : the number of seconds to wait for the temporary instance to be ready, then initialized
+    """
+    def seed(self, version, fromInstance=None, timeout=900):
+        if fromInstance is not None:
+            instance = self.configManager.getInstance(fromInstance)
+            if instance is None:
+                self.logger.error('The instance with name [{}] does not exist.'.format(fromInstance))
+            elif instance['version'] != version:
+                self.logger.error('The instance [{}] is an instance of version {}'
+                                  .format(fromInstance, instance['version']))
+            elif InstanceSupervisor.readState(fromInstance) is not None:
+                self.logger.error('The instance [{}] should be stopped first, see `x stop`'.format(fromInstance))
+            else:
+                with self.instanceManager.getLock(fromInstance):
+                    self.__capture(version, fromInstance)
+            return
+
+        instanceName = 'xtool-seed-{}'.format(random_chars(4))
+        if not self.instanceManager.create(instanceName, version, seeded=False):
+            return
+        try:
+            supervisor = self.instanceManager.launch(instanceName, detach=True)
+            if supervisor is None:
+                return
+            initialized = False
+            try:
+                if supervisor.waitReady(timeout) is not None:
+                    self.logger.info('Initializing the wiki ...')
+                    initialized = self.__waitInitialized(supervisor.state['port'], timeout)
+            finally:
+                # Stop the instance cleanly, so that the database is consistent on the disk
+                if not self.instanceManager.stop(instanceName, force=False, timeout=self.stopTimeout):
+                    self.instanceManager.stop(instanceName)
+                    initialized = False
+            if initialized:
+                self.__capture(version, instanceName)
+        finally:
+            self.instanceManager.remove(instanceName)
+
+    def __capture(self, version, instanceName):
+        dataPath = os.path.join(self.instanceManager.getInstancePath(instanceName), 'data')
+        if not os.path.isdir(dataPath):
+            self.logger.error('The instance [{}] has no data directory'.format(instanceName))
+            return
+
+        self.logger.info('Capturing the data of instance [{}] as the seed of version {}'.format(instanceName, version))
+        # Copy the data next to the current seed first, so that instances being created still get a complete seed
+        temporaryPath = '{}.{}.tmp'.format(self.getSeedDirectoryPath(version), os.getpid())
+        shutil.rmtree(temporaryPath, ignore_errors=True)
+        self.getCopier().copy(dataPath, os.path.join(temporaryPath, 'data'))
+        with open(os.path.join(temporaryPath, 'seed.json'), 'w') as infoFile:
+            json.dump({'stamp': self.versionManager.getStamp(version), 'created': time.time(),
+                       'instance': instanceName}, infoFile)
+
+        with self.getLock(version):
+            Trash.discard(self.getSeedDirectoryPath(version))
+            os.rename(temporaryPath, self.getSeedDirectoryPath(version))
+        self.logger.info('Version {} seeded in [{}]'.format(version, self.getSeedPath(version)))
+
+    """
+    Replace the data directory of the given new instance by a copy of the seed of its version.
+    Returns True if the instance has been seeded
+    """
+    def apply(self, version, instancePath):
+        with self.getLock(version):
+            if not self.hasSeed(version):
+                self.logger.warning('Version {} has no seed, use `x version seed {}` to create one'
+                                    .format(version, version))
+                return False
+
+            try:
+                with open(self.getInfoPath(version), 'r') as infoFile:
+                    info = json.load(infoFile)
+            except (OSError, ValueError):
+                info = {}
+            if info.get('stamp') != self.versionManager.getStamp(version):
+                self.logger.warning('The seed of version {} was captured before the version was last updated'
+                                    .format(version))
+
+            dataPath = os.path.join(instancePath, 'data')
+            shutil.rmtree(dataPath, ignore_errors=True)
+            self.getCopier().copy(self.getSeedPath(version), dataPath)
+        self.logger.debug('Instance [{}] seeded'.format(instancePath))
+        return True
+
+    def remove(self, version):
+        with self.getLock(version):
+            if os.path.isdir(self.getSeedDirectoryPath(version)):
+                Trash.discard(self.getSeedDirectoryPath(version))
+                self.logger.info('The seed of version {} has been removed'.format(version))
+            else:
+                self.logger.error('Version {} has no seed'.format(version))
+
+    def list(self):
+        if not os.path.isdir(Environment.seedsDir):
+            return
+        for version in sorted(os.listdir(Environment.seedsDir)):
+            if not version.endswith('.tmp') and self.hasSeed(version):
+                try:
+                    with open(self.getInfoPath(version), 'r') as infoFile:
+                        created = json.load(infoFile).get('created')
+                except (OSError, ValueError):
+                    created = None
+                print('{}: {}'.format(version, datetime.datetime.fromtimestamp(created).__format__(
+                    '%a %d %b %Y - %H:%M') if created else 'unknown date'))
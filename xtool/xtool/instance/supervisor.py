@@ -0,0 +1,471 @@
+from contextlib import contextmanager
+import datetime
+import http.client
+import json
+import logging
+import os
+import queue
+import re
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from environment import Environment
+
+from instance.monitor import ResourceMonitor
+
+
+class InstanceSupervisor:
+    """
+    Start an instance and follow it until it is ready to serve requests.
+    The supervisor reacts to events instead of polling the process : a thread waits for the process to exit, another
+    one follows its output, looking for the line Jetty logs once its connector is started, which triggers a probe
+    of the HTTP port. The port is also probed at a regular interval, in case the log line is missed.
+    The PID and the port of the running instance are recorded in ~/.xtool/run, for `x stop` and `x status`.
+    """
+
+    logger = logging.getLogger('InstanceSupervisor')
+
+    readyPattern = re.compile(r'Started (ServerConnector|Server@|@\d+ms)')
+    probePath = '/xwiki/'
+    probeInterval = 2
+    # Once Jetty reported that it is started, the port is probed more often
+    fastProbeInterval = 0.2
+    stopTimeout = 10
+    # Signals received when the terminal of xtool is closed or when xtool is asked to terminate
+    terminationSignals = [signal.SIGTERM, signal.SIGHUP]
+
+    def __init__(self, instanceName, instancePath):
+        self.instanceName = instanceName
+        self.instancePath = instancePath
+        self.events = queue.Queue()
+        self.probeRequested = threading.Event()
+        self.stopped = threading.Event()
+        self.jettyStarted = False
+        self.process = None
+        self.state = None
+
+    @staticmethod
+    def getStatePath(instanceName):
+        return os.path.join(Environment.runDir, '{}.json'.format(instanceName))
+
+    @staticmethod
+    def getLogPath(instanceName):
+        return os.path.join(Environment.runDir, '{}.log'.format(instanceName))
+
+    # Get the state of a process (R, S, Z, ...) and its start time, in clock ticks since boot, which tells it apart
+    # from a process that reused its PID
+    @staticmethod
+    def __readProcessStat(pid):
+        try:
+            with open('/proc/{}/stat'.format(pid), 'r') as statFile:
+                fields = statFile.read().rsplit(')', 1)[1].split()
+            return fields[0], int(fields[19])
+        except (OSError, IndexError, ValueError):
+            return None, None
+
+    @staticmethod
+    def isAlive(state):
+        try:
+            os.kill(state['pid'], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        processState, startTime = InstanceSupervisor.__readProcessStat(state['pid'])
+        # A zombie has exited, it is only waiting for its parent to collect it
+        return processState != 'Z' and (state.get('processStartTime') is None
+                                        or startTime == state['processStartTime'])
+
+    """
+    Get the runtime state of the given instance, None if it is not running.
+    """
+    @staticmethod
+    def readState(instanceName):
+        statePath = InstanceSupervisor.getStatePath(instanceName)
+        try:
+            with open(statePath, 'r') as stateFile:
+                state = json.load(stateFile)
+        except (OSError, ValueError):
+            return None
+
+        if not InstanceSupervisor.isAlive(state):
+            InstanceSupervisor.logger.debug('Removing the stale state of instance [{}]'.format(instanceName))
+            InstanceSupervisor.removeState(instanceName)
+            return None
+        return state
+
+    @staticmethod
+    def removeState(instanceName):
+        if os.path.exists(InstanceSupervisor.getStatePath(instanceName)):
+            os.remove(InstanceSupervisor.getStatePath(instanceName))
+
+    def __writeState(self):
+        os.makedirs(Environment.runDir, exist_ok=True)
+        statePath = self.getStatePath(self.instanceName)
+        temporaryPath = '{}.{}.tmp'.format(statePath, os.getpid())
+        with open(temporaryPath, 'w') as stateFile:
+            json.dump(self.state, stateFile)
+        os.replace(temporaryPath, statePath)
+
+    # Check whether a program accepts connections on the given port
+    @staticmethod
+    def isListening(port):
+        try:
+            socket.create_connection(('localhost', port), timeout=InstanceSupervisor.probeInterval).close()
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def probe(port):
+        connection = http.client.HTTPConnection('localhost', port, timeout=InstanceSupervisor.probeInterval)
+        try:
+            connection.request('GET', InstanceSupervisor.probePath)
+            # XWiki answers with a 503 while it is initializing
+            return connection.getresponse().status < 500
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    def __watchProcess(self):
+        returnCode = self.process.wait()
+        self.events.put(('exit', returnCode))
+
+    def __handleLine(self, line):
+        if self.readyPattern.search(line):
+            self.jettyStarted = True
+            self.events.put(('log-ready', line.strip()))
+            self.probeRequested.set()
+
+    # Follow the output of an attached instance, while still displaying it
+    def __watchOutput(self):
+        for line in iter(self.process.stdout.readline, b''):
+            sys.stdout.buffer.write(line)
+            sys.stdout.buffer.flush()
+            self.__handleLine(line.decode('utf-8', errors='replace'))
+
+    # Follow the log file of a detached instance, reading it again each time it is modified
+    def __watchLog(self, logPath):
+        logChanged = threading.Event()
+
+        class LogHandler(FileSystemEventHandler):
+            def on_modified(self, event):
+                if event.src_path == logPath:
+                    logChanged.set()
+
+        observer = Observer()
+        observer.schedule(LogHandler(), os.path.dirname(logPath))
+        observer.start()
+        try:
+            with open(logPath, 'r', errors='replace') as logFile:
+                while not self.stopped.is_set():
+                    line = logFile.readline()
+                    if line:
+                        self.__handleLine(line)
+                    else:
+                        logChanged.wait(self.probeInterval)
+                        logChanged.clear()
+        finally:
+            observer.stop()
+
+    # Probe the port until the instance answers, the port being opened before the instance is ready
+    def __watchPort(self, port):
+        portOpen = False
+        while not self.stopped.is_set():
+            self.probeRequested.wait(self.fastProbeInterval if self.jettyStarted else self.probeInterval)
+            self.probeRequested.clear()
+            if not portOpen and self.isListening(port):
+                portOpen = True
+                self.events.put(('port-open', time.time() - self.state['started']))
+            if portOpen and not self.stopped.is_set() and self.probe(port):
+                self.events.put(('ready', time.time() - self.state['started']))
+                return
+
+    def __startThread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    # Whether the given start script accepts the given option : old distributions reject the stop and debug ports
+    @staticmethod
+    def supportsOption(scriptPath, option):
+        try:
+            with open(scriptPath, 'r', errors='replace') as script:
+                return re.search(r'(?<![\w-]){}(?![\w-])'.format(re.escape(option)), script.read()) is not None
+        except OSError:
+            return False
+
+    """
+    Start the instance in a new session, so that it can be stopped as a whole with its process group.
+    The stop port is only given to the scripts supporting it, the instance being stopped through its process group
+    anyway.
+    @param ports : a dict giving the http and stop ports of the instance, and its debug port in debug mode
+    @param detach : whether the instance should keep running once xtool exits, its output is then written to a
+    log file in ~/.xtool/run
+    @param environment : the environment variables of the instance process, those of xtool by default
+    @param monitorInterval : the number of seconds between two samples of the resources used by the instance, None
+    to disable the sampling
+    """
+    def launch(self, ports, debug=False, detach=False, environment=None, monitorInterval=None):
+        port = ports['http']
+        startScript = 'start_xwiki_debug.sh' if debug else 'start_xwiki.sh'
+        scriptPath = '{}/./{}'.format(self.instancePath, startScript)
+        processArgs = [scriptPath, '-p', str(port)]
+        for option, kind in [('-sp', 'stop'), ('-dp', 'debug')]:
+            if kind in ports and (kind != 'debug' or debug):
+                if self.supportsOption(scriptPath, option):
+                    processArgs += [option, str(ports[kind])]
+                else:
+                    self.logger.debug('[{}] does not support {}, not passing the {} port'
+                                      .format(startScript, option, kind))
+
+        logPath = None
+        if detach:
+            os.makedirs(Environment.runDir, exist_ok=True)
+            logPath = self.getLogPath(self.instanceName)
+            with open(logPath, 'wb') as logFile:
+                self.process = subprocess.Popen(processArgs, stdin=subprocess.DEVNULL, stdout=logFile,
+                                                stderr=subprocess.STDOUT, env=environment, start_new_session=True)
+        else:
+            self.process = subprocess.Popen(processArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                            env=environment, start_new_session=True)
+
+        self.state = {
+            'instance': self.instanceName,
+            'pid': self.process.pid,
+            'processStartTime': self.__readProcessStat(self.process.pid)[1],
+            'port': port,
+            'ports': ports,
+            'started': time.time(),
+            'portOpen': None,
+            'ready': None,
+            'log': logPath,
+            'detached': detach
+        }
+        self.__writeState()
+        self.logger.info('Instance [{}] started with PID {} on port {}'
+                         .format(self.instanceName, self.process.pid, port))
+
+        self.__startThread(self.__watchProcess)
+        if detach:
+            self.__startThread(self.__watchLog, logPath)
+        else:
+            self.__startThread(self.__watchOutput)
+        self.__startThread(self.__watchPort, port)
+
+        if monitorInterval:
+            monitor = ResourceMonitor(self.instanceName)
+            if detach:
+                # The samples are still needed once xtool exits
+                monitor.runInBackground(self.process.pid, monitorInterval)
+            else:
+                self.__startThread(monitor.run, self.process.pid, monitorInterval, self.stopped)
+
+    def __handleEvent(self, event):
+        name, value = event
+        if name == 'log-ready':
+            self.logger.debug('Jetty is started : [{}]'.format(value))
+        elif name == 'port-open':
+            self.state['portOpen'] = value
+            self.__writeState()
+            self.logger.debug('Port {} opened after {:.1f} seconds'.format(self.state['port'], value))
+        elif name == 'ready':
+            self.state['ready'] = value
+            self.__writeState()
+            self.logger.info('Instance [{}] is ready on port {} after {:.1f} seconds'
+                             .format(self.instanceName, self.state['port'], value))
+        elif name == 'exit':
+            self.stopped.set()
+            self.probeRequested.set()
+            self.removeState(self.instanceName)
+            self.logger.debug('Instance has terminated with return code : [{}]'.format(value))
+
+    """
+    Wait until the instance answers on its port.
+    Returns the time it took for the instance to be ready, in seconds, or None if the instance exited or did not
+    get ready within the given timeout.
+    @param reportTimeout : whether reaching the timeout is an error
+    """
+    def waitReady(self, timeout=None, reportTimeout=True):
+        # The instance may already have been waited for
+        if self.state['ready'] is not None or self.stopped.is_set():
+            return self.state['ready']
+
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            try:
+                event = self.events.get(timeout=max(0, deadline - time.time()) if deadline is not None else None)
+            except queue.Empty:
+                if reportTimeout:
+                    self.logger.error('Instance [{}] is not ready after {} seconds'
+                                      .format(self.instanceName, timeout))
+                return None
+            self.__handleEvent(event)
+            if event[0] == 'ready':
+                return event[1]
+            elif event[0] == 'exit':
+                self.logger.error('Instance [{}] exited before being ready, see [{}]'
+                                  .format(self.instanceName, self.state['log'] or 'its output'))
+                return None
+
+    """
+    Handle the termination signals like Ctrl+C within the block, by raising KeyboardInterrupt : attached instances
+    run in their own session, they would otherwise keep running once xtool is gone.
+    Signal handlers can only be installed from the main thread, the block runs unchanged in the other threads.
+    """
+    @staticmethod
+    @contextmanager
+    def interruptOnTermination():
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def interrupt(signalNumber, frame):
+            raise KeyboardInterrupt(signal.Signals(signalNumber).name)
+
+        previousHandlers = {s: signal.signal(s, interrupt) for s in InstanceSupervisor.terminationSignals}
+        try:
+            yield
+        finally:
+            for signalNumber, handler in previousHandlers.items():
+                signal.signal(signalNumber, handler)
+
+    """
+    Follow an attached instance until it exits, stopping it on Ctrl+C or when xtool is terminated.
+    @param onReady : a function to call in a separate thread once the instance is ready
+    Returns the return code of the instance.
+    """
+    def supervise(self, onReady=None):
+        with self.interruptOnTermination():
+            try:
+                while True:
+                    event = self.events.get()
+                    self.__handleEvent(event)
+                    if event[0] == 'ready' and onReady is not None:
+                        self.__startThread(onReady)
+                    elif event[0] == 'exit':
+                        return event[1]
+            except KeyboardInterrupt as interrupt:
+                self.logger.debug('Interrupt [{}] recieved, terminating the instance ...'.format(interrupt))
+                self.stop(self.instanceName)
+                self.removeState(self.instanceName)
+                return self.process.poll()
+
+    # Wait for a process that may not be a child of this one to exit, without polling when pidfd is available
+    @staticmethod
+    def __waitExit(pid, timeout):
+        try:
+            pidFd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return True
+        except (AttributeError, OSError):
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    return True
+                time.sleep(0.1)
+            return False
+        try:
+            return bool(select.select([pidFd], [], [], timeout)[0])
+        finally:
+            os.close(pidFd)
+
+    # Whether a process of the given process group, other than a zombie, is still running
+    @staticmethod
+    def __isGroupAlive(groupId):
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open('/proc/{}/stat'.format(entry), 'r') as statFile:
+                        fields = statFile.read().rsplit(')', 1)[1].split()
+                except (OSError, IndexError):
+                    continue
+                if int(fields[2]) == groupId and fields[0] != 'Z':
+                    return True
+        return False
+
+    # Wait for the start script, then for the JVM it started : the shell may exit as soon as it is signaled
+    @staticmethod
+    def __waitGroupExit(groupId, timeout):
+        deadline = time.time() + timeout
+        InstanceSupervisor.__waitExit(groupId, timeout)
+        while InstanceSupervisor.__isGroupAlive(groupId):
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    """
+    Stop a running instance : its process group is terminated, and killed if it is still running after a delay.
+    @param force : whether the instance should be killed once the delay is over, it is left running otherwise
+    @param timeout : the number of seconds to wait for the instance to terminate, stopTimeout by default
+    Returns True if the instance is not running anymore.
+    """
+    @staticmethod
+    def stop(instanceName, force=True, timeout=None):
+        state = InstanceSupervisor.readState(instanceName)
+        if state is None:
+            InstanceSupervisor.logger.error('The instance [{}] is not running'.format(instanceName))
+            return False
+
+        timeout = timeout or InstanceSupervisor.stopTimeout
+        InstanceSupervisor.logger.info('Stopping instance [{}] (PID {}) ...'.format(instanceName, state['pid']))
+        try:
+            os.killpg(state['pid'], signal.SIGTERM)
+            if not InstanceSupervisor.__waitGroupExit(state['pid'], timeout):
+                if not force:
+                    InstanceSupervisor.logger.error('The instance [{}] did not terminate within {} seconds'
+                                                    .format(instanceName, timeout))
+                    return False
+                InstanceSupervisor.logger.debug('Failed to terminate within {} seconds, killing the instance ...'
+                                                .format(timeout))
+                os.killpg(state['pid'], signal.SIGKILL)
+                InstanceSupervisor.__waitGroupExit(state['pid'], InstanceSupervisor.stopTimeout)
+        except ProcessLookupError:
+            pass
+
+        if InstanceSupervisor.isAlive(state):
+            InstanceSupervisor.logger.error('Failed to kill the instance.')
+            return False
+        InstanceSupervisor.removeState(instanceName)
+        return True
+
+    # Get the states of all the running instances
+    @staticmethod
+    def listStates():
+        if not os.path.isdir(Environment.runDir):
+            return []
+        states = [InstanceSupervisor.readState(f[:-len('.json')])
+                  for f in sorted(os.listdir(Environment.runDir)) if f.endswith('.json')]
+        return [s for s in states if s is not None]
+
+    @staticmethod
+    def status(instanceName=None):
+        states = InstanceSupervisor.listStates()
+        if instanceName is not None:
+            states = [s for s in states if s['instance'] == instanceName]
+            if not states:
+                print('The instance [{}] is not running'.format(instanceName))
+                return
+
+        rowFormat = '{:<25}{:<10}{:<8}{:<25}{:<12}{}'
+        print(rowFormat.format('Instance', 'PID', 'Port', 'Started', 'Ready in', 'Status'))
+        for state in states:
+            print(rowFormat.format(
+                state['instance'],
+                state['pid'],
+                state['port'],
+                datetime.datetime.fromtimestamp(state['started']).__format__('%a %d %b %Y - %H:%M'),
+                '{:.1f}s'.format(state['ready']) if state['ready'] is not None else '',
+                'ready' if InstanceSupervisor.probe(state['port']) else 'starting'))
@@ -36,6 +36,12 @@ class UpgradeManager:
                 self.logger.info('Stored the new version of the file in [{}]'.format(suffixedFilePath))
 
     def upgrade(self, instanceName, newVersion, force, keepconf):
+        with self.instanceManager.getLock(instanceName):
+            self.__upgrade(instanceName, newVersion, force, keepconf)
+
+    def __upgrade(self, instanceName, newVersion, force, keepconf):
+        self.configManager.reload()
+
         # Get the instance
         matchingInstances = [i for i in self.configManager.instances() if i['name'] == instanceName]
 
@@ -92,6 +98,7 @@ class UpgradeManager:
 
                     # Remove the temporary instance
                     self.instanceManager.remove(tempInstanceName)
+                    self.versionManager.touch(newVersion)
                 else:
                     self.logger.error(
                         'Not upgrading instance [{}] as version [{}] could not be found in local repository'
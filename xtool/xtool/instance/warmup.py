@@ -0,0 +1,77 @@
+import http.client
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WarmupCrawler:
+    """
+    Warm up the caches of a started instance (templates, skin resources, wiki caches) by requesting a list of URLs
+    concurrently, pass after pass, until the duration of a pass settles.
+    The lists of URLs are stored in the warmupUrls preference, by name, so that they are shared by the team ; the
+    URLs are relative to the root of the instance, for example /xwiki/bin/view/Main/.
+    """
+
+    logger = logging.getLogger('WarmupCrawler')
+
+    workers = 4
+    requestTimeout = 120
+    # The latency is settled once a pass is less than 10% faster than the previous one
+    settleThreshold = 0.1
+
+    # urls : the URLs to request, relative to the root of the instance
+    # maxPasses : the number of passes after which the warm up stops, even if the latency did not settle
+    def __init__(self, port, urls, maxPasses=10):
+        self.port = port
+        self.urls = urls
+        self.maxPasses = maxPasses
+
+    # Request the given URL, returns a tuple (status, latency in seconds), the status being None on failure
+    def fetch(self, url):
+        connection = http.client.HTTPConnection('localhost', self.port, timeout=self.requestTimeout)
+        start = time.time()
+        try:
+            connection.request('GET', url)
+            response = connection.getresponse()
+            response.read()
+            return response.status, time.time() - start
+        except (OSError, http.client.HTTPException) as e:
+            self.logger.debug('Failed to request [{}] : {}'.format(url, e))
+            return None, time.time() - start
+        finally:
+            connection.close()
+
+    """
+    Run passes until the latency settles.
+    Returns the list of passes, each pass being a list of (status, latency) tuples in the order of the URLs
+    """
+    def run(self):
+        passes = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for passNumber in range(1, self.maxPasses + 1):
+                start = time.time()
+                results = list(executor.map(self.fetch, self.urls))
+                duration = time.time() - start
+                passes.append(results)
+
+                self.logger.info('Warm up pass {} : {:.2f}s'.format(passNumber, duration))
+                for url, (status, latency) in zip(self.urls, results):
+                    self.logger.info('  {:>8.0f} ms  {:<5}{}'.format(latency * 1000, status or 'error', url))
+
+                if len(passes) > 1:
+                    previousDuration = sum(latency for status, latency in passes[-2])
+                    if sum(latency for status, latency in results) > previousDuration * (1 - self.settleThreshold):
+                        self.logger.info('Latency settled after {} passes'.format(passNumber))
+                        break
+            else:
+                self.logger.info('Latency did not settle after {} passes'.format(self.maxPasses))
+
+        self.printSummary(passes)
+        return passes
+
+    def printSummary(self, passes):
+        rowFormat = '{:>12}{:>12}  {}'
+        print(rowFormat.format('First pass', 'Last pass', 'URL'))
+        for i, url in enumerate(self.urls):
+            print(rowFormat.format('{:.0f} ms'.format(passes[0][i][1] * 1000),
+                                   '{:.0f} ms'.format(passes[-1][i][1] * 1000), url))
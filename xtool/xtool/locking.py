@@ -0,0 +1,67 @@
+import fcntl
+import logging
+import os
+import threading
+
+from environment import Environment
+
+
+class FileLock:
+    """
+    Named lock shared between the processes of the current user, based on flock(2) on a file in ~/.xtool/locks.
+    The lock is reentrant within a process : nested acquisitions by the same thread do not block, while other
+    threads of the process wait like other processes do.
+    quiet : whether waiting for the lock should only be logged at the debug level, for locks held briefly
+    """
+
+    logger = logging.getLogger('FileLock')
+
+    # name -> [RLock, depth, file descriptor]
+    registry = {}
+    registryLock = threading.Lock()
+
+    def __init__(self, name, quiet=False):
+        self.name = name
+        self.quiet = quiet
+        self.path = os.path.join(Environment.locksDir, '{}.lock'.format(name.replace(os.sep, '_')))
+
+        with FileLock.registryLock:
+            if name not in FileLock.registry:
+                FileLock.registry[name] = [threading.RLock(), 0, None]
+            self.state = FileLock.registry[name]
+
+    # blocking : whether to wait for the lock, returns False if the lock is held elsewhere otherwise
+    def acquire(self, blocking=True):
+        if not self.state[0].acquire(blocking):
+            return False
+        if self.state[1] == 0:
+            os.makedirs(Environment.locksDir, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not blocking:
+                    os.close(fd)
+                    self.state[0].release()
+                    return False
+                log = self.logger.debug if self.quiet else self.logger.info
+                log('Waiting for another xtool process to release [{}] ...'.format(self.name))
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            self.state[2] = fd
+        self.state[1] += 1
+        return True
+
+    def release(self):
+        self.state[1] -= 1
+        if self.state[1] == 0:
+            fcntl.flock(self.state[2], fcntl.LOCK_UN)
+            os.close(self.state[2])
+            self.state[2] = None
+        self.state[0].release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,179 @@
+import base64
+import http.client
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class HttpClient:
+    """
+    Minimal HTTP client that keeps connections alive across requests.
+    Connections are pooled per thread and per host, so that the client can be shared by concurrent downloads.
+    Errors are reported with the same exceptions as urllib (HTTPError and URLError).
+    Proxies are taken from the environment like urllib does (http_proxy, https_proxy, no_proxy) : HTTPS requests
+    go through a CONNECT tunnel, plain HTTP requests are sent to the proxy with their absolute URL.
+    """
+
+    logger = logging.getLogger('HttpClient')
+
+    maxRedirects = 5
+    timeout = 60
+    userAgent = 'xtool'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __connections(self):
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        return self.local.connections
+
+    """
+    Get the proxy to use for the given URL, from the environment.
+    Returns a tuple (proxy host and port, headers to send to the proxy), None if the URL should be fetched directly
+    """
+    def __getProxy(self, parsedURL):
+        proxyURL = urllib.request.getproxies().get(parsedURL.scheme)
+        if not proxyURL or urllib.request.proxy_bypass(parsedURL.hostname or ''):
+            return None
+
+        # The scheme of the proxy is optional, as in http_proxy=proxy.example.org:3128
+        if '://' not in proxyURL:
+            proxyURL = 'http://{}'.format(proxyURL)
+        parsedProxyURL = urllib.parse.urlsplit(proxyURL)
+        proxyHeaders = {}
+        if parsedProxyURL.username is not None:
+            credentials = '{}:{}'.format(urllib.parse.unquote(parsedProxyURL.username),
+                                         urllib.parse.unquote(parsedProxyURL.password or ''))
+            proxyHeaders['Proxy-Authorization'] = 'Basic {}'.format(
+                base64.b64encode(credentials.encode('utf-8')).decode('ascii'))
+        return parsedProxyURL.netloc.rpartition('@')[2], proxyHeaders
+
+    def __getConnection(self, parsedURL, proxy):
+        key = (parsedURL.scheme, parsedURL.netloc)
+        connections = self.__connections()
+        if key not in connections:
+            self.logger.debug('Opening connection to [{}://{}]{}'.format(
+                parsedURL.scheme, parsedURL.netloc, ' through proxy [{}]'.format(proxy[0]) if proxy else ''))
+            if parsedURL.scheme == 'https':
+                if proxy is None:
+                    connection = http.client.HTTPSConnection(parsedURL.netloc, timeout=self.timeout)
+                else:
+                    connection = http.client.HTTPSConnection(proxy[0], timeout=self.timeout)
+                    connection.set_tunnel(parsedURL.hostname, parsedURL.port, headers=proxy[1])
+            elif parsedURL.scheme == 'http':
+                connection = http.client.HTTPConnection(proxy[0] if proxy else parsedURL.netloc, timeout=self.timeout)
+            else:
+                raise urllib.error.URLError('Unsupported URL scheme [{}]'.format(parsedURL.scheme))
+            connections[key] = connection
+            return connection, False
+        return connections[key], True
+
+    # Forget the given connection, unless a newer connection to the same host has replaced it in the meantime
+    def __forgetConnection(self, parsedURL, connection):
+        connections = self.__connections()
+        key = (parsedURL.scheme, parsedURL.netloc)
+        if connections.get(key) is connection:
+            del connections[key]
+
+    def __dropConnection(self, parsedURL, connection):
+        self.__forgetConnection(parsedURL, connection)
+        connection.close()
+
+    def __send(self, url, method, headers):
+        parsedURL = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(('', '', parsedURL.path or '/', parsedURL.query, ''))
+        requestHeaders = {'User-Agent': self.userAgent}
+        requestHeaders.update(headers or {})
+
+        proxy = self.__getProxy(parsedURL)
+        if proxy is not None and parsedURL.scheme == 'http':
+            # Plain HTTP proxies expect the absolute URL of the resource
+            path = urllib.parse.urlunsplit(parsedURL._replace(fragment=''))
+            requestHeaders.update(proxy[1])
+
+        connection, reused = self.__getConnection(parsedURL, proxy)
+        try:
+            connection.request(method, path, headers=requestHeaders)
+            return parsedURL, connection, connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+            self.__dropConnection(parsedURL, connection)
+            if not reused:
+                raise urllib.error.URLError(e)
+            # The server closed an idle keep-alive connection, retry once on a fresh one
+            self.logger.debug('Connection to [{}] was closed by the server, reconnecting'.format(parsedURL.netloc))
+            connection, reused = self.__getConnection(parsedURL, proxy)
+        except (OSError, http.client.HTTPException) as e:
+            self.__dropConnection(parsedURL, connection)
+            raise urllib.error.URLError(e)
+
+        try:
+            connection.request(method, path, headers=requestHeaders)
+            return parsedURL, connection, connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            self.__dropConnection(parsedURL, connection)
+            raise urllib.error.URLError(e)
+
+    """
+    Send a request and return the response, following redirects.
+    The response should be used as a context manager : once it is closed, its connection is released for the next
+    request if the body has been entirely read.
+    Responses with a status greater than 400 are raised as urllib.error.HTTPError ; 304 responses are returned.
+    """
+    def open(self, url, method='GET', headers=None):
+        for redirect in range(self.maxRedirects + 1):
+            parsedURL, connection, response = self.__send(url, method, headers)
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                self.logger.debug('Following redirect to [{}]'.format(url))
+                continue
+
+            if response.status >= 400:
+                response.read()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+            if response.will_close:
+                # The connection cannot be reused, forget about it once the response has been consumed
+                self.__forgetConnection(parsedURL, connection)
+            return HttpResponse(response, lambda: self.__dropConnection(parsedURL, connection))
+
+        raise urllib.error.URLError('Too many redirects for [{}]'.format(url))
+
+    # Fetch the whole content of the given URL
+    def fetch(self, url, headers=None):
+        with self.open(url, headers=headers) as response:
+            return response.read()
+
+
+class HttpResponse:
+    """
+    Wrap an http.client response so that its connection is discarded if the response is closed before its body has
+    been entirely read.
+    """
+
+    def __init__(self, response, dropConnection):
+        self.response = response
+        self.dropConnection = dropConnection
+        self.status = response.status
+        self.headers = response.headers
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, size=None):
+        return self.response.read(size)
+
+    def close(self):
+        if not self.response.isclosed():
+            self.response.close()
+            self.dropConnection()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
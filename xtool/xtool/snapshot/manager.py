@@ -8,6 +8,8 @@ import tempfile
 import zipfile
 
 from entities import Snapshot
+from locking import FileLock
+from trash import Trash
 
 
 class SnapshotManager:
@@ -60,6 +62,12 @@ class SnapshotManager:
                                os.path.join(snapshotPath, dir))
 
     def create(self, instanceName):
+        # Prevent the instance from being changed while it is compared to its version
+        with self.instanceManager.getLock(instanceName):
+            self.__create(instanceName)
+
+    def __create(self, instanceName):
+        self.configManager.reload()
         matchingInstances = [i for i in self.configManager.instances() if i['name'] == instanceName]
         if len(matchingInstances) == 1:
             instanceConfig = matchingInstances[0]
@@ -101,39 +109,61 @@ class SnapshotManager:
                                     root_dir=snapshotDir)
 
                 # 4. Save the snapshot information
-                self.configManager.snapshots.append(snapshotEntity)
-                self.configManager.persist()
+                with self.configManager.transaction():
+                    self.configManager.snapshots.append(snapshotEntity)
         else:
             self.logger.error('The instance name [{}] is invalid'.format(instanceName))
 
     def restore(self, snapshotName, overwrite=False):
+        with FileLock('snapshot-{}'.format(snapshotName)):
+            self.__restore(snapshotName, overwrite)
+
+    # Extract the given snapshot over the files of the instance
+    # The files are extracted next to the instance first, then moved in place : writing over the files directly
+    # would also change the version and its other instances when the files are shared through links
+    def __unpack(self, archivePath, instancePath):
+        extractionPath = tempfile.mkdtemp(prefix='.restore-', dir=os.path.dirname(instancePath))
+        try:
+            shutil.unpack_archive(archivePath, extractionPath)
+            for root, dirs, fileNames in os.walk(extractionPath):
+                targetRoot = os.path.join(instancePath, os.path.relpath(root, extractionPath))
+                os.makedirs(targetRoot, exist_ok=True)
+                for fileName in fileNames:
+                    os.replace(os.path.join(root, fileName), os.path.join(targetRoot, fileName))
+        finally:
+            Trash.discard(extractionPath)
+
+    def __restore(self, snapshotName, overwrite):
+        self.configManager.reload()
+
         # Get the configuration of the snapshot
         snapshot = self.configManager.getSnapshot(snapshotName)
         if snapshot:
-            # See if we already have an existing instance with this name
-            matchingInstances = [i for i in self.configManager.instances()
-                                 if i['name'] == snapshot['instance-name']]
-            if len(matchingInstances) == 0 or (len(matchingInstances) == 1 and overwrite):
-                # In case the instance already exists, wipe it
-                if len(matchingInstances) > 0:
-                    self.instanceManager.remove(snapshot['instance-name'])
-
-                # Create a new instance
-                self.instanceManager.create(snapshot['instance-name'], snapshot['version'])
-
-                # Remove unused files / folders
-                for file in snapshot['removed-elements']:
-                    if os.is_dir(file):
-                        os.rmdir(file)
-                    else:
-                        os.remove(file)
-
-                # Unzip the backup that we had
-                shutil.unpack_archive(snapshot.getPath(),
-                                      self.instanceManager.getInstancePath(snapshot['instance-name']))
-
-            else:
-                self.logger.error('An instance with the name [{}] already exists, aborting ...'
-                                  .format(snapshot['instance-name']))
+            # The instance is wiped and recreated from the snapshot
+            with self.instanceManager.getLock(snapshot['instance-name']):
+                # See if we already have an existing instance with this name
+                matchingInstances = [i for i in self.configManager.instances()
+                                     if i['name'] == snapshot['instance-name']]
+                if len(matchingInstances) == 0 or (len(matchingInstances) == 1 and overwrite):
+                    # In case the instance already exists, wipe it
+                    if len(matchingInstances) > 0:
+                        self.instanceManager.remove(snapshot['instance-name'])
+
+                    # Create a new instance
+                    self.instanceManager.create(snapshot['instance-name'], snapshot['version'])
+
+                    # Remove unused files / folders
+                    for file in snapshot['removed-elements']:
+                        if os.is_dir(file):
+                            os.rmdir(file)
+                        else:
+                            os.remove(file)
+
+                    # Unzip the backup that we had
+                    self.__unpack(snapshot.getPath(), self.instanceManager.getInstancePath(snapshot['instance-name']))
+
+                else:
+                    self.logger.error('An instance with the name [{}] already exists, aborting ...'
+                                      .format(snapshot['instance-name']))
         else:
             self.logger.error('The snapshot name [{}] is invalid'.format(snapshotName))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import time
+
+from environment import Environment
+from locking import FileLock
+
+
+class Trash:
+    """
+    Remove directories by moving them to ~/.xtool/trash, which is instant as long as they are on the same file
+    system, their files being deleted later by a reaper running in the background with a low CPU and I/O priority.
+    Only one reaper runs at a time. The entries left behind by an interrupted reaper are deleted by the next one,
+    which any xtool invocation starts when it finds the trash not empty.
+    The entries a reaper failed to delete are recorded in the trash (reaper.json), and only retried after a delay
+    doubling with each failure, so that they do not start a reaper on every invocation.
+    """
+
+    logger = logging.getLogger('Trash')
+
+    # Delays in seconds before retrying to delete an entry, after its first failure and at most
+    retryDelay = 60
+    maxRetryDelay = 24 * 3600
+
+    # Entries are named after their original path followed by a random suffix, they never collide with this file
+    failuresFileName = 'reaper.json'
+
+    @staticmethod
+    def getLock():
+        return FileLock('trash', quiet=True)
+
+    """
+    Move the given file or directory to the trash, and start a reaper to delete it.
+    Paths that cannot be moved to the trash, for instance because they are on another file system, are deleted
+    right away.
+    """
+    @staticmethod
+    def discard(path):
+        if not os.path.lexists(path):
+            return
+        os.makedirs(Environment.trashDir, exist_ok=True)
+        # Each entry gets a unique name, so that trashed paths having the same name never collide ; the path is
+        # renamed in a single step, a running reaper never sees an incomplete entry
+        entryPath = os.path.join(Environment.trashDir, '{}.{}'.format(os.path.basename(path.rstrip(os.sep)),
+                                                                      os.urandom(6).hex()))
+        try:
+            os.rename(path, entryPath)
+        except OSError as e:
+            Trash.logger.debug('Deleting [{}] in place : {}'.format(path, e))
+            Trash.delete(path)
+            return
+        Trash.logger.debug('Moved [{}] to the trash'.format(path))
+        Trash.reapInBackground()
+
+    @staticmethod
+    def delete(path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # Give the owner full access to the directories of the given tree, so that their content can be deleted
+    @staticmethod
+    def makeWritable(path):
+        if os.path.islink(path) or not os.path.isdir(path):
+            return
+        os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) | stat.S_IRWXU)
+        for root, dirs, fileNames in os.walk(path):
+            for directory in dirs:
+                directoryPath = os.path.join(root, directory)
+                if not os.path.islink(directoryPath):
+                    os.chmod(directoryPath, stat.S_IMODE(os.stat(directoryPath).st_mode) | stat.S_IRWXU)
+
+    # Get the entries that failed to be deleted, as a dict entry name -> {attempts, retry}
+    @staticmethod
+    def readFailures():
+        try:
+            with open(os.path.join(Environment.trashDir, Trash.failuresFileName), 'r') as failuresFile:
+                return json.load(failuresFile)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def __writeFailures(failures):
+        failuresPath = os.path.join(Environment.trashDir, Trash.failuresFileName)
+        if not failures:
+            Trash.delete(failuresPath)
+            return
+        temporaryPath = '{}.{}.tmp'.format(failuresPath, os.getpid())
+        with open(temporaryPath, 'w') as failuresFile:
+            json.dump(failures, failuresFile, indent=4)
+        os.replace(temporaryPath, failuresPath)
+
+    # Get the entries of the trash that should be deleted now, leaving out those waiting for a retry
+    @staticmethod
+    def getPendingEntries():
+        try:
+            entries = os.listdir(Environment.trashDir)
+        except FileNotFoundError:
+            return []
+        failures = Trash.readFailures()
+        now = time.time()
+        return [e for e in entries
+                if e != Trash.failuresFileName and not e.startswith('{}.'.format(Trash.failuresFileName))
+                and (e not in failures or failures[e]['retry'] <= now)]
+
+    # Whether the trash has no entry to delete now
+    @staticmethod
+    def isEmpty():
+        return not Trash.getPendingEntries()
+
+    @staticmethod
+    def isReaping():
+        lock = Trash.getLock()
+        if lock.acquire(blocking=False):
+            lock.release()
+            return False
+        return True
+
+    # Start a reaper in a separate process, unless one is already running
+    @staticmethod
+    def reapInBackground():
+        if Trash.isReaping():
+            return
+        command = [sys.executable, os.path.abspath(__file__)]
+        if shutil.which('ionice') is not None:
+            # Idle I/O scheduling class : only use the disk when no other process needs it
+            command = ['ionice', '-c', '3'] + command
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+    """
+    Delete the entries of the trash, until it is empty.
+    Entries that cannot be deleted, even once their directories are made writable, are left in the trash.
+    Returns immediately if another reaper is running.
+    """
+    @staticmethod
+    def reap():
+        lock = Trash.getLock()
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            failures = Trash.readFailures()
+            failedEntries = set()
+            # Entries may be added while the trash is being emptied
+            while True:
+                entries = [e for e in Trash.getPendingEntries() if e not in failedEntries]
+                if not entries:
+                    break
+                for entry in entries:
+                    entryPath = os.path.join(Environment.trashDir, entry)
+                    Trash.logger.debug('Deleting [{}] from the trash'.format(entry))
+                    Trash.delete(entryPath)
+                    if os.path.lexists(entryPath):
+                        # Read-only directories, as extracted from some archives, prevent their content from being
+                        # deleted
+                        try:
+                            Trash.makeWritable(entryPath)
+                        except OSError as e:
+                            Trash.logger.debug('Failed to make [{}] writable : {}'.format(entryPath, e))
+                        Trash.delete(entryPath)
+                    if os.path.lexists(entryPath):
+                        attempts = failures.get(entry, {}).get('attempts', 0) + 1
+                        delay = min(Trash.retryDelay * 2 ** (attempts - 1), Trash.maxRetryDelay)
+                        Trash.logger.warning('Failed to delete [{}] from the trash, retrying in {} seconds'
+                                             .format(entryPath, delay))
+                        failures[entry] = {'attempts': attempts, 'retry': time.time() + delay}
+                        failedEntries.add(entry)
+                    else:
+                        failures.pop(entry, None)
+            # Forget the entries deleted by other means
+            Trash.__writeFailures({e: f for e, f in failures.items()
+                                   if os.path.lexists(os.path.join(Environment.trashDir, e))})
+        except FileNotFoundError:
+            # The trash directory itself is gone
+            pass
+        finally:
+            lock.release()
+
+
+if __name__ == '__main__':
+    os.nice(19)
+    Trash.reap()
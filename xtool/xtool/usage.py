@@ -0,0 +1,203 @@
+from collections import Counter
+import json
+import logging
+import os
+import sqlite3
+import stat
+
+from environment import Environment
+from utils import format_size
+
+
+class DiskUsage:
+    """
+    Account for the disk space used by the versions, the instances and the snapshots.
+    The entries of each directory are cached in a SQLite database (~/.xtool/cache/usage.db) along with the
+    modification time of the directory : the directories that did not change since the last accounting are not
+    listed again. Only the names of the entries are cached, the files themselves are stat'ed on each accounting, as
+    a file growing in place does not change the modification time of its directory.
+    Files hard linked several times are only counted once, like du does. The content an instance shares with its
+    version, through symlinks or hard links, is shown separately from the content that is unique to the instance,
+    the unique content being further split between data/, logs and the rest.
+    """
+
+    logger = logging.getLogger('DiskUsage')
+
+    def __init__(self, configManager, versionManager, instanceManager, refresh=False):
+        self.configManager = configManager
+        self.versionManager = versionManager
+        self.instanceManager = instanceManager
+        self.refresh = refresh
+        self.path = os.path.join(Environment.cacheDir, 'usage.db')
+        self.connection = None
+        # Paths of the directories visited during the accounting, the other directories are dropped from the cache
+        self.visitedDirectories = set()
+
+    def __connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # The directories table cached the stats of the files as well
+        self.connection.execute('DROP TABLE IF EXISTS directories')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, mtime INTEGER, '
+                                'names TEXT)')
+
+    """
+    List the given directory, from the cache if it did not change since it was last listed.
+    Returns a dict giving the names of the subdirectories (dirs), and the files (files) as lists
+    [device, inode, bytes, number of links, whether the file is a symlink], symlinks giving the file they point to
+    """
+    def __listDirectory(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        self.visitedDirectories.add(path)
+        names = None
+        if not self.refresh:
+            row = self.connection.execute('SELECT mtime, names FROM entries WHERE path = ?', (path,)).fetchone()
+            if row is not None and row[0] == mtime:
+                names = json.loads(row[1])
+
+        if names is None:
+            names = {'dirs': [], 'files': []}
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        names['dirs' if entry.is_dir(follow_symlinks=False) else 'files'].append(entry.name)
+                    except OSError:
+                        continue
+            self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                    (path, mtime, json.dumps(names, separators=(',', ':'))))
+
+        content = {'dirs': names['dirs'], 'files': []}
+        for name in names['files']:
+            filePath = os.path.join(path, name)
+            try:
+                fileStat = os.lstat(filePath)
+                isSymlink = stat.S_ISLNK(fileStat.st_mode)
+                if isSymlink:
+                    fileStat = os.stat(filePath)
+            except OSError:
+                # Broken symlink, or file removed in the meantime
+                continue
+            content['files'].append([fileStat.st_dev, fileStat.st_ino, fileStat.st_blocks * 512, fileStat.st_nlink,
+                                     isSymlink])
+        return content
+
+    # Walk the given tree, yielding tuples (path relative to the root, directory content)
+    def __walk(self, rootPath):
+        directories = ['']
+        while directories:
+            relativePath = directories.pop()
+            try:
+                content = self.__listDirectory(os.path.join(rootPath, relativePath) if relativePath else rootPath)
+            except OSError:
+                continue
+            directories += [os.path.join(relativePath, d) for d in content['dirs']]
+            yield relativePath, content
+
+    """
+    Account for the given tree.
+    @param seen : the files with several links that have already been counted, updated with the files of the tree
+    Returns a Counter of bytes by category : size (counted for the tree), shared (symlinks and files already
+    counted elsewhere, for instance in the version of an instance), data and logs (parts of size)
+    """
+    def __account(self, rootPath, seen):
+        usage = Counter()
+        if not os.path.isdir(rootPath):
+            return usage
+
+        for relativePath, content in self.__walk(rootPath):
+            components = relativePath.split(os.sep)
+            for device, inode, size, links, isSymlink in content['files']:
+                key = (device, inode)
+                if isSymlink or key in seen:
+                    usage['shared'] += size
+                    continue
+                usage['size'] += size
+                if components[0] == 'data':
+                    usage['data'] += size
+                elif 'logs' in components:
+                    usage['logs'] += size
+                if links > 1:
+                    seen.add(key)
+        return usage
+
+    def __fileSize(self, path):
+        try:
+            return os.stat(path).st_blocks * 512
+        except OSError:
+            return 0
+
+    # Compute the usage of all the entities, as a dict ready to be serialized in JSON
+    def compute(self):
+        self.__connect()
+        seen = set()
+        report = {'versions': {}, 'instances': {}, 'snapshots': {}, 'other': {}}
+
+        # The versions come first, so that the files shared with their instances are counted for the versions
+        for version in self.configManager.versions():
+            if self.versionManager.cache.isCold(version):
+                report['versions'][version] = {
+                    'size': self.__fileSize(self.versionManager.cache.getColdArchivePath(version)),
+                    'shared': 0,
+                    'cold': True
+                }
+            else:
+                usage = self.__account(self.versionManager.getDirectoryPath(version), seen)
+                report['versions'][version] = {'size': usage['size'], 'shared': usage['shared'], 'cold': False}
+
+        for instance in self.configManager.instances():
+            usage = self.__account(self.instanceManager.getInstancePath(instance['name']), seen)
+            report['instances'][instance['name']] = {
+                'version': instance['version'],
+                'size': usage['size'],
+                'data': usage['data'],
+                'logs': usage['logs'],
+                'shared': usage['shared']
+            }
+
+        for snapshot in self.configManager.snapshots:
+            report['snapshots'][snapshot['name']] = {'size': self.__fileSize(snapshot.getPath())}
+
+        for name, path in [('pool', Environment.poolDir), ('seeds', Environment.seedsDir),
+                           ('cache', Environment.cacheDir), ('trash', Environment.trashDir),
+                           ('stats', Environment.statsDir)]:
+            report['other'][name] = {'size': self.__account(path, seen)['size']}
+
+        report['total'] = sum(entity['size'] for category in ['versions', 'instances', 'snapshots', 'other']
+                              for entity in report[category].values())
+
+        # Forget the directories that do not exist anymore
+        cachedDirectories = [row[0] for row in self.connection.execute('SELECT path FROM entries')]
+        self.connection.executemany('DELETE FROM entries WHERE path = ?',
+                                    [(p,) for p in cachedDirectories if p not in self.visitedDirectories])
+        self.connection.commit()
+        self.connection.close()
+        return report
+
+    def show(self, asJson=False):
+        report = self.compute()
+        if asJson:
+            print(json.dumps(report, indent=4))
+            return
+
+        rowFormat = '{:<30}{:>14}{:>14}{:>14}{:>14}'
+        print(rowFormat.format('Versions', 'Size', '', '', 'Shared'))
+        for version, usage in sorted(report['versions'].items()):
+            print(rowFormat.format('  {}{}'.format(version, ' (cold)' if usage['cold'] else ''),
+                                   format_size(usage['size']), '', '', format_size(usage['shared'])))
+
+        print(rowFormat.format('Instances', 'Unique', 'Data', 'Logs', 'Shared'))
+        for name, usage in sorted(report['instances'].items()):
+            print(rowFormat.format('  {} ({})'.format(name, usage['version']), format_size(usage['size']),
+                                   format_size(usage['data']), format_size(usage['logs']),
+                                   format_size(usage['shared'])))
+
+        if report['snapshots']:
+            print(rowFormat.format('Snapshots', 'Size', '', '', ''))
+            for name, usage in sorted(report['snapshots'].items()):
+                print(rowFormat.format('  {}'.format(name), format_size(usage['size']), '', '', ''))
+
+        print(rowFormat.format('Other', 'Size', '', '', ''))
+        for name, usage in report['other'].items():
+            print(rowFormat.format('  {}'.format(name), format_size(usage['size']), '', '', ''))
+        print(rowFormat.format('Total', format_size(report['total']), '', '', ''))
@@ -1,11 +1,11 @@
 # Define a set of utility functions to initialize the environment
 import argparse
 import binascii
-import hashlib
 import logging
 import os
 import sys
 
+from fingerprint import FingerprintCache
 from version.parser import VersionParser
 from instance.parser import InstanceParser
 from snapshot.parser import SnapshotParser
@@ -37,34 +37,33 @@ def valid_config(configArg):
         return configArg
 
 
-def random_chars(numberOfChars):
-    return binascii.b2a_hex(os.urandom(numberOfChars)).decode('UTF-8')
+# Parse a size such as 512M or 20G into a number of bytes
+def parse_size(size):
+    if size is None or isinstance(size, int):
+        return size
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
 
 
-def tqdm_download_hook(t):
-    # Code snippet taken from
-    # https://github.com/tqdm/tqdm/blob/cd7f61b4562fb2f4aad560edf094a2ddad1ae3b7/examples/tqdm_wget.py#L28
-    last_b = [0]
+# Format a number of bytes for humans, the counterpart of parse_size
+def format_size(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(size) < 1024 or unit == 'GiB':
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
 
-    def update_to(b=1, bsize=1, tsize=None):
-        if tsize not in (None, -1):
-            t.total = tsize
-        t.update((b - last_b[0]) * bsize)
-        last_b[0] = b
 
-    return update_to
+def random_chars(numberOfChars):
+    return binascii.b2a_hex(os.urandom(numberOfChars)).decode('UTF-8')
 
 
-# Return the MD5 sum of a file
-def compute_checksum(path):
-    with open(path, 'rb') as f:
-        digest = hashlib.md5()
-        while True:
-            data = f.read(8192)
-            if not data:  # In case we're at the end of the file
-                break
-            digest.update(data)
-        return digest.hexdigest()
+# Return the checksum of a file, MD5 by default
+# Use the 'fast' algorithm to compare local files, the checksums being cached as long as the files are unchanged
+def compute_checksum(path, algorithm='md5'):
+    return FingerprintCache.get().digest(path, algorithm)
 
 
 def parse_args():
@@ -102,6 +101,12 @@ def parse_args():
     configParser.add_argument('property_name', help='the name of the property')
     configParser.add_argument('-s', '--set', metavar='VALUE', type=valid_config, help='set the value of the property')
 
+    # Usage action
+    usageParser = subParsers.add_parser('usage', help='show the disk space used by the versions and the instances')
+    usageParser.add_argument('-j', '--json', action='store_true', help='print the usage as JSON')
+    usageParser.add_argument('-r', '--refresh', action='store_true',
+                             help='list every directory again instead of reusing the cached listings')
+
     # Entity-related parsers
     versionParser = subParsers.add_parser('version', aliases=['v'], help='manage versions')
     versionSubParsers = versionParser.add_subparsers(dest='subAction', required=True, help='the action to perform')
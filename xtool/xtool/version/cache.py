@@ -0,0 +1,110 @@
+import logging
+import os
+import shutil
+import stat
+
+from environment import Environment
+from trash import Trash
+
+
+class VersionCache:
+    """
+    Keep the versions directory within a size budget.
+    Versions are considered from the least recently used one : versions that no instance uses are removed, while
+    versions still used by an instance are packed into a compressed archive (the cold tier) and transparently
+    extracted again the next time they are needed.
+    """
+
+    logger = logging.getLogger('VersionCache')
+
+    def __init__(self, versionManager):
+        self.versionManager = versionManager
+        self.configManager = versionManager.configManager
+        # Whether the directory of a version is needed by its instances, set by the instance manager which knows
+        # about them : until then, the versions used by an instance are never packed
+        self.isInUse = lambda version: True
+
+    def __getArchiveFormat(self):
+        return self.configManager.get('coldArchiveFormat') or 'gztar'
+
+    def getColdArchivePath(self, version, includeExtension=True):
+        extension = ''
+        if includeExtension:
+            for name, extensions, description in shutil.get_unpack_formats():
+                if name == self.__getArchiveFormat():
+                    extension = extensions[0]
+        return os.path.join(Environment.coldVersionsDir,
+                            '{}{}'.format(self.versionManager.getVersionBaseName(version), extension))
+
+    def isCold(self, version):
+        return (not os.path.isdir(self.versionManager.getDirectoryPath(version))
+                and os.path.isfile(self.getColdArchivePath(version)))
+
+    # Compute the disk usage of a version, files shared with other versions through hard links are split between them
+    def getSize(self, version):
+        size = 0
+        for root, dirs, fileNames in os.walk(self.versionManager.getDirectoryPath(version)):
+            for fileName in fileNames:
+                fileStat = os.lstat(os.path.join(root, fileName))
+                if stat.S_ISREG(fileStat.st_mode):
+                    size += fileStat.st_blocks * 512 // fileStat.st_nlink
+        return size
+
+    # Pack the given version in the cold tier and remove its directory
+    def freeze(self, version):
+        self.logger.info('Packing version {} in [{}] ...'.format(version, Environment.coldVersionsDir))
+        os.makedirs(Environment.coldVersionsDir, exist_ok=True)
+        temporaryBase = '{}.tmp'.format(self.getColdArchivePath(version, includeExtension=False))
+        archivePath = shutil.make_archive(temporaryBase,
+                                          self.__getArchiveFormat(),
+                                          root_dir=Environment.dataDir,
+                                          base_dir=self.versionManager.getVersionBaseName(version))
+        os.replace(archivePath, self.getColdArchivePath(version))
+        Trash.discard(self.versionManager.getDirectoryPath(version))
+
+    # Extract the given version from the cold tier
+    def thaw(self, version):
+        self.logger.info('Extracting version {} from the cold tier ...'.format(version))
+        shutil.unpack_archive(self.getColdArchivePath(version), Environment.dataDir)
+        os.remove(self.getColdArchivePath(version))
+
+    def removeColdArchive(self, version):
+        if os.path.exists(self.getColdArchivePath(version)):
+            os.remove(self.getColdArchivePath(version))
+
+    """
+    Evict the least recently used versions until the versions directory fits in the given budget (in bytes).
+    @param keptVersions : versions that are about to be used and should not be evicted, such as a version that has
+    just been downloaded to create an instance
+    """
+    def trim(self, budget, keptVersions=()):
+        usage = self.configManager.versionsUsage()
+        referencedVersions = set(i['version'] for i in self.configManager.instances())
+        extractedVersions = [v for v in self.configManager.versions()
+                             if os.path.isdir(self.versionManager.getDirectoryPath(v))]
+        sizes = {v: self.getSize(v) for v in extractedVersions}
+        totalSize = sum(sizes.values())
+        self.logger.debug('Versions use {} bytes, budget is {} bytes'.format(totalSize, budget))
+
+        for version in sorted(extractedVersions, key=lambda v: usage.get(v, 0)):
+            if totalSize <= budget:
+                break
+            if version in keptVersions:
+                continue
+            if version in referencedVersions:
+                if self.isInUse(version):
+                    self.logger.debug('Keeping version {}, its instances use its directory'.format(version))
+                    continue
+                with self.versionManager.getLock(version):
+                    # An instance may have been started or linked to the version while waiting for the lock
+                    if self.isInUse(version):
+                        self.logger.debug('Keeping version {}, it is now in use'.format(version))
+                        continue
+                    self.freeze(version)
+            else:
+                self.versionManager.remove(version)
+            totalSize -= sizes[version]
+
+        if totalSize > budget:
+            self.logger.warning('The versions still use {:.1f} MiB, above the budget of {:.1f} MiB'
+                                .format(totalSize / (1024 * 1024), budget / (1024 * 1024)))
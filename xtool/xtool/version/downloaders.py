@@ -3,32 +3,59 @@ import os
 from packaging import version as Version
 from tqdm import tqdm
 import urllib.error
-import urllib.request
 import xml.etree.ElementTree as ET
 
+from environment import Environment
 from utils import compute_checksum
-from utils import tqdm_download_hook
+
+from version.installer import StreamingInstaller
+from version.transfer import RangeDownloader
 
 
 # Handles the download of an XWiki version
 class VersionDownloader:
     logger = logging.getLogger('VersionDownloader')
+    # checksum sidecars published by Maven, by order of preference
+    checksumAlgorithms = ['sha256', 'sha1', 'md5']
+
+    repositoryURL = 'https://maven.xwiki.org/{category}'
+    platformArtifactPath = 'org/xwiki/platform/xwiki-platform-distribution-flavor-jetty-hsqldb'
+    enterpriseArtifactPath = 'org/xwiki/enterprise/xwiki-enterprise-jetty-hsqldb'
 
     # version : the version that needs to be downloaded
     # versionManager : the version manager
-    def __init__(self, version, versionManager, category='releases'):
+    # progressPosition : the line on which the progress bar should be displayed, when several downloads run together
+    # repositoryURL : the root URL of the Maven repository, where {category} is replaced by releases or snapshots
+    def __init__(self, version, versionManager, category='releases', progressPosition=None, repositoryURL=None):
         self.version = version
 
         self.versionManager = versionManager
         self.versionCategory = category
+        self.progressPosition = progressPosition
+        self.repositoryURL = repositoryURL or VersionDownloader.repositoryURL
+        # The (algorithm, hexdigest) checksum of the archive, once fetched
+        self.checksum = None
+
+    def _progressBar(self, total=None):
+        return tqdm(total=total, desc=self.version if self.progressPosition is not None else None,
+                    position=self.progressPosition, leave=self.progressPosition is None,
+                    unit='B', unit_scale=True, unit_divisor=1024, miniters=1)
+
+    # Get the build of the version that is downloaded, only relevant for snapshots
+    def getBuild(self):
+        return None
+
+    # Generate the link to the artifact folder, containing one folder per version and the artifact metadata
+    @staticmethod
+    def generateArtifactLink(repositoryURL, category, platform=True):
+        artifactPath = VersionDownloader.platformArtifactPath if platform else VersionDownloader.enterpriseArtifactPath
+        return '{}/{}'.format(repositoryURL.format(category=category).rstrip('/'), artifactPath)
 
     def _generateFolderLink(self):
-        if self.version.endswith('-SNAPSHOT') or Version.parse(self.version) >= self.versionManager.migrationVersion:
-            baseURL = 'https://maven.xwiki.org/{}/org/xwiki/platform/xwiki-platform-distribution-flavor-jetty-hsqldb/{}'
-        else:
-            baseURL = 'https://maven.xwiki.org/{}/org/xwiki/enterprise/xwiki-enterprise-jetty-hsqldb/{}'
-
-        return baseURL.format(self.versionCategory, self.version)
+        platform = (self.version.endswith('-SNAPSHOT')
+                    or Version.parse(self.version) >= self.versionManager.migrationVersion)
+        return '{}/{}'.format(self.generateArtifactLink(self.repositoryURL, self.versionCategory, platform),
+                              self.version)
 
     def _generateRemoteFileName(self, version, extension):
         if self.version.endswith('-SNAPSHOT') or Version.parse(self.version) >= self.versionManager.migrationVersion:
@@ -41,44 +68,84 @@ class VersionDownloader:
     def _generateDownloadLink(self, extension):
         return '{}/{}'.format(self._generateFolderLink(), self._generateRemoteFileName(self.version, extension))
 
-    # Will safely download a file and check its MD5 sum before returning
-    def __safeDownloadFile(self, fileURL, md5FileURL, destinationPath):
-        try:
-            # Test if we don't get a 404 error or something similar
-            self.logger.debug('Testing url [{}]'.format(md5FileURL))
-            md5Sum = urllib.request.urlopen(md5FileURL).read().decode('utf-8')
-
-            # Actually download the archive
-            self.logger.info('Downloading file [{}] ...'.format(fileURL))
-            with tqdm(unit='B', unit_scale=True, unit_divisor=1024, miniters=1) as t:
-                urllib.request.urlretrieve(fileURL, destinationPath, reporthook=tqdm_download_hook(t))
-            fileMD5Sum = compute_checksum(destinationPath)
-
-            # Verify the control sum of the downloaded file
-            self.logger.debug('Checking file integrity ...')
-            self.logger.debug('EXPECTED : {}'.format(md5Sum))
-            self.logger.debug('ACTUAL   : {}'.format(fileMD5Sum))
-            if fileMD5Sum != md5Sum:
-                # If it's actually the case, delete the download files and quit
-                os.remove(destinationPath)
-                raise IOError('The control sum of the downloaded file is invalid. Aborting.')
-            return
-        except urllib.error.HTTPError as e:
-            self.logger.debug('Gotten error {}'.format(e))
-            self.logger.error('The URL [{}] is either unaccesible or unavailable'.format(md5FileURL))
-            raise e
+    # Fetch the checksum of the archive from the first sidecar file published next to it
+    # Returns a tuple (algorithm, hexdigest)
+    def _fetchChecksum(self):
+        lastError = None
+        for algorithm in self.checksumAlgorithms:
+            checksumURL = self._generateDownloadLink('zip.{}'.format(algorithm))
+            try:
+                # Test if we don't get a 404 error or something similar
+                self.logger.debug('Testing url [{}]'.format(checksumURL))
+                checksum = self.versionManager.httpClient.fetch(checksumURL).decode('utf-8')
+                # Some repositories append the file name after the checksum
+                self.checksum = (algorithm, checksum.split()[0].strip().lower())
+                return self.checksum
+            except urllib.error.HTTPError as e:
+                self.logger.debug('No {} checksum available : {}'.format(algorithm, e))
+                lastError = e
+
+        self.logger.error('No checksum could be found for the archive [{}]'.format(self._generateDownloadLink('zip')))
+        raise lastError
+
+    # Will safely download a file and check its checksum before returning
+    def __safeDownloadFile(self, fileURL, destinationPath):
+        algorithm, expectedChecksum = self._fetchChecksum()
+
+        # Actually download the archive
+        self.logger.info('Downloading file [{}] ...'.format(fileURL))
+        workers = self.versionManager.configManager.get('downloadWorkers') or 1
+        with self._progressBar() as t:
+            RangeDownloader(self.versionManager.httpClient, fileURL, destinationPath, int(workers)).download(t)
+        fileChecksum = compute_checksum(destinationPath, algorithm)
+
+        # Verify the control sum of the downloaded file
+        self.logger.debug('Checking file integrity ...')
+        self.logger.debug('EXPECTED : {}'.format(expectedChecksum))
+        self.logger.debug('ACTUAL   : {}'.format(fileChecksum))
+        if fileChecksum != expectedChecksum:
+            # If it's actually the case, delete the download files and quit
+            os.remove(destinationPath)
+            raise IOError('The control sum of the downloaded file is invalid. Aborting.')
 
     # Tries to download the file
     # Returns True if the download occured, false in any other case.
     def download(self):
         zipDownloadURL = self._generateDownloadLink('zip')
-        md5DownloadURL = self._generateDownloadLink('zip.md5')
         archivePath = self.versionManager.getArchivePath(self.version)
 
         try:
-            self.__safeDownloadFile(zipDownloadURL, md5DownloadURL, archivePath)
+            self.__safeDownloadFile(zipDownloadURL, archivePath)
             return True
-        except (urllib.error.HTTPError, urllib.error.URLError) as e:
+        except OSError as e:
+            # URL errors, connection errors, as well as invalid archives
+            self.logger.error('Error while downloading file : {}'.format(e))
+            self.logger.info('Skipping version {}'.format(self.version))
+            return False
+
+    # Download the archive and extract it on the fly in the version directory, without storing the archive
+    # Returns True if the installation occured, false in any other case.
+    def install(self):
+        zipDownloadURL = self._generateDownloadLink('zip')
+
+        try:
+            checksum = self._fetchChecksum()
+
+            self.logger.info('Downloading and extracting file [{}] ...'.format(zipDownloadURL))
+            with self.versionManager.httpClient.open(zipDownloadURL) as response:
+                size = response.getheader('Content-Length')
+                with self._progressBar(int(size) if size else None) as t:
+                    manifest = StreamingInstaller(Environment.dataDir).install(
+                        response,
+                        self.versionManager.getVersionBaseName(self.version),
+                        self.versionManager.getDirectoryPath(self.version),
+                        checksum,
+                        t)
+            manifest.build = self.getBuild()
+            self.versionManager.saveManifest(self.version, manifest)
+            return True
+        except OSError as e:
+            # URL errors, connection errors, as well as invalid archives
             self.logger.error('Error while downloading file : {}'.format(e))
             self.logger.info('Skipping version {}'.format(self.version))
             return False
@@ -89,17 +156,19 @@ class VersionDownloader:
 class SnapshotVersionDownloader(VersionDownloader):
     logger = logging.getLogger('SnapshotVersionDownloader')
 
-    def __init__(self, version, versionManager):
-        super().__init__(version, versionManager, category='snapshots')
+    # metadataMaxAge : the maximum age of the cached maven metadata, use 0 to always check for a new build
+    def __init__(self, version, versionManager, progressPosition=None, repositoryURL=None, metadataMaxAge=None):
+        super().__init__(version, versionManager, category='snapshots', progressPosition=progressPosition,
+                         repositoryURL=repositoryURL)
         self.snapshotVersion = None
-        self.__getSnapshotVersionValue()
+        self.__getSnapshotVersionValue(metadataMaxAge)
 
-    def __getSnapshotVersionValue(self):
+    def __getSnapshotVersionValue(self, metadataMaxAge):
         self.logger.debug('Fetching the maven-metadata.xml file from the SNAPSHOT version ...')
         mavenMetadataURL = '{}/maven-metadata.xml'.format(self._generateFolderLink())
 
         try:
-            mavenMetadata = urllib.request.urlopen(mavenMetadataURL).read().decode('utf-8')
+            mavenMetadata = self.versionManager.metadataCache.get(mavenMetadataURL, metadataMaxAge)
             metadataRoot = ET.fromstring(mavenMetadata)
 
             self.snapshotVersion = (
@@ -110,3 +179,6 @@ class SnapshotVersionDownloader(VersionDownloader):
 
     def _generateDownloadLink(self, extension):
         return '{}/{}'.format(self._generateFolderLink(), self._generateRemoteFileName(self.snapshotVersion, extension))
+
+    def getBuild(self):
+        return self.snapshotVersion
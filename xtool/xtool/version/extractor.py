@@ -0,0 +1,126 @@
+import logging
+import multiprocessing
+import os
+import stat
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Run in the worker processes : each worker opens its own handle on the archive
+def extractEntries(archivePath, targetDir, names):
+    with zipfile.ZipFile(archivePath, 'r') as zipRef:
+        for name in names:
+            entry = zipRef.getinfo(name)
+            path = zipRef.extract(entry, targetDir)
+            ArchiveExtractor.applyPermissions(entry, path)
+    return len(names)
+
+
+class ArchiveExtractor:
+    """
+    Extract zip archives by spreading their entries over a pool of processes, inflating being bound by the CPU.
+    The entries of each archive are split in batches of similar sizes, one per worker, and the permissions recorded
+    in the archive are restored on the extracted files.
+    Used as a context manager, the extractor keeps its worker processes until it is exited, so that the archives
+    extracted concurrently by several threads share the same workers instead of each starting as many processes as
+    there are CPUs.
+    """
+
+    logger = logging.getLogger('ArchiveExtractor')
+
+    # Below this number of files, starting the worker processes costs more than it saves
+    minParallelEntries = 64
+
+    def __init__(self, workers=None):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.executor = None
+        self.executorLock = threading.Lock()
+        self.shared = False
+
+    def __enter__(self):
+        self.shared = True
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.shared = False
+        self.__shutdown()
+
+    # Forking a process running other threads, such as concurrent downloads, could leave a lock held in the child
+    @staticmethod
+    def __getContext():
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('forkserver')
+        return multiprocessing.get_context('spawn')
+
+    def __getExecutor(self):
+        with self.executorLock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.__getContext())
+            return self.executor
+
+    def __shutdown(self):
+        with self.executorLock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    # Only archives created on Unix systems carry permissions
+    @staticmethod
+    def applyPermissions(entry, path):
+        mode = entry.external_attr >> 16
+        if entry.create_system == 3 and mode and (stat.S_ISREG(mode) or stat.S_ISDIR(mode)):
+            os.chmod(path, stat.S_IMODE(mode))
+
+    # Split the given entries in batches of similar uncompressed sizes, largest entries first
+    def __makeBatches(self, entries):
+        batches = [[0, []] for i in range(min(self.workers, len(entries)))]
+        for entry in sorted(entries, key=lambda e: e.file_size, reverse=True):
+            batch = min(batches, key=lambda b: b[0])
+            batch[0] += entry.file_size
+            batch[1].append(entry.filename)
+        return [names for size, names in batches]
+
+    """
+    Extract each of the given archives in its target directory.
+    @param archives : a list of tuples (archive path, target directory)
+    Returns a dict associating the path of each archive to the list of its entries
+    """
+    def extract(self, archives):
+        archiveEntries = {}
+        batches = []
+        directories = []
+        for archivePath, targetDir in archives:
+            files = []
+            with zipfile.ZipFile(archivePath, 'r') as zipRef:
+                archiveEntries[archivePath] = zipRef.infolist()
+                # Create the directories beforehand so that the workers do not race on them
+                for entry in archiveEntries[archivePath]:
+                    if entry.is_dir():
+                        directories.append((entry, zipRef.extract(entry, targetDir)))
+                    else:
+                        # Archives do not always list the parent directories of their files
+                        parentDir = os.path.dirname(os.path.normpath(os.path.join(targetDir, entry.filename)))
+                        if os.path.commonpath([parentDir, targetDir]) == os.path.normpath(targetDir):
+                            os.makedirs(parentDir, exist_ok=True)
+                        files.append(entry)
+            batches += [(archivePath, targetDir, names) for names in self.__makeBatches(files)]
+
+        totalEntries = sum(len(entries) for entries in archiveEntries.values())
+        if self.workers == 1 or totalEntries < self.minParallelEntries:
+            for batch in batches:
+                extractEntries(*batch)
+        else:
+            self.logger.debug('Extracting {} entries with {} processes'.format(totalEntries, self.workers))
+            try:
+                executor = self.__getExecutor()
+                for future in [executor.submit(extractEntries, *batch) for batch in batches]:
+                    future.result()
+            finally:
+                if not self.shared:
+                    self.__shutdown()
+
+        # Directories are only restricted once their content has been written
+        for entry, path in directories:
+            self.applyPermissions(entry, path)
+        return archiveEntries
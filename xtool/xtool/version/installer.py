@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import zipfile
+import zlib
+
+from trash import Trash
+
+from version.manifest import VersionManifest
+
+
+class DigestReader:
+    """
+    Wrap a readable stream so that every byte read from it is fed to a digest and reported to an optional
+    progress bar. Data that has been read too far can be pushed back to be read again without being digested twice.
+    """
+
+    def __init__(self, stream, algorithm, progress=None):
+        self.stream = stream
+        self.digest = hashlib.new(algorithm)
+        self.progress = progress
+        self.pushedBack = b''
+
+    def read(self, size):
+        if self.pushedBack:
+            data, self.pushedBack = self.pushedBack[:size], self.pushedBack[size:]
+            return data
+
+        data = self.stream.read(size)
+        if data:
+            self.digest.update(data)
+            if self.progress is not None:
+                self.progress.update(len(data))
+        return data
+
+    def unread(self, data):
+        self.pushedBack = data + self.pushedBack
+
+    def readExactly(self, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            data = self.read(remaining)
+            if not data:
+                raise IOError('Unexpected end of stream ({} bytes missing)'.format(remaining))
+            chunks.append(data)
+            remaining -= len(data)
+        return b''.join(chunks)
+
+    def drain(self):
+        remaining = []
+        while True:
+            data = self.read(256 * 1024)
+            if not data:
+                return b''.join(remaining)
+            remaining.append(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class StreamingInstaller:
+    """
+    Extract a zip archive while it is being downloaded.
+    The local file headers of the archive are read sequentially from the stream, each entry is inflated into a
+    staging directory and the digest of the whole stream is computed on the fly. Once the end of the stream is
+    reached and the digest matches the expected checksum, the extracted directory is renamed into place.
+    """
+
+    logger = logging.getLogger('StreamingInstaller')
+
+    localHeaderSignature = 0x04034b50
+    centralHeaderSignature = 0x02014b50
+    dataDescriptorSignature = 0x08074b50
+    zip64ExtraId = 0x0001
+    bufferSize = 256 * 1024
+
+    def __init__(self, baseDir):
+        self.baseDir = baseDir
+
+    def __zip64Sizes(self, extra, compressedSize, uncompressedSize):
+        offset = 0
+        while offset + 4 <= len(extra):
+            headerId, dataSize = struct.unpack('<HH', extra[offset:offset + 4])
+            if headerId == self.zip64ExtraId:
+                values = extra[offset + 4:offset + 4 + dataSize]
+                position = 0
+                if uncompressedSize == 0xFFFFFFFF:
+                    uncompressedSize = struct.unpack('<Q', values[position:position + 8])[0]
+                    position += 8
+                if compressedSize == 0xFFFFFFFF:
+                    compressedSize = struct.unpack('<Q', values[position:position + 8])[0]
+                return compressedSize, uncompressedSize, True
+            offset += 4 + dataSize
+        return compressedSize, uncompressedSize, False
+
+    def __safePath(self, stagingDir, name):
+        path = os.path.normpath(os.path.join(stagingDir, name))
+        if os.path.isabs(name) or not path.startswith(stagingDir + os.sep):
+            raise IOError('Refusing to extract entry [{}] outside of the target directory'.format(name))
+        return path
+
+    def __extractEntry(self, reader, targetFile, method, hasDescriptor, compressedSize):
+        actualCRC = 0
+
+        if method == zipfile.ZIP_STORED:
+            if hasDescriptor:
+                raise IOError('Stored entries with a data descriptor cannot be streamed')
+            remaining = compressedSize
+            while remaining > 0:
+                data = reader.readExactly(min(self.bufferSize, remaining))
+                actualCRC = zlib.crc32(data, actualCRC)
+                targetFile.write(data)
+                remaining -= len(data)
+        elif method == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            remaining = compressedSize
+            while not decompressor.eof:
+                if hasDescriptor:
+                    # The compressed size is unknown, rely on the end of the deflate stream instead
+                    data = reader.read(self.bufferSize)
+                else:
+                    data = reader.read(min(self.bufferSize, remaining))
+                    remaining -= len(data)
+                if not data:
+                    raise IOError('Unexpected end of stream in a compressed entry')
+                inflated = decompressor.decompress(data)
+                actualCRC = zlib.crc32(inflated, actualCRC)
+                targetFile.write(inflated)
+            # Whatever was read past the end of the entry belongs to the next record
+            reader.unread(decompressor.unused_data)
+        else:
+            raise IOError('Unsupported compression method [{}]'.format(method))
+
+        return actualCRC
+
+    def __readDataDescriptor(self, reader, zip64):
+        crc = struct.unpack('<I', reader.readExactly(4))[0]
+        if crc == self.dataDescriptorSignature:
+            # The descriptor signature is optional
+            crc = struct.unpack('<I', reader.readExactly(4))[0]
+        reader.readExactly(16 if zip64 else 8)
+        return crc
+
+    def __applyPermissions(self, stagingDir, centralDirectory):
+        offset = 0
+        while offset + 46 <= len(centralDirectory):
+            signature = struct.unpack('<I', centralDirectory[offset:offset + 4])[0]
+            if signature != self.centralHeaderSignature:
+                break
+            (createSystem, nameLength, extraLength, commentLength, externalAttributes) = (
+                centralDirectory[offset + 5],
+                *struct.unpack('<HHH', centralDirectory[offset + 28:offset + 34]),
+                struct.unpack('<I', centralDirectory[offset + 38:offset + 42])[0])
+            name = centralDirectory[offset + 46:offset + 46 + nameLength].decode('utf-8')
+            mode = externalAttributes >> 16
+            # Only archives created on Unix systems carry permissions
+            if createSystem == 3 and mode and stat.S_ISREG(mode):
+                path = self.__safePath(stagingDir, name)
+                if os.path.isfile(path):
+                    os.chmod(path, stat.S_IMODE(mode))
+            offset += 46 + nameLength + extraLength + commentLength
+
+    def __extract(self, reader, stagingDir, entries):
+        while True:
+            header = reader.readExactly(30)
+            signature = struct.unpack('<I', header[:4])[0]
+
+            if signature != self.localHeaderSignature:
+                # We reached the central directory (or the end of the archive), read it to restore permissions
+                if signature == self.centralHeaderSignature:
+                    self.__applyPermissions(stagingDir, header + reader.drain())
+                else:
+                    reader.drain()
+                return
+
+            (flags, method, crc, compressedSize, uncompressedSize, nameLength, extraLength) = (
+                struct.unpack('<HH4xIIIHH', header[6:30]))
+            name = reader.readExactly(nameLength).decode('utf-8' if flags & 0x800 else 'cp437')
+            extra = reader.readExactly(extraLength)
+            compressedSize, uncompressedSize, zip64 = self.__zip64Sizes(extra, compressedSize, uncompressedSize)
+
+            path = self.__safePath(stagingDir, name)
+            if name.endswith('/'):
+                os.makedirs(path, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as targetFile:
+                actualCRC = self.__extractEntry(reader, targetFile, method, flags & 0x08, compressedSize)
+            if flags & 0x08:
+                crc = self.__readDataDescriptor(reader, zip64)
+            if actualCRC != crc:
+                raise IOError('Corrupted entry [{}] in the archive'.format(name))
+            entries.append(zipfile.ZipInfo(name))
+            entries[-1].file_size = os.path.getsize(path)
+            entries[-1].CRC = crc
+
+    """
+    Extract the zip archive read from the given stream into the given target directory.
+    @param stream : a readable stream of the archive
+    @param archiveDirName : the name of the top level directory contained in the archive
+    @param targetPath : the final location of the extracted directory
+    @param expectedChecksum : a tuple (algorithm, hexdigest) that the whole stream should match
+    @param progress : an optional tqdm instance
+    Returns the manifest of the extracted files
+    """
+    def install(self, stream, archiveDirName, targetPath, expectedChecksum, progress=None):
+        algorithm, expectedDigest = expectedChecksum
+        reader = DigestReader(stream, algorithm, progress)
+
+        stagingDir = tempfile.mkdtemp(prefix='.staging-', dir=self.baseDir)
+        entries = []
+        try:
+            self.__extract(reader, stagingDir, entries)
+
+            self.logger.debug('Checking archive integrity ...')
+            self.logger.debug('EXPECTED : {}'.format(expectedDigest))
+            self.logger.debug('ACTUAL   : {}'.format(reader.hexdigest()))
+            if reader.hexdigest() != expectedDigest:
+                raise IOError('The control sum of the downloaded file is invalid. Aborting.')
+
+            extractedPath = os.path.join(stagingDir, archiveDirName)
+            if not os.path.isdir(extractedPath):
+                raise IOError('The archive does not contain the expected directory [{}]'.format(archiveDirName))
+            if os.path.isdir(targetPath):
+                Trash.discard(targetPath)
+            os.rename(extractedPath, targetPath)
+            return VersionManifest.fromZipEntries(entries, archiveDirName)
+        finally:
+            shutil.rmtree(stagingDir, ignore_errors=True)
@@ -1,13 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+import datetime
 import logging
 import os
 from packaging import version as Version
-import shutil
+import queue
+import time
+from tqdm import tqdm
+import urllib.error
+import xml.etree.ElementTree as ET
 import zipfile
 
 from environment import Environment
+from locking import FileLock
+from network import HttpClient
+from trash import Trash
+from utils import parse_size
 
+from version.cache import VersionCache
 from version.downloaders import VersionDownloader
-from version.downloaders import SnapshotVersionDownloader
+from version.extractor import ArchiveExtractor
+from version.manifest import VersionManifest
+from version.metadata import MetadataCache
+from version.sources import ArtifactSource
+from version.sources import LocalArtifactSource
+from version.store import ContentStore
+from version.updater import SnapshotUpdater
 
 
 class VersionManager:
@@ -17,13 +35,43 @@ class VersionManager:
 
     def __init__(self, configManager):
         self.configManager = configManager
+        self.httpClient = HttpClient()
+        self.metadataCache = MetadataCache(self.httpClient, self.configManager.get('metadataCacheTTL') or 0)
+        self.cache = VersionCache(self)
+        # Extractor shared by the concurrent downloads, see downloadAll
+        self.extractor = None
         self.migrateVersions()
 
     def list(self):
-        rowFormat = '{}'
-        print(rowFormat.format('Version'))
+        rowFormat = '{:<25}{}'
+        print(rowFormat.format('Version', 'Last used'))
+        usage = self.configManager.versionsUsage()
         for version in self.configManager.versions():
-            print(rowFormat.format(version))
+            lastUsed = datetime.datetime.fromtimestamp(usage[version]).__format__('%a %d %b %Y - %H:%M') \
+                if version in usage else ''
+            print(rowFormat.format(version, '{}{}'.format(lastUsed, ' (cold)' if self.cache.isCold(version) else '')))
+
+    # List the versions available in the remote repository, based on the cached Maven metadata
+    def listRemote(self, snapshots=False):
+        categories = [('releases', True), ('releases', False)]
+        if snapshots:
+            categories.append(('snapshots', True))
+        repositoryURLs = [s.location for s in self.getArtifactSources() if s.isRemote()]
+        metadataURLs = ['{}/maven-metadata.xml'.format(VersionDownloader.generateArtifactLink(url, category, platform))
+                        for url in repositoryURLs for category, platform in categories]
+
+        remoteVersions = set()
+        for metadataURL in dict.fromkeys(metadataURLs):
+            try:
+                remoteVersions.update(self.metadataCache.getVersions(metadataURL))
+            except (urllib.error.URLError, ET.ParseError) as e:
+                self.logger.error('Failed to fetch the list of versions from [{}]'.format(metadataURL))
+                self.logger.debug('Error : [{}]'.format(e))
+
+        rowFormat = '{:<25}{}'
+        print(rowFormat.format('Version', 'Local'))
+        for version in sorted(remoteVersions, key=lambda x: Version.parse(x)):
+            print(rowFormat.format(version, '*' if self.hasVersion(version) else ''))
 
     def getVersionBaseName(self, version):
         if version.endswith('-SNAPSHOT') or Version.parse(version) >= self.migrationVersion:
@@ -42,10 +90,71 @@ class VersionManager:
     def getDirectoryPath(self, version):
         return os.path.abspath('{}/{}'.format(Environment.dataDir, self.getVersionBaseName(version)))
 
+    def getManifestPath(self, version):
+        return os.path.abspath('{}/{}.manifest.json'.format(Environment.dataDir, self.getVersionBaseName(version)))
+
+    # Get the manifest of the files of the version, None if the version has been extracted before manifests existed
+    def getManifest(self, version):
+        return VersionManifest.load(self.getManifestPath(version))
+
+    def saveManifest(self, version, manifest):
+        manifest.save(self.getManifestPath(version))
+
+    # The stamp of a version changes whenever its files are replaced, None if the version is not extracted
+    def getStamp(self, version):
+        try:
+            return os.stat(self.getManifestPath(version)).st_mtime_ns
+        except OSError:
+            return None
+
+    # Get the ordered list of sources from which versions can be obtained
+    def getArtifactSources(self):
+        sources = [ArtifactSource.create(location, self)
+                   for location in self.configManager.get('artifactSources') or [VersionDownloader.repositoryURL]]
+
+        # The shared cache comes right before the first remote source
+        cache = self.getArtifactCache()
+        if cache is not None:
+            remoteIndexes = [i for i, source in enumerate(sources) if source.isRemote()]
+            sources.insert(remoteIndexes[0] if remoteIndexes else len(sources), cache)
+        return sources
+
+    # Get the shared directory in which downloaded archives are stored for later use, if any
+    def getArtifactCache(self):
+        cacheDir = self.configManager.get('artifactCacheDir')
+        return LocalArtifactSource(cacheDir, self) if cacheDir else None
+
+    # Get the lock serializing the downloads and removals of the given version between xtool processes
+    def getLock(self, version):
+        return FileLock('version-{}'.format(version))
+
     def ensureVersion(self, version):
         if not self.hasVersion(version):
             self.logger.info('Version {} not in the local repository ; downloading it ...'.format(version))
             self.download(version)
+        elif self.cache.isCold(version):
+            with self.getLock(version):
+                # Another process may have extracted the version while we were waiting for the lock
+                if self.cache.isCold(version):
+                    self.cache.thaw(version)
+                    if self.configManager.get('deduplicateVersions'):
+                        self.deduplicateVersion(version)
+
+    # Record that the version has just been used, so that it is the last to be evicted from the versions cache
+    def touch(self, version):
+        with self.configManager.transaction():
+            self.configManager.versionsUsage()[version] = time.time()
+
+    # Evict the least recently used versions if the versions directory is above the configured budget
+    # keptVersions : versions that are about to be used and should not be evicted
+    def trim(self, budget=None, keptVersions=()):
+        budget = parse_size(budget or self.configManager.get('versionsCacheSize'))
+        if budget is None:
+            self.logger.error('No budget given, use --budget or set the versionsCacheSize preference')
+        else:
+            # Consider the versions downloaded by other processes as well
+            self.configManager.reload()
+            self.cache.trim(budget, keptVersions)
 
     def removeVersionArchive(self, version):
         if os.path.exists(self.getArchivePath(version)):
@@ -53,61 +162,207 @@ class VersionManager:
 
     def removeVersionDirectory(self, version):
         if os.path.exists(self.getDirectoryPath(version)):
-            shutil.rmtree(self.getDirectoryPath(version))
+            Trash.discard(self.getDirectoryPath(version))
+        if os.path.exists(self.getManifestPath(version)):
+            os.remove(self.getManifestPath(version))
 
     def remove(self, version):
         self.logger.info('Removing version {} …'.format(version))
-        self.removeVersionArchive(version)
-        self.removeVersionDirectory(version)
-        self.configManager.versions().remove(version)
-        self.configManager.persist()
+        with self.getLock(version):
+            self.removeVersionArchive(version)
+            self.removeVersionDirectory(version)
+            self.cache.removeColdArchive(version)
+            with self.configManager.transaction():
+                if version in self.configManager.versions():
+                    self.configManager.versions().remove(version)
+                self.configManager.versionsUsage().pop(version, None)
+
+    def getExtractor(self):
+        return self.extractor or ArchiveExtractor(self.configManager.get('extractWorkers'))
 
-    def extractVersion(self, version):
+    # Extract the given version, from its archive in the versions directory unless another archive is given
+    # build : the build of the archive, recorded in the version manifest
+    def extractVersion(self, version, archivePath=None, build=None):
         self.logger.debug('Unzipping version {} in {}'.format(version, Environment.dataDir))
-        zipRef = zipfile.ZipFile(self.getArchivePath(version), 'r')
-        zipRef.extractall(Environment.dataDir)
-        zipRef.close()
+        archivePath = archivePath or self.getArchivePath(version)
+        entries = self.getExtractor().extract([(archivePath, Environment.dataDir)])[archivePath]
+        self.__completeExtraction(version, entries, build)
 
+    def __completeExtraction(self, version, entries, build=None):
+        # Archives created on other systems than Unix do not store the permissions of the execution scripts
+        self.markExecutable(version)
+        self.saveManifest(version, VersionManifest.fromZipEntries(entries, self.getVersionBaseName(version), build))
+        if self.configManager.get('deduplicateVersions'):
+            self.deduplicateVersion(version)
+
+    def markExecutable(self, version):
         versionPath = self.getDirectoryPath(version)
 
         # Mark the execution scripts executable
-        os.chmod('{}/start_xwiki.sh'.format(versionPath), 0o755)
-        os.chmod('{}/start_xwiki_debug.sh'.format(versionPath), 0o755)
-        os.chmod('{}/stop_xwiki.sh'.format(versionPath), 0o755)
+        for script in ['start_xwiki.sh', 'start_xwiki_debug.sh', 'stop_xwiki.sh']:
+            scriptPath = '{}/{}'.format(versionPath, script)
+            if os.path.isfile(scriptPath):
+                os.chmod(scriptPath, 0o755)
 
     def migrateVersions(self):
         # Check if the versions are stored as zip files, if so, unzip them and remove the zip
-        for version in self.configManager.versions():
-            if os.path.exists(self.getArchivePath(version)):
-                if not os.path.exists(self.getDirectoryPath(version)):
-                    self.extractVersion(version)
-                self.removeVersionArchive(version)
+        legacyVersions = [v for v in self.configManager.versions() if os.path.exists(self.getArchivePath(v))]
+        versionsToExtract = [v for v in legacyVersions if not os.path.exists(self.getDirectoryPath(v))]
+
+        # Extract all the archives at once, so that their entries are spread over the same worker processes
+        if versionsToExtract:
+            self.logger.info('Extracting {} versions ...'.format(len(versionsToExtract)))
+            archiveEntries = self.getExtractor().extract([(self.getArchivePath(v), Environment.dataDir)
+                                                          for v in versionsToExtract])
+            for version in versionsToExtract:
+                self.__completeExtraction(version, archiveEntries[self.getArchivePath(version)])
+
+        for version in legacyVersions:
+            self.removeVersionArchive(version)
+
+    # Hard link the files of the given version that are identical to files of the other versions
+    # Opt-in through the deduplicateVersions preference : a file written in place by any instance sharing its inode
+    # would change in every deduplicated version
+    def deduplicateVersion(self, version):
+        otherPaths = [self.getDirectoryPath(v) for v in self.configManager.versions()
+                      if v != version and self.isExtracted(v)]
+        linkedFiles, reclaimedBytes = ContentStore().deduplicate([self.getDirectoryPath(version)], otherPaths)
+        self.logger.debug('Version {} : {} files linked, {} bytes reclaimed'
+                          .format(version, linkedFiles, reclaimedBytes))
+
+    # Hard link identical files across all the versions
+    def dedupe(self):
+        versionPaths = [self.getDirectoryPath(v) for v in self.configManager.versions()
+                        if os.path.isdir(self.getDirectoryPath(v))]
+        self.logger.info('Deduplicating {} versions ...'.format(len(versionPaths)))
+        linkedFiles, reclaimedBytes = ContentStore().deduplicate(versionPaths)
+        self.logger.info('{} files linked, {:.1f} MiB reclaimed'.format(linkedFiles, reclaimedBytes / (1024 * 1024)))
 
     def hasVersion(self, version):
         return version in self.configManager.versions()
 
-    def download(self, version):
-        # First, check that we have a version already registered
-        self.logger.debug('Downloading version : {}'.format(version))
-        self.logger.debug('Downloaded versions : {}'.format(self.configManager.versions()))
-        if version in self.configManager.versions():
-            self.logger.info('The version {} is already downloaded, skipping.'.format(version))
-        else:
-            if (version.endswith('-SNAPSHOT')):
-                downloadSuccessful = SnapshotVersionDownloader(version, self).download()
+    # Whether the version has been completely extracted, the manifest being written once all the files are there
+    def isExtracted(self, version):
+        return os.path.isdir(self.getDirectoryPath(version)) and os.path.isfile(self.getManifestPath(version))
+
+    # Mark the version as present in the versions repository
+    def register(self, version):
+        with self.configManager.transaction():
+            if version not in self.configManager.versions():
+                self.configManager.versions().append(version)
+            self.touch(version)
+
+    # Download and extract the given version
+    # Concurrent downloads of a same version, including from other xtool processes, wait for the first one to
+    # complete and reuse its result.
+    # register : whether the version should be registered in the configuration right away
+    # progressPosition : the line on which the progress bar should be displayed
+    # Returns True if the version is available once the method returns
+    def download(self, version, register=True, progressPosition=None):
+        with self.getLock(version):
+            # Another process may have downloaded the version while we were waiting for the lock
+            self.configManager.reload()
+
+            # First, check that we have a version already registered
+            self.logger.debug('Downloading version : {}'.format(version))
+            self.logger.debug('Downloaded versions : {}'.format(self.configManager.versions()))
+            if version in self.configManager.versions():
+                self.logger.info('The version {} is already downloaded, skipping.'.format(version))
+                return True
+
+            downloadSuccessful = False
+            if self.isExtracted(version):
+                self.logger.info('The version {} has been extracted by another process, reusing it.'.format(version))
+                downloadSuccessful = True
             else:
-                # Use the standard version downloader
-                downloadSuccessful = VersionDownloader(version, self).download()
+                # Try each source in order, only falling back to the next one if the version could not be found
+                for source in self.getArtifactSources():
+                    self.logger.debug('Trying artifact source [{}]'.format(source.location))
+                    try:
+                        if source.install(version, progressPosition):
+                            downloadSuccessful = True
+                            break
+                    except (zipfile.BadZipFile, OSError) as e:
+                        self.logger.warning('Failed to install version {} from [{}] : {}'
+                                            .format(version, source.location, e))
+                        # Do not leave a partial extraction behind for the next source
+                        self.removeVersionDirectory(version)
 
-            if downloadSuccessful:
-                # Unzip the version
-                self.extractVersion(version)
-                self.removeVersionArchive(version)
+            if downloadSuccessful and register:
+                self.register(version)
 
-                # Mark the instance as present in the instance repository
-                self.configManager.versions().append(version)
-                self.configManager.persist()
-                self.logger.info('Version {} successfully downloaded!'.format(version))
+        if downloadSuccessful:
+            if register:
+                self.__trimIfNeeded([version])
+            self.logger.info('Version {} successfully downloaded!'.format(version))
+        return downloadSuccessful
+
+    def __trimIfNeeded(self, keptVersions):
+        if self.configManager.get('versionsCacheSize'):
+            self.trim(keptVersions=keptVersions)
+
+    # Download several versions concurrently, a failure on one version does not prevent the others from being
+    # downloaded
+    def downloadAll(self, versions, workers=None):
+        versions = list(dict.fromkeys(versions))
+        if len(versions) == 1:
+            self.download(versions[0])
+            return
+
+        workers = min(len(versions), int(workers or self.configManager.get('parallelDownloads') or 1))
+        # Each running download gets its own progress line, below the overall progress bar
+        freePositions = queue.Queue()
+        for position in range(1, workers + 1):
+            freePositions.put(position)
+
+        def downloadVersion(version):
+            position = freePositions.get()
+            try:
+                return self.download(version, register=False, progressPosition=position)
+            finally:
+                freePositions.put(position)
+
+        failedVersions = []
+        downloadedVersions = []
+        # The downloads share the worker processes extracting their archives
+        with tqdm(total=len(versions), desc='Versions', unit='version', position=0) as overallProgress, \
+                self.getExtractor() as self.extractor:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(downloadVersion, version): version for version in versions}
+                for future in as_completed(futures):
+                    version = futures[future]
+                    try:
+                        if future.result():
+                            downloadedVersions.append(version)
+                        else:
+                            failedVersions.append(version)
+                    except Exception as e:
+                        self.logger.error('Failed to download version {} : {}'.format(version, e))
+                        failedVersions.append(version)
+                    overallProgress.update(1)
+        self.extractor = None
+
+        # Save the configuration only once all the downloads are done
+        with self.configManager.transaction():
+            for version in downloadedVersions:
+                self.register(version)
+        self.__trimIfNeeded(downloadedVersions)
+
+        self.logger.info('{} out of {} versions downloaded'
+                         .format(len(versions) - len(failedVersions), len(versions)))
+        for version in failedVersions:
+            self.logger.error('Version {} could not be downloaded'.format(version))
+
+    # Update a SNAPSHOT version to its latest build, only fetching the files that changed
+    def update(self, version):
+        if not version.endswith('-SNAPSHOT'):
+            self.logger.error('Only SNAPSHOT versions can be updated')
+        elif not self.hasVersion(version):
+            self.logger.info('Version {} not in the local repository ; downloading it ...'.format(version))
+            self.download(version)
+        else:
+            with self.getLock(version):
+                SnapshotUpdater(self).update(version)
 
     def prune(self):
         unusedVersions = self.configManager.versions()[:]
@@ -0,0 +1,89 @@
+import fnmatch
+import json
+import logging
+import os
+import zlib
+
+
+class VersionManifest:
+    """
+    List of the files of an extracted version, with their size and CRC32 as recorded in the distribution archive.
+    The manifest is written when a version is extracted, and allows to know which files of the version changed
+    without reading them. It also records which files are mutable, that is, which files an instance of the version
+    may modify : the other files can be shared between the version and its instances.
+    """
+
+    logger = logging.getLogger('VersionManifest')
+
+    # Files matching one of these patterns, either by their relative path or by their name, are mutable
+    # The configuration files of the webapp and of Jetty are edited in place, by the users or by a snapshot restore
+    # The start scripts resolve their own symlinks to find the directory to run from, so they are never shared
+    mutablePatterns = ['data/*', 'logs/*', '*.properties', 'hibernate.cfg.xml', '*.sh',
+                       '*/WEB-INF/*.xml', '*/WEB-INF/*.ini', '*/WEB-INF/*.cfg', '*/WEB-INF/*.conf',
+                       'jetty/*.xml', 'jetty/*.ini', 'jetty/*.cfg', 'jetty/*.conf']
+
+    # files : a dict of relative path -> [size, crc32]
+    # build : the build of the archive the files come from (the timestamped version of a snapshot)
+    # mutableFiles : the relative paths of the mutable files, in addition to the files matching the mutable patterns
+    def __init__(self, files=None, build=None, mutableFiles=None):
+        self.files = files if files is not None else {}
+        self.build = build
+        # The patterns are applied again to the manifests saved before they were extended
+        self.mutableFiles = set(mutableFiles or []) | set(f for f in self.files.keys() if self.matchesMutablePattern(f))
+
+    @staticmethod
+    def matchesMutablePattern(path):
+        return any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(os.path.basename(path), p)
+                   for p in VersionManifest.mutablePatterns)
+
+    # Whether the given file is part of the version and never modified by the instances
+    def isImmutable(self, path):
+        return path in self.files and path not in self.mutableFiles
+
+    # Create a manifest from the entries of a zip archive, relative to the given top level directory
+    @staticmethod
+    def fromZipEntries(entries, archiveDirName, build=None):
+        prefix = '{}/'.format(archiveDirName)
+        files = {}
+        for entry in entries:
+            if entry.filename.startswith(prefix) and not entry.filename.endswith('/'):
+                files[entry.filename[len(prefix):]] = [entry.file_size, entry.CRC]
+        return VersionManifest(files, build)
+
+    # Create a manifest by reading the files of an extracted version
+    @staticmethod
+    def fromDirectory(directoryPath, build=None):
+        files = {}
+        for root, dirs, fileNames in os.walk(directoryPath):
+            for fileName in fileNames:
+                path = os.path.join(root, fileName)
+                if os.path.islink(path):
+                    continue
+                crc = 0
+                with open(path, 'rb') as f:
+                    while True:
+                        data = f.read(1024 * 1024)
+                        if not data:
+                            break
+                        crc = zlib.crc32(data, crc)
+                files[os.path.relpath(path, directoryPath)] = [os.path.getsize(path), crc]
+        return VersionManifest(files, build)
+
+    @staticmethod
+    def load(path):
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'r') as manifestFile:
+                content = json.load(manifestFile)
+            return VersionManifest(content['files'], content.get('build'), content.get('mutable'))
+        except (OSError, ValueError, KeyError) as e:
+            VersionManifest.logger.debug('Ignoring invalid manifest [{}] : {}'.format(path, e))
+            return None
+
+    def save(self, path):
+        temporaryPath = '{}.tmp'.format(path)
+        with open(temporaryPath, 'w') as manifestFile:
+            json.dump({'build': self.build, 'files': self.files, 'mutable': sorted(self.mutableFiles)},
+                      manifestFile)
+        os.replace(temporaryPath, path)
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.error
+import xml.etree.ElementTree as ET
+
+from environment import Environment
+
+
+class MetadataCache:
+    """
+    On-disk cache of Maven metadata files (maven-metadata.xml).
+    Cached entries younger than the configured TTL are used without any request ; older entries are revalidated
+    with a conditional request (ETag / Last-Modified) so that an unchanged file only costs a 304 response.
+    If the repository cannot be reached, the last known content is used.
+    """
+
+    logger = logging.getLogger('MetadataCache')
+
+    def __init__(self, httpClient, ttl=0):
+        self.httpClient = httpClient
+        self.ttl = ttl
+        self.cacheDir = os.path.join(Environment.cacheDir, 'metadata')
+
+    def __entryPaths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cacheDir, '{}.xml'.format(key)), os.path.join(self.cacheDir, '{}.json'.format(key))
+
+    def __loadEntry(self, url):
+        contentPath, infoPath = self.__entryPaths(url)
+        if not (os.path.isfile(contentPath) and os.path.isfile(infoPath)):
+            return None, None
+        try:
+            with open(infoPath, 'r') as infoFile:
+                info = json.load(infoFile)
+            with open(contentPath, 'rb') as contentFile:
+                return contentFile.read(), info
+        except (OSError, ValueError) as e:
+            self.logger.debug('Ignoring corrupted cache entry for [{}] : {}'.format(url, e))
+            return None, None
+
+    def __saveEntry(self, url, content, info):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        contentPath, infoPath = self.__entryPaths(url)
+        for path, data in [(contentPath, content), (infoPath, json.dumps(info).encode('utf-8'))]:
+            temporaryPath = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporaryPath, 'wb') as temporaryFile:
+                temporaryFile.write(data)
+            os.replace(temporaryPath, path)
+
+    """
+    Get the content of the metadata file at the given URL.
+    @param maxAge : overrides the TTL of the cache, 0 forces a revalidation
+    """
+    def get(self, url, maxAge=None):
+        maxAge = self.ttl if maxAge is None else maxAge
+        content, info = self.__loadEntry(url)
+
+        if content is not None and time.time() - info['fetched'] < maxAge:
+            self.logger.debug('Using cached metadata for [{}]'.format(url))
+            return content
+
+        headers = {}
+        if content is not None:
+            if info.get('etag'):
+                headers['If-None-Match'] = info['etag']
+            if info.get('last-modified'):
+                headers['If-Modified-Since'] = info['last-modified']
+
+        try:
+            with self.httpClient.open(url, headers=headers) as response:
+                body = response.read()
+                if response.status == 304 and content is not None:
+                    self.logger.debug('Cached metadata for [{}] is still valid'.format(url))
+                    info['fetched'] = time.time()
+                    self.__saveEntry(url, content, info)
+                    return content
+
+                self.logger.debug('Fetched new metadata for [{}]'.format(url))
+                self.__saveEntry(url, body, {
+                    'url': url,
+                    'etag': response.getheader('ETag'),
+                    'last-modified': response.getheader('Last-Modified'),
+                    'fetched': time.time()
+                })
+                return body
+        except urllib.error.URLError as e:
+            if content is None or isinstance(e, urllib.error.HTTPError):
+                raise
+            self.logger.warning('Unable to reach [{}], using cached metadata : {}'.format(url, e))
+            return content
+
+    # Return the list of versions listed in an artifact-level metadata file
+    def getVersions(self, url, maxAge=None):
+        metadataRoot = ET.fromstring(self.get(url, maxAge))
+        return [v.text for v in metadataRoot.findall('./versioning/versions/version')]
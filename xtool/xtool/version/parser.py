@@ -18,12 +18,63 @@ class VersionParser(Parser):
         # Start by adding actions that are top-level (incidentally, the most used)
         # Download action
         downloadParser = subParsers.add_parser('download', aliases=['d'], help='download a new version')
-        downloadParser.add_argument('version', help='the XWiki version to download')
+        downloadParser.add_argument('version', nargs='+', help='the XWiki versions to download')
+        downloadParser.add_argument(
+            '-w', '--workers',
+            type=int,
+            help='the maximum number of versions to download at the same time'
+        )
 
         if not topLevel:
+            # List action
+            listParser = subParsers.add_parser('list', aliases=['l'], help='list versions')
+            listParser.add_argument(
+                '-r', '--remote',
+                action='store_true',
+                help='list the versions available in the remote repository instead of the downloaded ones'
+            )
+            listParser.add_argument(
+                '-s', '--snapshots',
+                action='store_true',
+                help='include SNAPSHOT versions when listing remote versions'
+            )
+            # Update action
+            updateParser = subParsers.add_parser(
+                'update',
+                aliases=['u'],
+                help='update a SNAPSHOT version to its latest build, only downloading the files that changed'
+            )
+            updateParser.add_argument('version', help='the SNAPSHOT version to update')
             # Remove action
             removeParser = subParsers.add_parser('remove', aliases=['r'], help='remove a version')
             removeParser.add_argument('version', help='the XWiki version to remove')
+            # Dedupe action
+            subParsers.add_parser('dedupe', help='hard link the files that are identical across versions')
+            # Trim action
+            trimParser = subParsers.add_parser(
+                'trim',
+                help=('evict the least recently used versions until the versions fit in the configured budget : '
+                      'unused versions are removed, the others are compressed until they are needed again')
+            )
+            trimParser.add_argument('-b', '--budget', help='the size budget (for example 20G), '
+                                                           'defaults to the versionsCacheSize preference')
+            # Seed action
+            seedParser = subParsers.add_parser(
+                'seed',
+                help=('capture the data directory of an initialized instance of the version, which is then copied '
+                      'into new instances (see `x create --seeded`), list the seeded versions if no version is given')
+            )
+            seedParser.add_argument('version', nargs='?', default=None, help='the XWiki version to seed')
+            seedParser.add_argument(
+                '-f', '--from',
+                dest='from_instance',
+                help=('capture the data of this stopped instance, initialized by hand, instead of starting a '
+                      'temporary instance')
+            )
+            seedParser.add_argument('--timeout', type=int, default=900,
+                                    help='the maximum number of seconds to wait for the temporary instance to be '
+                                         'initialized')
+            seedParser.add_argument('-r', '--remove', action='store_true', help='remove the seed of the version')
             # Prune action
             subParsers.add_parser('prune', aliases=['p'], help='remove any version that is not used by an instance')
 
@@ -32,8 +83,29 @@ class VersionParser(Parser):
     """
     def handleArgs(self, args, action):
         if action in ['download', 'd']:
-            self.versionManager.download(args.version)
+            self.versionManager.downloadAll(args.version, args.workers)
+        elif action in ['list', 'l']:
+            if args.remote:
+                self.versionManager.listRemote(args.snapshots)
+            else:
+                self.versionManager.list()
+        elif action in ['update', 'u']:
+            self.versionManager.update(args.version)
+            # Recycle the pooled instances of the previous build
+            if args.version in self.instanceManager.pool.getSizes():
+                self.instanceManager.pool.fillInBackground([args.version])
         elif action in ['remove', 'r']:
             self.versionManager.remove(args.version)
+        elif action == 'seed':
+            if args.version is None:
+                self.instanceManager.seeds.list()
+            elif args.remove:
+                self.instanceManager.seeds.remove(args.version)
+            else:
+                self.instanceManager.seeds.seed(args.version, args.from_instance, args.timeout)
+        elif action == 'dedupe':
+            self.versionManager.dedupe()
+        elif action == 'trim':
+            self.versionManager.trim(args.budget)
         elif action in ['prune', 'p']:
             self.versionManager.prune()
@@ -0,0 +1,82 @@
+import io
+import logging
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file backed by HTTP range requests, so that a remote zip archive can be opened with
+    zipfile.ZipFile without being downloaded : only the central directory and the entries that are actually read
+    are transferred.
+    Reads are served from a buffer holding the last fetched range ; the buffer can be filled ahead of time with
+    load() to fetch several neighbouring entries in a single request.
+    """
+
+    logger = logging.getLogger('HttpRangeFile')
+
+    readAheadSize = 1024 * 1024
+
+    def __init__(self, httpClient, url, progress=None):
+        super().__init__()
+        self.httpClient = httpClient
+        self.url = url
+        self.progress = progress
+        self.position = 0
+        self.bufferStart = 0
+        self.buffer = b''
+        self.fetchedBytes = 0
+
+        with self.httpClient.open(self.url, method='HEAD') as response:
+            if response.getheader('Accept-Ranges', '').lower() != 'bytes' or not response.getheader('Content-Length'):
+                raise IOError('The server does not support range requests for [{}]'.format(url))
+            self.size = int(response.getheader('Content-Length'))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    # Fetch the bytes between start (included) and end (excluded) in the read buffer
+    def load(self, start, end):
+        end = min(end, self.size)
+        if start >= end:
+            return
+        self.logger.debug('Fetching bytes {}-{} of [{}]'.format(start, end - 1, self.url))
+        with self.httpClient.open(self.url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)}) as response:
+            if response.status != 206:
+                raise IOError('Server ignored the range request for [{}]'.format(self.url))
+            data = response.read()
+        if len(data) != end - start:
+            raise IOError('Incomplete range received for [{}]'.format(self.url))
+
+        self.bufferStart = start
+        self.buffer = data
+        self.fetchedBytes += len(data)
+        if self.progress is not None:
+            self.progress.update(len(data))
+
+    def readinto(self, target):
+        length = min(len(target), self.size - self.position)
+        if length <= 0:
+            return 0
+
+        bufferEnd = self.bufferStart + len(self.buffer)
+        if not (self.bufferStart <= self.position and self.position + length <= bufferEnd):
+            self.load(self.position, self.position + max(length, self.readAheadSize))
+
+        offset = self.position - self.bufferStart
+        target[:length] = self.buffer[offset:offset + length]
+        self.position += length
+        return length
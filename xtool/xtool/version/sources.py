@@ -0,0 +1,170 @@
+import logging
+import os
+import shutil
+import urllib.parse
+import zipfile
+
+from utils import compute_checksum
+
+from version.downloaders import VersionDownloader
+from version.downloaders import SnapshotVersionDownloader
+
+
+class ArtifactSource:
+    """
+    A location from which the distribution archive of a version can be obtained.
+    Sources are configured through the artifactSources preference, as an ordered list of Maven repository roots :
+    local paths (such as ~/.m2/repository) or file:// URLs are read in place, http(s):// URLs are downloaded.
+    In both cases, {category} is replaced by either releases or snapshots ; local sources only provide releases.
+    """
+
+    def __init__(self, location, versionManager):
+        self.location = location
+        self.versionManager = versionManager
+
+    @staticmethod
+    def create(location, versionManager):
+        if location.startswith('http://') or location.startswith('https://'):
+            return RemoteArtifactSource(location, versionManager)
+        else:
+            return LocalArtifactSource(location, versionManager)
+
+    def isRemote(self):
+        return False
+
+    """
+    Install the given version from this source in the versions directory.
+    Returns True if the version could be installed, False if the source does not provide it.
+    """
+    def install(self, version, progressPosition=None):
+        raise NotImplementedError("Please implement this method")
+
+
+class LocalArtifactSource(ArtifactSource):
+    """
+    A Maven repository available on the file system, such as the local Maven repository or a mirror on a shared
+    drive. Archives are extracted directly from the repository, without being copied first.
+    Only released versions are taken from local repositories : a SNAPSHOT left there by an old build would
+    otherwise win over the newer builds of the remote repositories.
+    """
+
+    logger = logging.getLogger('LocalArtifactSource')
+
+    def __init__(self, location, versionManager):
+        super().__init__(location, versionManager)
+        if location.startswith('file://'):
+            location = urllib.parse.unquote(urllib.parse.urlsplit(location).path)
+        self.rootPath = os.path.expanduser(location)
+
+    # Paths are joined rather than formatted, a local path may contain braces
+    def __getFolderPath(self, version):
+        platform = self.versionManager.getVersionBaseName(version).startswith('xwiki-platform')
+        artifactPath = (VersionDownloader.platformArtifactPath if platform
+                        else VersionDownloader.enterpriseArtifactPath)
+        return os.path.join(self.rootPath.replace('{category}', 'releases'), *artifactPath.split('/'), version)
+
+    # Verify the archive against the first checksum sidecar available next to it
+    def __verify(self, archivePath):
+        for algorithm in VersionDownloader.checksumAlgorithms:
+            checksumPath = '{}.{}'.format(archivePath, algorithm)
+            if os.path.isfile(checksumPath):
+                with open(checksumPath, 'r') as checksumFile:
+                    expectedChecksum = checksumFile.read().split()[0].strip().lower()
+                actualChecksum = compute_checksum(archivePath, algorithm)
+                self.logger.debug('EXPECTED : {}'.format(expectedChecksum))
+                self.logger.debug('ACTUAL   : {}'.format(actualChecksum))
+                return actualChecksum == expectedChecksum
+
+        # Artifacts built and installed locally come without any checksum, check the CRC of each entry instead
+        self.logger.debug('No checksum available for [{}], checking the CRC of its entries'.format(archivePath))
+        try:
+            with zipfile.ZipFile(archivePath, 'r') as archive:
+                corruptedEntry = archive.testzip()
+        except (zipfile.BadZipFile, OSError) as e:
+            self.logger.warning('The archive [{}] is invalid : {}'.format(archivePath, e))
+            return False
+        if corruptedEntry is not None:
+            self.logger.warning('The entry [{}] of [{}] is corrupted'.format(corruptedEntry, archivePath))
+            return False
+        return True
+
+    def install(self, version, progressPosition=None):
+        if version.endswith('-SNAPSHOT'):
+            self.logger.debug('Skipping [{}] for SNAPSHOT version {}'.format(self.location, version))
+            return False
+
+        archivePath = os.path.join(self.__getFolderPath(version),
+                                   '{}.zip'.format(self.versionManager.getVersionBaseName(version)))
+        self.logger.debug('Looking for [{}]'.format(archivePath))
+        if os.path.isfile(archivePath):
+            if self.__verify(archivePath):
+                self.logger.info('Extracting version {} from [{}] ...'.format(version, archivePath))
+                self.versionManager.extractVersion(version, archivePath)
+                return True
+            else:
+                self.logger.warning('The control sum of [{}] is invalid, skipping it.'.format(archivePath))
+        return False
+
+    """
+    Store a released archive in the repository, so that it can be reused by other users of the repository.
+    @param checksum : a tuple (algorithm, hexdigest) to store next to the archive
+    """
+    def store(self, version, archivePath, checksum):
+        folderPath = self.__getFolderPath(version)
+        targetPath = os.path.join(folderPath, os.path.basename(archivePath))
+        if os.path.exists(targetPath):
+            return
+
+        self.logger.debug('Storing [{}] in [{}]'.format(archivePath, folderPath))
+        try:
+            os.makedirs(folderPath, exist_ok=True)
+            # Copy under a temporary name first so that other users never see a partial archive
+            temporaryPath = '{}.{}.tmp'.format(targetPath, os.getpid())
+            shutil.copyfile(archivePath, temporaryPath)
+            if checksum is not None:
+                with open('{}.{}'.format(targetPath, checksum[0]), 'w') as checksumFile:
+                    checksumFile.write(checksum[1])
+            os.replace(temporaryPath, targetPath)
+        except OSError as e:
+            self.logger.warning('Failed to store version {} in [{}] : {}'.format(version, self.rootPath, e))
+
+
+class RemoteArtifactSource(ArtifactSource):
+    """
+    A remote Maven repository, such as maven.xwiki.org or an internal Nexus.
+    """
+
+    logger = logging.getLogger('RemoteArtifactSource')
+
+    def isRemote(self):
+        return True
+
+    def install(self, version, progressPosition=None):
+        if version.endswith('-SNAPSHOT'):
+            downloader = SnapshotVersionDownloader(version, self.versionManager, progressPosition, self.location)
+            if downloader.getBuild() is None:
+                return False
+        else:
+            # Use the standard version downloader
+            downloader = VersionDownloader(version, self.versionManager,
+                                           progressPosition=progressPosition, repositoryURL=self.location)
+
+        if self.versionManager.configManager.get('streamingInstall'):
+            # Extract the archive while it is downloaded, without keeping it on disk
+            if not downloader.install():
+                return False
+            self.versionManager.markExecutable(version)
+            if self.versionManager.configManager.get('deduplicateVersions'):
+                self.versionManager.deduplicateVersion(version)
+        else:
+            if not downloader.download():
+                return False
+            # Unzip the version
+            self.versionManager.extractVersion(version, build=downloader.getBuild())
+
+            # Keep released archives in the shared cache, snapshots would get stale
+            cache = self.versionManager.getArtifactCache()
+            if cache is not None and not version.endswith('-SNAPSHOT'):
+                cache.store(version, self.versionManager.getArchivePath(version), downloader.checksum)
+            self.versionManager.removeVersionArchive(version)
+        return True
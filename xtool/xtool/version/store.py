@@ -0,0 +1,87 @@
+import logging
+import os
+import stat
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from fingerprint import FingerprintCache
+from locking import FileLock
+
+
+class ContentStore:
+    """
+    Deduplicate identical files across the extracted versions by replacing them with hard links to a single copy.
+    Files are identified by their content digest, size and permissions. Only the files having the same size and
+    permissions as another file are hashed, and their digests come from the fingerprint cache : a file that did not
+    change since it was last hashed, for instance a file of a version deduplicated before, is not read again.
+    """
+
+    logger = logging.getLogger('ContentStore')
+
+    hashWorkers = 4
+
+    # List the regular files of the given directories, as a dict path -> stat
+    @staticmethod
+    def __listFiles(directoryPaths):
+        files = {}
+        for directoryPath in directoryPaths:
+            for root, dirs, fileNames in os.walk(directoryPath):
+                for fileName in fileNames:
+                    path = os.path.join(root, fileName)
+                    fileStat = os.lstat(path)
+                    # Empty files and symlinks are not worth linking
+                    if stat.S_ISREG(fileStat.st_mode) and fileStat.st_size > 0:
+                        files[path] = fileStat
+        return files
+
+    # Files can only be linked on the same device, and only share their permissions once linked
+    @staticmethod
+    def __shape(fileStat):
+        return fileStat.st_dev, fileStat.st_size, fileStat.st_mode
+
+    """
+    Replace the files of the given directories that are identical to a file of the reference directories (or to
+    another file of the given directories) by a hard link.
+    @param referencePaths : directories whose files are kept as they are, such as the other versions
+    Returns a tuple (number of linked files, number of bytes reclaimed)
+    """
+    def deduplicate(self, directoryPaths, referencePaths=()):
+        # Two processes deduplicating at the same time could link a file to a copy the other one is replacing
+        with FileLock('content-store'):
+            return self.__deduplicate(directoryPaths, referencePaths)
+
+    def __deduplicate(self, directoryPaths, referencePaths):
+        files = self.__listFiles(directoryPaths)
+        references = {p: s for p, s in self.__listFiles(referencePaths).items() if p not in files}
+
+        # Only the files that may have an identical copy are hashed
+        shapes = Counter(self.__shape(s) for s in list(files.values()) + list(references.values()))
+        fileShapes = set(self.__shape(s) for s in files.values())
+        candidates = ([p for p in sorted(references.keys()) if self.__shape(references[p]) in fileShapes]
+                      + [p for p in sorted(files.keys()) if shapes[self.__shape(files[p])] > 1])
+        stats = dict(references, **files)
+
+        self.logger.debug('Hashing {} files out of {}'.format(len(candidates), len(files)))
+        fingerprints = FingerprintCache.get()
+        with ThreadPoolExecutor(max_workers=self.hashWorkers) as executor:
+            digests = list(executor.map(lambda p: fingerprints.digest(p, 'sha256'), candidates))
+
+        # The references come first, so that they are the copies the other files are linked to
+        canonicalPaths = {}
+        linkedFiles = 0
+        reclaimedBytes = 0
+        for path, digest in zip(candidates, digests):
+            fileStat = stats[path]
+            key = self.__shape(fileStat) + (digest,)
+            canonicalPath = canonicalPaths.setdefault(key, path)
+            if canonicalPath == path or path in references:
+                continue
+            if stats[canonicalPath].st_ino != fileStat.st_ino:
+                self.logger.debug('Linking [{}] to [{}]'.format(path, canonicalPath))
+                temporaryPath = '{}.xtool-link'.format(path)
+                os.link(canonicalPath, temporaryPath)
+                if fileStat.st_nlink == 1:
+                    reclaimedBytes += fileStat.st_size
+                os.replace(temporaryPath, path)
+                linkedFiles += 1
+        return linkedFiles, reclaimedBytes
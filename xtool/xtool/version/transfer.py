@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TransferError(urllib.error.URLError):
+    """
+    Raised when a remote file could not be completely downloaded, once the retries are exhausted.
+    """
+    pass
+
+
+class RangeDownloader:
+    """
+    Download a remote file by splitting it into byte ranges that are fetched in parallel and written
+    directly at their offset in a preallocated file.
+    Connections are kept alive between the ranges fetched by a same worker.
+    The list of completed ranges is kept in a state file next to the partial download, so that an interrupted
+    download can be resumed instead of being started over.
+    If the server does not support range requests, the file is downloaded as a single stream.
+    """
+
+    logger = logging.getLogger('RangeDownloader')
+
+    chunkSize = 8 * 1024 * 1024
+    bufferSize = 256 * 1024
+    maxRetries = 3
+
+    def __init__(self, httpClient, url, destinationPath, workers=4):
+        self.httpClient = httpClient
+        self.url = url
+        self.destinationPath = destinationPath
+        self.partialPath = '{}.part'.format(destinationPath)
+        self.statePath = '{}.part.json'.format(destinationPath)
+        self.workers = max(1, workers)
+
+        self.stateLock = threading.Lock()
+        self.progressLock = threading.Lock()
+
+    def __probe(self):
+        with self.httpClient.open(self.url, method='HEAD') as response:
+            size = response.headers.get('Content-Length')
+            return {
+                'url': self.url,
+                'size': int(size) if size is not None else None,
+                'ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes',
+                'etag': response.headers.get('ETag'),
+                'last-modified': response.headers.get('Last-Modified'),
+                'chunk-size': self.chunkSize,
+                'completed': []
+            }
+
+    # Load the state of a previous download, only if it still matches the remote file
+    def __loadState(self, remoteState):
+        if not (os.path.isfile(self.statePath) and os.path.isfile(self.partialPath)):
+            return None
+
+        try:
+            with open(self.statePath, 'r') as stateFile:
+                state = json.load(stateFile)
+        except (OSError, ValueError) as e:
+            self.logger.debug('Ignoring unreadable download state [{}] : {}'.format(self.statePath, e))
+            return None
+
+        for key in ['url', 'size', 'etag', 'last-modified', 'chunk-size']:
+            if state.get(key) != remoteState[key]:
+                self.logger.debug('Remote file changed since the last attempt ({}), restarting download'.format(key))
+                return None
+        return state
+
+    def __saveState(self, state):
+        temporaryPath = '{}.tmp'.format(self.statePath)
+        with open(temporaryPath, 'w') as stateFile:
+            json.dump(state, stateFile)
+        os.replace(temporaryPath, self.statePath)
+
+    # Whether a later attempt can resume the download instead of starting over
+    def isResumable(self):
+        try:
+            with open(self.statePath, 'r') as stateFile:
+                return bool(json.load(stateFile)['completed'])
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def __clearState(self):
+        for path in [self.statePath, self.partialPath]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __preallocate(self, size):
+        with open(self.partialPath, 'wb') as partialFile:
+            if hasattr(os, 'posix_fallocate') and size > 0:
+                try:
+                    os.posix_fallocate(partialFile.fileno(), 0, size)
+                    return
+                except OSError:
+                    # Some file systems (tmpfs on old kernels, NFS) do not support fallocate
+                    pass
+            partialFile.truncate(size)
+
+    def __updateProgress(self, progress, length):
+        if progress is not None:
+            with self.progressLock:
+                progress.update(length)
+
+    def __fetchRange(self, fd, index, size, state, progress):
+        start = index * self.chunkSize
+        end = min(start + self.chunkSize, size) - 1
+
+        for attempt in range(1, self.maxRetries + 1):
+            offset = start
+            try:
+                rangeHeader = {'Range': 'bytes={}-{}'.format(start, end)}
+                with self.httpClient.open(self.url, headers=rangeHeader) as response:
+                    if response.status != 206:
+                        raise TransferError('Server ignored the range request for [{}]'.format(self.url))
+                    while offset <= end:
+                        data = response.read(min(self.bufferSize, end - offset + 1))
+                        if not data:
+                            raise TransferError('Connection closed before the end of range {}-{}'.format(start, end))
+                        os.pwrite(fd, data, offset)
+                        offset += len(data)
+                        self.__updateProgress(progress, len(data))
+                break
+            except (urllib.error.URLError, OSError) as e:
+                # Roll back the progress of the failed attempt, the whole range will be fetched again
+                self.__updateProgress(progress, start - offset)
+                if attempt == self.maxRetries:
+                    raise
+                self.logger.debug('Range {}-{} failed (attempt {}/{}) : {}'
+                                  .format(start, end, attempt, self.maxRetries, e))
+
+        with self.stateLock:
+            state['completed'].append(index)
+            self.__saveState(state)
+
+    def __downloadRanges(self, state, progress):
+        size = state['size']
+        chunkCount = (size + self.chunkSize - 1) // self.chunkSize
+        completed = set(state['completed'])
+        pending = [i for i in range(chunkCount) if i not in completed]
+
+        if progress is not None:
+            progress.total = size
+            progress.update(sum(min(self.chunkSize, size - i * self.chunkSize) for i in completed))
+
+        self.logger.debug('Downloading {} ranges of [{}] with {} workers ({} already completed)'
+                          .format(len(pending), self.url, self.workers, len(completed)))
+
+        fd = os.open(self.partialPath, os.O_WRONLY)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self.__fetchRange, fd, index, size, state, progress) for index in pending]
+                for future in futures:
+                    # Propagate the first error, the state file keeps track of what has been done so far
+                    future.result()
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __downloadStream(self, progress):
+        with self.httpClient.open(self.url) as response:
+            size = response.getheader('Content-Length')
+            if progress is not None and size is not None:
+                progress.total = int(size)
+            with open(self.partialPath, 'wb') as partialFile:
+                while True:
+                    data = response.read(self.bufferSize)
+                    if not data:
+                        break
+                    partialFile.write(data)
+                    self.__updateProgress(progress, len(data))
+
+    """
+    Download the file to its destination path.
+    @param progress : an optional tqdm instance to report the progress of the download
+    """
+    def download(self, progress=None):
+        try:
+            self.__download(progress)
+        except OSError:
+            # Keep the completed ranges for the next attempt, a partial stream is of no use
+            if not self.isResumable():
+                self.__clearState()
+            raise
+
+    def __download(self, progress):
+        remoteState = self.__probe()
+
+        if remoteState['ranges'] and remoteState['size']:
+            state = self.__loadState(remoteState)
+            if state is None:
+                self.__clearState()
+                state = remoteState
+                self.__preallocate(state['size'])
+                self.__saveState(state)
+            else:
+                self.logger.info('Resuming the download of [{}]'.format(self.url))
+            self.__downloadRanges(state, progress)
+        else:
+            self.logger.debug('Server does not support range requests for [{}], using a single stream'
+                              .format(self.url))
+            self.__clearState()
+            self.__downloadStream(progress)
+
+        os.replace(self.partialPath, self.destinationPath)
+        if os.path.exists(self.statePath):
+            os.remove(self.statePath)
@@ -0,0 +1,127 @@
+import logging
+import os
+import stat
+import urllib.error
+import zipfile
+
+from tqdm import tqdm
+
+from version.downloaders import SnapshotVersionDownloader
+from version.manifest import VersionManifest
+from version.remotezip import HttpRangeFile
+
+
+class SnapshotUpdater:
+    """
+    Update an extracted SNAPSHOT version to the latest build available in a remote repository, by only fetching
+    the entries of the new archive that differ from the extracted files.
+    The central directory of the remote archive is read with range requests, its CRCs and sizes are compared to
+    the manifest of the extracted version, and the changed entries are fetched by grouping neighbouring entries in
+    a same request.
+    """
+
+    logger = logging.getLogger('SnapshotUpdater')
+
+    # Entries separated by less than this amount of bytes are fetched in the same request
+    mergeGap = 256 * 1024
+    maxGroupSize = 64 * 1024 * 1024
+
+    def __init__(self, versionManager):
+        self.versionManager = versionManager
+
+    def __groupEntries(self, changedEntries, allEntries, endOffset):
+        # The data of an entry ends where the next entry (or the central directory) starts
+        offsets = sorted(e.header_offset for e in allEntries) + [endOffset]
+        nextOffsets = {offsets[i]: offsets[i + 1] for i in range(len(offsets) - 1)}
+
+        groups = []
+        for entry in sorted(changedEntries, key=lambda e: e.header_offset):
+            start, end = entry.header_offset, nextOffsets[entry.header_offset]
+            if groups and start - groups[-1]['end'] <= self.mergeGap and end - groups[-1]['start'] <= self.maxGroupSize:
+                groups[-1]['end'] = end
+                groups[-1]['entries'].append(entry)
+            else:
+                groups.append({'start': start, 'end': end, 'entries': [entry]})
+        return groups
+
+    def __replaceFile(self, remoteZip, entry, targetPath):
+        os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+        temporaryPath = '{}.xtool-update'.format(targetPath)
+        with remoteZip.open(entry) as source, open(temporaryPath, 'wb') as target:
+            while True:
+                data = source.read(256 * 1024)
+                if not data:
+                    break
+                target.write(data)
+
+        mode = entry.external_attr >> 16
+        if mode and stat.S_ISREG(mode):
+            os.chmod(temporaryPath, stat.S_IMODE(mode))
+        # Replace the file instead of writing into it, so that hard links to the previous content are left untouched
+        os.replace(temporaryPath, targetPath)
+
+    def __applyDelta(self, version, downloadURL, manifest, build):
+        versionPath = self.versionManager.getDirectoryPath(version)
+        archiveDirName = self.versionManager.getVersionBaseName(version)
+
+        with tqdm(unit='B', unit_scale=True, unit_divisor=1024, miniters=1) as t:
+            rangeFile = HttpRangeFile(self.versionManager.httpClient, downloadURL, t)
+            with zipfile.ZipFile(rangeFile) as remoteZip:
+                entries = remoteZip.infolist()
+                remoteManifest = VersionManifest.fromZipEntries(entries, archiveDirName, build)
+
+                prefix = '{}/'.format(archiveDirName)
+                changedEntries = [e for e in entries if e.filename.startswith(prefix) and not e.is_dir()
+                                  and manifest.files.get(e.filename[len(prefix):]) != [e.file_size, e.CRC]]
+                removedFiles = [f for f in manifest.files.keys() if f not in remoteManifest.files]
+                self.logger.info('{} files changed, {} files removed'.format(len(changedEntries), len(removedFiles)))
+
+                t.total = sum(e.compress_size for e in changedEntries) + rangeFile.fetchedBytes
+                for group in self.__groupEntries(changedEntries, entries, remoteZip.start_dir):
+                    rangeFile.load(group['start'], group['end'])
+                    for entry in group['entries']:
+                        self.logger.debug('Updating [{}]'.format(entry.filename))
+                        self.__replaceFile(remoteZip, entry, os.path.join(versionPath, entry.filename[len(prefix):]))
+
+        for removedFile in removedFiles:
+            self.logger.debug('Removing [{}]'.format(removedFile))
+            path = os.path.join(versionPath, removedFile)
+            if os.path.lexists(path):
+                os.remove(path)
+
+        self.versionManager.saveManifest(version, remoteManifest)
+        self.logger.info('Version {} updated to build {}, fetched {} out of {} bytes'
+                         .format(version, build, rangeFile.fetchedBytes, rangeFile.size))
+
+    """
+    Update the given SNAPSHOT version to its latest build.
+    Returns True if the version is up to date once the method returns.
+    """
+    def update(self, version):
+        remoteSources = [s for s in self.versionManager.getArtifactSources() if s.isRemote()]
+        if not remoteSources:
+            self.logger.error('No remote artifact source is configured')
+            return False
+
+        # Always check the metadata of the snapshot, the cached version is likely to be outdated
+        downloader = SnapshotVersionDownloader(version, self.versionManager, repositoryURL=remoteSources[0].location,
+                                               metadataMaxAge=0)
+        if downloader.snapshotVersion is None:
+            return False
+
+        manifest = self.versionManager.getManifest(version)
+        if manifest is None:
+            self.logger.info('No manifest found for version {}, indexing the extracted files ...'.format(version))
+            manifest = VersionManifest.fromDirectory(self.versionManager.getDirectoryPath(version))
+
+        if manifest.build == downloader.snapshotVersion:
+            self.logger.info('Version {} is already up to date ({})'.format(version, manifest.build))
+            return True
+
+        self.logger.info('Updating version {} to build {} ...'.format(version, downloader.snapshotVersion))
+        try:
+            self.__applyDelta(version, downloader._generateDownloadLink('zip'), manifest, downloader.snapshotVersion)
+            return True
+        except (urllib.error.URLError, IOError, zipfile.BadZipFile) as e:
+            self.logger.error('Failed to update version {} : {}'.format(version, e))
+            return False